@@ -1,25 +1,46 @@
+import io
 import os
+import re
+import shutil
+import hashlib
 import logging
 import subprocess
 import sys
 import ctypes
 import socket
-import pyautogui
-from flask import Flask, request, jsonify, render_template, send_from_directory, Blueprint, send_file
+from flask import Flask, request, jsonify, render_template, Blueprint, send_file, g, Response, current_app
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
+from werkzeug.datastructures import FileStorage
+from werkzeug.exceptions import ClientDisconnected
 from PIL import Image
-from converter.image_converter import convert_image, image_to_ico, raster_to_svg, svg_to_raster, text_to_qr, qr_to_text, reduce_image_size
-from converter.video_converter import convert_mp4_to_mp3, gif_to_mp4, mp4_to_gif
+from converter.image_converter import convert_image, image_to_ico, raster_to_svg, svg_to_raster, text_to_qr, qr_to_text, reduce_image_size, pillow_can_convert
+from converter.video_converter import convert_mp4_to_mp3, gif_to_mp4, mp4_to_gif, reduce_video_size, X264_PRESETS
 from converter.document_converter import convert_word_to_pdf
+import json
+import uuid
 import zipfile
 import tempfile
-from converter.archive_converter import archive_files_to_zip
-from converter.audio_converter import mp3_to_wav, wav_to_mp3, m4a_to_mp3, mp3_to_m4a
-from converter.ocr_converter import image_to_text, pdf_to_text
+import threading
+from converter.archive_converter import archive_files_to_zip, extract_zip_to_zip, iter_zip_members, stream_zip
+from converter.audio_converter import mp3_to_wav, wav_to_mp3, m4a_to_mp3, mp3_to_m4a, reduce_audio_size, REDUCE_CODECS
+from converter.ffmpeg_pipe import PIPE_DIRECTIONS, PROBE_SIZE, PrefixedStream, is_streamable, stream_convert
+from converter.ocr_converter import image_to_text, pdf_to_text, iter_pdf_pages, plan_pdf_pages, DEFAULT_LANG, DEFAULT_PSM
+from converter import ocr_converter
 from converter.tts_converter import text_to_mp3, text_to_wav
+from converter import tts_service
 import time
-from converter.yt_downloader import download_yt_mp3, download_yt_mp4, download_yt_playlist_mp3, download_yt_playlist_mp4
+import jobs
+from converter import scheduler
+from converter import progress
+from upload_stream import save_stream_atomic, stream_to_file, throughput_stats
+from result_cache import ResultCache, make_key
+from store import Store
+from upload_index import UploadIndex, SHA256_LENGTH
+import resumable
+from file_serving import serve_file
+from file_index import FolderIndex, format_size
+from converter import yt_downloader
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -27,32 +48,21 @@ logger = logging.getLogger(__name__)
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 UPLOAD_FOLDER = os.path.join(BASE_DIR, 'uploads')
-app = Flask(__name__)
-CORS(app)  # Enable CORS for all routes
-
-# Configure Flask for large file uploads
-app.config['MAX_CONTENT_LENGTH'] = 2 * 1024 * 1024 * 1024  # 2GB max file size
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp', 'mp4', 'avi', 'mov', 'mkv', 'mp3', 'wav', 'flac', 'aac', 'pdf', 'doc', 'docx', 'xls', 'xlsx', 'ppt', 'pptx', 'txt', 'csv', 'json', 'xml', 'zip', 'rar', '7z', 'tar', 'gz'}
-
-if not os.path.exists(app.config['UPLOAD_FOLDER']):
-    os.makedirs(app.config['UPLOAD_FOLDER'])
-
 MOBILE_UPLOADS_FOLDER = os.path.join(BASE_DIR, 'mobile_uploads')
-if not os.path.exists(MOBILE_UPLOADS_FOLDER):
-    os.makedirs(MOBILE_UPLOADS_FOLDER)
-
 SEND_TO_MOBILE_FOLDER = os.path.join(BASE_DIR, 'send_to_mobile')
-if not os.path.exists(SEND_TO_MOBILE_FOLDER):
-    os.makedirs(SEND_TO_MOBILE_FOLDER)
+RESUMABLE_FOLDER = os.path.join(UPLOAD_FOLDER, '.resumable')
+# Latest results and job status, shared by all server processes (see store.py)
+STORE_PATH = os.environ.get('WEB_APP_STORE', os.path.join(UPLOAD_FOLDER, '.state.sqlite3'))
+
+send_to_mobile_index = FolderIndex(SEND_TO_MOBILE_FOLDER)
 
-latest_result = {'text': '', 'filename': ''} 
+main_bp = Blueprint('main', __name__)
 
-@app.route('/')
+@main_bp.route('/')
 def home():
     return "Flask server is running!"
 
-@app.route('/test', methods=['GET'])
+@main_bp.route('/test', methods=['GET'])
 def test_connection():
     """Test endpoint for Android app to verify connection"""
     return jsonify({
@@ -61,12 +71,12 @@ def test_connection():
         'timestamp': time.time()
     })
 
-@app.route('/health', methods=['GET'])
+@main_bp.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     try:
         # Check if upload folders exist
-        web_uploads_ok = os.path.exists(app.config['UPLOAD_FOLDER'])
+        web_uploads_ok = os.path.exists(current_app.config['UPLOAD_FOLDER'])
         mobile_uploads_ok = os.path.exists(MOBILE_UPLOADS_FOLDER)
         
         return jsonify({
@@ -82,7 +92,26 @@ def health_check():
             'timestamp': time.time()
         }), 500
 
-@app.route('/command', methods=['POST'])
+@main_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Runtime counters for the converter pool and caches"""
+    return jsonify({
+        'jobs': {
+            'workers': jobs.MAX_WORKERS,
+            'threads': jobs.THREAD_WORKERS,
+            'pending': jobs.pending_count(),
+        },
+        'conversion_cache': current_app.extensions['result_cache'].stats(),
+        'scheduler': scheduler.get_scheduler().stats(),
+        # Streamed PDF OCR runs in this process; pool workers keep their own counters
+        'ocr': {'engine': ocr_converter.get_engine().name, 'cache': ocr_converter.get_cache().stats()},
+        'tts_cache': tts_service.get_service().cache.stats(),
+        'yt': yt_downloader.get_manager().stats(),
+        'upload_dedupe': current_app.extensions['upload_index'].stats(),
+        'timestamp': time.time()
+    })
+
+@main_bp.route('/command', methods=['POST'])
 def handle_command():
     """Handle commands from Android app"""
     try:
@@ -137,8 +166,9 @@ def handle_command():
         
         elif action == "take_screenshot":
             try:
+                import pyautogui  # needs a desktop session, so only loaded for this command
                 screenshot = pyautogui.screenshot()
-                screenshot_path = os.path.join(app.config['UPLOAD_FOLDER'], "screenshot.png")
+                screenshot_path = os.path.join(current_app.config['UPLOAD_FOLDER'], "screenshot.png")
                 screenshot.save(screenshot_path)
                 return jsonify({"status": "ok", "result": f"Screenshot saved as {screenshot_path}"})
             except Exception as e:
@@ -161,14 +191,51 @@ def allowed_file(filename, source=None):
         return '.' in filename  # Allow any file with an extension
     # For web uploads, use the restricted list
     return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
+           filename.rsplit('.', 1)[1].lower() in current_app.config['ALLOWED_EXTENSIONS']
 
 def dummy_ml_process(image_path):
     # Replace this with your ML code
     # For now, just return the filename as 'recognized text'
     return f"Processed: {os.path.basename(image_path)}"
 
-@app.route('/upload', methods=['POST'])
+def _store():
+    return current_app.extensions['store']
+
+UPLOAD_ID_PATTERN = re.compile(r'^[A-Za-z0-9_\-]{1,64}$')
+RESULT_MAX_WAIT = int(os.environ.get('RESULT_MAX_WAIT', 30))  # seconds a /result long-poll is held
+ALL_CLIENTS = '*'  # client=* asks /result for every client's results (the dashboard)
+
+def _client_id(form=None):
+    """Who is asking: a Client-Id header or client field, else the remote address"""
+    client = request.headers.get('Client-Id') or request.args.get('client') or (form or {}).get('client')
+    return (client or request.remote_addr or 'unknown')[:128]
+
+def _upload_id(upload_id=None):
+    """The client's own Upload-Id, so it can wait for the result before the upload returns, or a new one"""
+    if upload_id is None:
+        upload_id = request.headers.get('Upload-Id', '')
+    return upload_id if UPLOAD_ID_PATTERN.match(upload_id) else uuid.uuid4().hex
+
+def _record_result(filename, result_text, upload_id, form=None):
+    """Store the result for /result; returns the fields to add to the upload's response"""
+    result = _store().add_result(filename, result_text, _client_id(form), upload_id)
+    return {'upload_id': upload_id, 'result_id': result['id'], 'result_url': f"/result?upload_id={upload_id}"}
+
+def _upload_index():
+    return current_app.extensions['upload_index']
+
+def _dedupe_upload(upload_folder, filepath, digest=None):
+    """Index a mobile upload by content; a duplicate becomes a hardlink to the stored copy"""
+    if upload_folder != MOBILE_UPLOADS_FOLDER:
+        return {}
+    try:
+        original = _upload_index().add(filepath, digest)
+    except OSError as e:
+        logger.warning(f"Could not de-duplicate {filepath}: {e}")
+        return {}
+    return {'duplicate_of': os.path.basename(original)} if original else {}
+
+@main_bp.route('/upload', methods=['POST'])
 def upload_file():
     try:
         # Safely get remote address
@@ -182,7 +249,7 @@ def upload_file():
         try:
             # Safely log headers
             try:
-                logger.info(f"Request headers: {dict(request.headers)}")
+                logger.debug(f"Request headers: {dict(request.headers)}")
             except Exception as e:
                 logger.info(f"Could not log headers: {e}")
             
@@ -193,7 +260,7 @@ def upload_file():
             # Check if we can access form data
             try:
                 form_data = dict(request.form)
-                logger.info(f"Request form data: {form_data}")
+                logger.debug(f"Request form data: {form_data}")
                 # Update source from form if available
                 if 'source' in form_data:
                     source = form_data['source']
@@ -238,7 +305,7 @@ def upload_file():
                 if source == 'mobile':
                     upload_folder = MOBILE_UPLOADS_FOLDER
                 else:
-                    upload_folder = app.config['UPLOAD_FOLDER']
+                    upload_folder = current_app.config['UPLOAD_FOLDER']
                 logger.info(f"Upload folder: {upload_folder}")
                 
                 if not os.path.exists(upload_folder):
@@ -251,7 +318,8 @@ def upload_file():
                 # Save file with error handling and progress logging
                 try:
                     start_time = time.time()
-                    file.save(filepath)
+                    # Replaced atomically rather than rewritten, so hardlinked duplicates are left alone
+                    _, digest, _ = save_stream_atomic(file.stream, filepath, fsync=False)
                     end_time = time.time()
                     
                     # Log file save completion
@@ -268,12 +336,12 @@ def upload_file():
                     logger.error(f"Error saving file: {save_error}")
                     return jsonify({'error': f'Failed to save file: {str(save_error)}'}), 500
                 
+                dedupe = _dedupe_upload(upload_folder, filepath, digest)
                 # Run dummy ML
                 result_text = dummy_ml_process(filepath)
-                global latest_result
-                latest_result = {'text': result_text, 'filename': filename}
+                links = _record_result(filename, result_text, _upload_id(), form_data)
                 logger.info(f"Processing complete: {result_text}")
-                return jsonify({'result': result_text}), 200
+                return jsonify({'result': result_text, **links, **dedupe}), 200
             else:
                 logger.info(f"File type not allowed: {file.filename}")
                 return jsonify({'error': f'File type not allowed: {file.filename}'}), 400
@@ -288,51 +356,274 @@ def upload_file():
         traceback.print_exc()
         return jsonify({'error': f'Upload failed: {str(e)}'}), 500
 
-@app.route('/result', methods=['GET'])
+@main_bp.route('/upload/<filename>', methods=['PUT'])
+def upload_file_raw(filename):
+    """
+    Raw upload: the request body is the file itself. It is streamed to disk in
+    large chunks and hashed on the way, skipping multipart parsing and its spool file.
+    """
+    source = request.headers.get('Source') or request.args.get('source') or 'unknown'
+    filename = secure_filename(os.path.basename(filename))
+    if not filename or not allowed_file(filename, source):
+        return jsonify({'error': f'File type not allowed: {filename}'}), 400
+    upload_folder = MOBILE_UPLOADS_FOLDER if source == 'mobile' else current_app.config['UPLOAD_FOLDER']
+    os.makedirs(upload_folder, exist_ok=True)
+    filepath = os.path.join(upload_folder, filename)
+    expected_sha256 = request.headers.get('X-Content-SHA256')
+    try:
+        size, digest, duration = save_stream_atomic(request.stream, filepath, expected_sha256=expected_sha256,
+                                                    expected_length=request.content_length)
+    except ValueError as e:
+        logger.warning(f"Raw upload rejected for {filename}: {e}")
+        return jsonify({'error': str(e)}), 400
+    except ClientDisconnected:
+        logger.warning(f"Raw upload of {filename} interrupted, existing file kept")
+        return jsonify({'error': 'Client disconnected during upload'}), 400
+    except Exception as e:
+        logger.error(f"Error saving raw upload {filename}: {e}")
+        return jsonify({'error': f'Failed to save file: {str(e)}'}), 500
+    stats = throughput_stats(size, duration)
+    logger.info(f"Raw upload saved: {filepath} ({size / (1024 * 1024):.2f} MB at {stats['mb_per_sec']} MB/s)")
+    dedupe = _dedupe_upload(upload_folder, filepath, digest)
+    result_text = dummy_ml_process(filepath)
+    links = _record_result(filename, result_text, _upload_id())
+    return jsonify({'result': result_text, 'filename': filename, 'sha256': digest, **stats, **links, **dedupe}), 201
+
+MAX_CHECK_FILES = 1000  # entries in one /upload/check request
+
+@main_bp.route('/upload/check', methods=['POST'])
+def upload_check():
+    """
+    Pre-flight for mobile uploads: send sha256 and size (optionally filename and upload_id)
+    as JSON or form fields, or {"files": [...]} to check many at once. Content the server
+    already has needn't be sent; with a filename it is stored under that name at once and
+    processed like an upload, so 'exists': true means the upload is done.
+    """
+    data = request.get_json(silent=True) or request.form.to_dict()
+    entries = data.get('files') if isinstance(data, dict) else None
+    if not isinstance(entries, list):
+        checked = _check_upload(data if isinstance(data, dict) else {})
+        return jsonify(checked), 400 if 'error' in checked else 200
+    if len(entries) > MAX_CHECK_FILES:
+        return jsonify({'error': f'At most {MAX_CHECK_FILES} files per check'}), 400
+    return jsonify({'files': [_check_upload(e if isinstance(e, dict) else {}) for e in entries]})
+
+def _check_upload(entry):
+    sha256 = str(entry.get('sha256', '')).lower()
+    try:
+        size = int(entry.get('size', ''))
+    except (TypeError, ValueError):
+        size = -1
+    if len(sha256) != SHA256_LENGTH or any(c not in '0123456789abcdef' for c in sha256) or size < 0:
+        return {'error': 'sha256 (hex) and size required'}
+    filename = secure_filename(os.path.basename(str(entry.get('filename') or '')))
+    if filename and not allowed_file(filename, 'mobile'):
+        return {'error': f'File type not allowed: {filename}', 'sha256': sha256}
+    path = os.path.join(MOBILE_UPLOADS_FOLDER, filename) if filename else None
+    try:
+        held = _upload_index().claim(sha256, size, path)
+    except OSError as e:
+        logger.error(f"Could not store {filename} from an existing upload: {e}")
+        return {'exists': False, 'sha256': sha256}
+    if held is None:
+        return {'exists': False, 'sha256': sha256}
+    checked = {'exists': True, 'sha256': sha256}
+    if path:
+        result_text = dummy_ml_process(path)
+        links = _record_result(filename, result_text, _upload_id(str(entry.get('upload_id', ''))))
+        checked.update(filename=filename, result=result_text, **links)
+        logger.info(f"Pre-flight: {filename} already stored, upload skipped")
+    return checked
+
+def _resumable_headers(session):
+    return {
+        'Upload-Offset': str(session.offset),
+        'Upload-Length': str(session.length),
+        'Cache-Control': 'no-store',
+    }
+
+def _finish_resumable(session):
+    filepath = resumable.finalize(session)
+    # Chunks arrived over several requests, so the file is hashed from disk
+    dedupe = _dedupe_upload(session.dest_folder, filepath)
+    result_text = dummy_ml_process(filepath)
+    links = _record_result(session.filename, result_text, session.id)
+    return jsonify({'result': result_text, 'filename': session.filename, 'size': session.length, **links, **dedupe}), 200
+
+@main_bp.route('/resumable', methods=['POST'])
+def create_resumable_upload():
+    """
+    Start a resumable upload. Send Upload-Length and Upload-Filename headers
+    (or length/filename form fields), then PATCH chunks to the returned URL.
+    """
+    source = request.headers.get('Source') or request.form.get('source') or 'unknown'
+    filename = request.headers.get('Upload-Filename') or request.form.get('filename', '')
+    filename = secure_filename(os.path.basename(filename))
+    try:
+        length = int(request.headers.get('Upload-Length') or request.form.get('length', ''))
+    except ValueError:
+        return jsonify({'error': 'Upload-Length required'}), 400
+    if length < 0 or length > current_app.config['MAX_CONTENT_LENGTH']:
+        return jsonify({'error': 'Invalid Upload-Length'}), 400
+    if not filename or not allowed_file(filename, source):
+        return jsonify({'error': f'File type not allowed: {filename}'}), 400
+    upload_folder = MOBILE_UPLOADS_FOLDER if source == 'mobile' else current_app.config['UPLOAD_FOLDER']
+    session = resumable.create(RESUMABLE_FOLDER, filename, length, upload_folder, source)
+    progress.publish(session.id, {'status': 'queued', 'stage': 'upload', 'offset': 0, 'length': length})
+    url = f"/resumable/{session.id}"
+    body = dict(session.to_dict(), url=url)
+    return jsonify(body), 201, dict(_resumable_headers(session), Location=url)
+
+@main_bp.route('/resumable/<upload_id>', methods=['HEAD', 'GET'])
+def resumable_upload_status(upload_id):
+    """Report the committed offset so a client knows where to resume"""
+    session = resumable.load(RESUMABLE_FOLDER, upload_id)
+    if session is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    return jsonify(session.to_dict()), 200, _resumable_headers(session)
+
+@main_bp.route('/resumable/<upload_id>', methods=['PATCH'])
+def resumable_upload_chunk(upload_id):
+    """Append a chunk at Upload-Offset; the upload is finalized when the last byte arrives"""
+    session = resumable.load(RESUMABLE_FOLDER, upload_id)
+    if session is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    try:
+        offset = int(request.headers.get('Upload-Offset', ''))
+    except ValueError:
+        return jsonify({'error': 'Upload-Offset required'}), 400
+    try:
+        new_offset = resumable.append(session, request.stream, offset)
+    except resumable.OffsetMismatch as e:
+        return jsonify({'error': str(e), 'offset': e.expected}), 409, _resumable_headers(session)
+    except resumable.SessionGone:
+        return jsonify({'error': 'Upload not found'}), 404
+    except Exception as e:
+        logger.warning(f"Resumable upload {upload_id} interrupted at {session.offset}: {e}")
+        return jsonify({'error': f'Chunk interrupted: {str(e)}', 'offset': session.offset}), 400, _resumable_headers(session)
+    progress.publish(upload_id, {'status': 'running', 'stage': 'upload', 'offset': new_offset, 'length': session.length})
+    if new_offset == session.length:
+        try:
+            response = _finish_resumable(session)
+        except resumable.SessionGone:
+            # Another request (maybe in another worker) finalized it first
+            return jsonify({'error': 'Upload not found'}), 404
+        except Exception as e:
+            logger.error(f"Error finalizing resumable upload {upload_id}: {e}")
+            progress.publish(upload_id, {'status': 'failed', 'error': str(e)})
+            return jsonify({'error': f'Failed to finalize upload: {str(e)}'}), 500
+        progress.publish(upload_id, {'status': 'done', 'stage': 'upload', 'offset': new_offset, 'length': session.length})
+        return response
+    return '', 204, _resumable_headers(session)
+
+@main_bp.route('/resumable/<upload_id>', methods=['DELETE'])
+def resumable_upload_abort(upload_id):
+    session = resumable.load(RESUMABLE_FOLDER, upload_id)
+    if session is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    try:
+        resumable.abort(session)
+    except resumable.SessionGone:
+        return jsonify({'error': 'Upload not found'}), 404
+    progress.publish(upload_id, {'status': 'failed', 'error': 'Upload aborted'})
+    return '', 204
+
+@main_bp.route('/events/<channel_id>', methods=['GET'])
+def progress_events(channel_id):
+    """
+    Server-Sent Events for a conversion job, resumable upload or yt download id:
+    the latest state first, then every change until it is done or failed.
+    Each event is JSON with status, stage and the stage's counters.
+    """
+    hub = progress.get_hub()
+    if not hub.exists(channel_id):
+        return jsonify({'error': 'Unknown job, upload or download id'}), 404
+
+    def generate():
+        for event in hub.subscribe(channel_id):
+            if event is None:
+                yield ': keep-alive\n\n'
+            else:
+                yield f"id: {event['seq']}\ndata: {json.dumps(event)}\n\n"
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@main_bp.route('/result', methods=['GET'])
 def get_result():
-    return jsonify(latest_result)
+    """
+    Latest processing result of the asking client (see _client_id, the owner uploads are
+    recorded under), or of all clients with client=*, optionally only of one upload_id.
+    since=<result id> asks for newer results only; they are listed oldest first under
+    'results' (the newest also at the top level). wait=<seconds> long-polls: the request
+    is held until a matching result arrives, or answered 204 after the wait (at most
+    RESULT_MAX_WAIT). Without since, a long-poll waits for the next new result, except
+    for an upload_id, whose result may already be there.
+    """
+    client = _client_id()
+    if client == ALL_CLIENTS:
+        client = None
+    upload_id = request.args.get('upload_id')
+    since = request.args.get('since', type=int)
+    wait = min(max(request.args.get('wait', 0, type=float), 0), RESULT_MAX_WAIT)
+    store = _store()
+    if since is None and wait and not upload_id:
+        since = store.last_result_id(client)
+    found = store.wait_results(client, upload_id, since or 0, wait)
+    if not found:
+        if wait:
+            return '', 204, {'Cache-Control': 'no-store'}
+        return jsonify({'text': '', 'filename': ''})
+    body = dict(found[-1])
+    if since is not None:
+        body['results'] = found
+    return jsonify(body), 200, {'Cache-Control': 'no-store'}
 
-@app.route('/dashboard', methods=['GET'])
+@main_bp.route('/dashboard', methods=['GET'])
 def dashboard():
-    return render_template('dashboard.html', result=latest_result)
+    recent = _store().results(limit=20)
+    return render_template('dashboard.html', result=recent[-1] if recent else {'text': '', 'filename': ''},
+                           recent=list(reversed(recent)), last_id=recent[-1]['id'] if recent else 0)
 
-@app.route('/uploads/<filename>')
+@main_bp.route('/uploads/<filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    return serve_file(current_app.config['UPLOAD_FOLDER'], filename)
 
-@app.route('/files', methods=['GET'])
+@main_bp.route('/files', methods=['GET'])
 def list_files():
-    """List all files available for download from send_to_mobile folder"""
+    """
+    List files available for download from send_to_mobile folder.
+    Optional query args: sort (modified|name|size), order (asc|desc), ext (comma separated),
+    limit and cursor (from next_cursor of the previous page). Unchanged listings answer 304.
+    """
     try:
-        files = []
-        folder = SEND_TO_MOBILE_FOLDER
-        if os.path.exists(folder):
-            for filename in os.listdir(folder):
-                file_path = os.path.join(folder, filename)
-                if os.path.isfile(file_path):
-                    file_size = int(os.path.getsize(file_path))
-                    file_modified = int(os.path.getmtime(file_path))
-                    # Format file size
-                    if file_size < 1024:
-                        size_str = f"{file_size} B"
-                    elif file_size < 1024 * 1024:
-                        size_str = f"{file_size // 1024} KB"
-                    else:
-                        size_str = f"{file_size // (1024 * 1024)} MB"
-                    file_ext = os.path.splitext(filename)[1].lower()
-                    files.append({
-                        'name': filename,
-                        'size': size_str,
-                        'size_bytes': file_size,
-                        'modified': file_modified,
-                        'extension': file_ext
-                    })
-        files.sort(key=lambda x: x['modified'], reverse=True)
-        return jsonify({
+        sort = request.args.get('sort', 'modified')
+        descending = request.args.get('order', 'desc').lower() != 'asc'
+        ext = request.args.get('ext', '')
+        extensions = {('.' + e.strip().lstrip('.')).lower() for e in ext.split(',') if e.strip()}
+        cursor = request.args.get('cursor') or None
+        limit = request.args.get('limit', type=int)
+        if limit is not None and limit <= 0:
+            return jsonify({'status': 'error', 'message': 'limit must be positive'}), 400
+
+        fingerprint = send_to_mobile_index.refresh()
+        etag = hashlib.sha1(f"{fingerprint}?{request.query_string.decode('latin-1')}".encode('utf-8')).hexdigest()
+        if request.if_none_match.contains(etag):
+            return '', 304, {'ETag': f'"{etag}"', 'Cache-Control': 'no-cache'}
+        try:
+            files, total, next_cursor = send_to_mobile_index.listing(sort, descending, extensions, cursor, limit)
+        except (ValueError, TypeError) as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        response = jsonify({
             'status': 'success',
             'files': files,
-            'count': len(files)
+            'count': len(files),
+            'total': total,
+            'next_cursor': next_cursor
         })
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
     except Exception as e:
         logger.error(f"Error listing files: {e}")
         return jsonify({
@@ -340,7 +631,7 @@ def list_files():
             'message': f'Failed to list files: {str(e)}'
         }), 500
 
-@app.route('/download/<filename>', methods=['GET'])
+@main_bp.route('/download/<filename>', methods=['GET'])
 def download_file(filename):
     """Download a specific file from send_to_mobile folder"""
     try:
@@ -351,20 +642,15 @@ def download_file(filename):
             return jsonify({'error': 'File not found'}), 404
         if not os.path.isfile(file_path):
             return jsonify({'error': 'Not a file'}), 400
-        logger.info(f"File download requested: {filename}")
-        return send_from_directory(
-            SEND_TO_MOBILE_FOLDER,
-            filename,
-            as_attachment=True,
-            download_name=filename
-        )
+        logger.info(f"File download requested: {filename} (Range: {request.headers.get('Range', 'none')})")
+        return serve_file(SEND_TO_MOBILE_FOLDER, filename, as_attachment=True, download_name=filename)
     except Exception as e:
         logger.error(f"Error downloading file {filename}: {e}")
         return jsonify({
             'error': f'Download failed: {str(e)}'
         }), 500
 
-@app.route('/delete/<filename>', methods=['DELETE'])
+@main_bp.route('/delete/<filename>', methods=['DELETE'])
 def delete_file(filename):
     """Delete a file from the send_to_mobile folder"""
     try:
@@ -376,6 +662,7 @@ def delete_file(filename):
         if not os.path.isfile(file_path):
             return jsonify({'error': 'Not a file'}), 400
         os.remove(file_path)
+        send_to_mobile_index.invalidate()
         logger.info(f"File deleted: {filename}")
         return jsonify({
             'status': 'success',
@@ -387,7 +674,7 @@ def delete_file(filename):
             'error': f'Delete failed: {str(e)}'
         }), 500
 
-@app.route('/file-info/<filename>', methods=['GET'])
+@main_bp.route('/file-info/<filename>', methods=['GET'])
 def get_file_info(filename):
     """Get detailed information about a file in send_to_mobile folder"""
     try:
@@ -401,12 +688,7 @@ def get_file_info(filename):
         file_size = int(os.path.getsize(file_path))
         file_modified = int(os.path.getmtime(file_path))
         file_created = int(os.path.getctime(file_path))
-        if file_size < 1024:
-            size_str = f"{file_size} B"
-        elif file_size < 1024 * 1024:
-            size_str = f"{file_size // 1024} KB"
-        else:
-            size_str = f"{file_size // (1024 * 1024)} MB"
+        size_str = format_size(file_size)
         file_ext = os.path.splitext(filename)[1].lower()
         return jsonify({
             'status': 'success',
@@ -428,48 +710,224 @@ def get_file_info(filename):
 
 converter_bp = Blueprint('converter', __name__, url_prefix='/convert')
 
+# Converters whose output is fully determined by the input content and parameters
+CACHEABLE_CONVERTERS = {
+    convert_image, image_to_ico, raster_to_svg, svg_to_raster, reduce_image_size,
+    convert_mp4_to_mp3, gif_to_mp4, mp4_to_gif, reduce_video_size,
+    mp3_to_wav, wav_to_mp3, m4a_to_mp3, mp3_to_m4a, reduce_audio_size,
+    convert_word_to_pdf,
+}
+# Converters that run on the thread pool (in-process Pillow, or services this process keeps running), with a check of their arguments
+THREADED_CONVERTERS = {
+    convert_image: pillow_can_convert,
+    image_to_ico: lambda input_path: True,
+    reduce_image_size: lambda input_path, *args: True,
+    # Use the TTS service of this process: its engine stays initialized and its cache warm
+    text_to_mp3: lambda text, *args: True,
+    text_to_wav: lambda text, *args: True,
+    # Use the office pool of this process, rather than one per converter process (see office_pool.py)
+    convert_word_to_pdf: lambda input_path: True,
+}
+def _wants_async():
+    """Clients opt into job mode with async=1 or a 'Prefer: respond-async' header"""
+    flag = request.form.get('async', request.args.get('async', ''))
+    return flag.lower() in ('1', 'true', 'yes') or 'respond-async' in request.headers.get('Prefer', '')
+
+def _save_upload(file, job_dir=None, unique=True):
+    """
+    Save an uploaded file into its own directory under UPLOAD_FOLDER so concurrent jobs don't collide.
+    Converters name outputs after the input, so by default the input also gets a unique stem;
+    the download name is mapped back to the original one. The content is hashed while it is
+    written; the digest keys the conversion cache.
+    """
+    if job_dir is None:
+        job_dir = tempfile.mkdtemp(prefix='job_', dir=current_app.config['UPLOAD_FOLDER'])
+    filename = secure_filename(os.path.basename(file.filename))
+    stem, ext = os.path.splitext(filename)
+    saved_stem = f"{stem}_{uuid.uuid4().hex[:8]}" if unique else stem
+    input_path = os.path.join(job_dir, saved_stem + ext)
+    _, hasher, _ = stream_to_file(file.stream, input_path, fsync=False)
+    g.setdefault('uploads', {})[input_path] = (hasher.hexdigest(), stem, saved_stem)
+    return input_path, job_dir
+
+def _job_options(func, args):
+    """Output naming and, for converters whose output only depends on input and parameters, a cache key"""
+    options = {}
+    if func in THREADED_CONVERTERS and THREADED_CONVERTERS[func](*args):
+        options['threaded'] = True
+    saved = g.get('uploads', {}).get(args[0]) if args and isinstance(args[0], str) else None
+    if saved is None:
+        return options
+    digest, stem, saved_stem = saved
+    options.update(input_base=stem, saved_base=saved_stem)
+    if func in CACHEABLE_CONVERTERS:
+        options['cache_key'] = make_key(func, [digest], *args[1:])
+    return options
+
+def _unique_arcname(name, used):
+    base, ext = os.path.splitext(name)
+    candidate, n = name, 1
+    while candidate in used:
+        candidate = f"{base}_{n}{ext}"
+        n += 1
+    used.add(candidate)
+    return candidate
+
+def _take_streams(files):
+    """
+    Take ownership of the uploads' spooled streams so they outlive the request context.
+    Flask closes request files before a streamed response is iterated; the caller closes
+    the returned streams (which frees their temp files) once the response is done.
+    """
+    streams = []
+    for file in files:
+        streams.append(file.stream)
+        file.stream = io.BytesIO()
+    return streams
+
+def _job_links(job):
+    return {
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': f"{converter_bp.url_prefix}/jobs/{job.id}",
+        'result_url': f"{converter_bp.url_prefix}/jobs/{job.id}/result",
+    }
+
+def _job_response(job):
+    if job.status == 'failed':
+        return jsonify({'error': job.error}), 500
+    if job.kind == 'file':
+        return send_file(job.result, as_attachment=True, download_name=job.download_name)
+    if job.kind == 'text':
+        return job.result, 200, {'Content-Type': 'text/plain; charset=utf-8'}
+    payload = {'status': 'success'}
+    if job.result is not None:
+        payload['text'] = job.result
+    if job.message:
+        payload['message'] = job.message
+    return jsonify(payload), 200
+
+def _run_conversion(func, *args, **job_options):
+    """
+    Run a converter function on the worker pool.
+    In async mode the job id is returned at once (202), otherwise the request waits for the result.
+    """
+    job_options.update(_job_options(func, args))
+    try:
+        job = jobs.submit(func, *args, **job_options)
+    except jobs.QueueFull as e:
+        return jsonify({'error': str(e)}), 503
+    if _wants_async():
+        return jsonify(_job_links(job)), 202, {'Location': _job_links(job)['status_url']}
+    jobs.wait(job)
+    response = _job_response(job)
+    # Nobody else knows this job's id, so its output can go once it has been sent.
+    # An X-Sendfile front server reads the file after the response, so it waits for the job to expire.
+    if job.output and isinstance(response, Response) and not current_app.config['USE_X_SENDFILE']:
+        response.call_on_close(lambda: jobs.release(job))
+    return response
+
+PIPE_CONVERTERS = {
+    'mp3_to_wav': mp3_to_wav,
+    'wav_to_mp3': wav_to_mp3,
+    'm4a_to_mp3': m4a_to_mp3,
+    'mp3_to_m4a': mp3_to_m4a,
+    'mp4_to_mp3': convert_mp4_to_mp3,
+}
+
+def _read_probe(stream, size):
+    head = b''
+    while len(head) < size:
+        chunk = stream.read(size - len(head))
+        if not chunk:
+            break
+        head += chunk
+    return head
+
+def _pipe_conversion(direction, stream, filename):
+    """
+    Pipe stream through ffmpeg and stream its output back, without temp files. Only worth it
+    for a raw request body (/convert/stream): werkzeug has spooled a multipart upload to a
+    temp file before the view runs, so there is no upload to overlap with.
+    Inputs that need seeking (MP4/M4A with the moov atom at the end) are saved to disk
+    and converted on the worker pool instead. Takes ownership of stream.
+    """
+    head = _read_probe(stream, PROBE_SIZE)
+    if not is_streamable(direction, head):
+        logger.info(f"{direction}: input is not streamable (moov after mdat), converting from disk")
+        try:
+            input_path, job_dir = _save_upload(FileStorage(PrefixedStream(head, stream), filename=filename))
+        finally:
+            stream.close()
+        return _run_conversion(PIPE_CONVERTERS[direction], input_path, cleanup=[job_dir])
+    _, ext, mimetype = PIPE_DIRECTIONS[direction]
+    output = stream_convert(direction, stream, head)
+    try:
+        # Wait for the first output so a bad input still gets a proper error status
+        first = next(output)
+    except StopIteration:
+        stream.close()
+        return jsonify({'error': f"ffmpeg produced no output for {direction}"}), 500
+    except Exception as e:
+        output.close()
+        stream.close()
+        logger.error(f"Pipe conversion {direction} failed: {e}")
+        return jsonify({'error': str(e)}), 500
+
+    def generate():
+        try:
+            yield first
+            yield from output
+        except RuntimeError as e:
+            # Headers are already sent; re-raise so the server drops the connection
+            logger.error(f"Pipe conversion {direction} failed mid-stream: {e}")
+            raise
+        finally:
+            output.close()
+            stream.close()
+
+    stem = os.path.splitext(secure_filename(os.path.basename(filename or '')))[0] or 'output'
+    return Response(generate(), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={stem}_converted.{ext}'})
+
+@converter_bp.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+@converter_bp.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if not job.done():
+        return jsonify(job.to_dict()), 409
+    return _job_response(job)
+
 @converter_bp.route('/image', methods=['POST'])
 def convert_image_endpoint():
     if 'file' not in request.files or 'format' not in request.form:
         return jsonify({'error': 'File and format required'}), 400
     file = request.files['file']
-    output_format = request.form['format']
-    filename = secure_filename(os.path.basename(file.filename))
-    input_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    file.save(input_path)
-    output_path = convert_image(input_path, output_format)
-    # Delete the original file after conversion
-    if os.path.exists(input_path):
-        os.remove(input_path)
-    return send_file(output_path, as_attachment=True)
+    output_format = request.form['format'].strip().lower()
+    input_path, job_dir = _save_upload(file)
+    return _run_conversion(convert_image, input_path, output_format, cleanup=[job_dir])
 
 @converter_bp.route('/video', methods=['POST'])
 def convert_video_endpoint():
     if 'file' not in request.files:
         return jsonify({'error': 'File required'}), 400
-    file = request.files['file']
-    filename = secure_filename(os.path.basename(file.filename))
-    input_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    file.save(input_path)
-    output_path = convert_mp4_to_mp3(input_path)
-    # Delete the original file after conversion
-    if os.path.exists(input_path):
-        os.remove(input_path)
-    return send_file(output_path, as_attachment=True)
+    input_path, job_dir = _save_upload(request.files['file'])
+    return _run_conversion(convert_mp4_to_mp3, input_path, cleanup=[job_dir])
 
 @converter_bp.route('/document', methods=['POST'])
 def convert_document_endpoint():
     if 'file' not in request.files:
         return jsonify({'error': 'File required'}), 400
-    file = request.files['file']
-    filename = secure_filename(os.path.basename(file.filename))
-    input_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    file.save(input_path)
-    output_path = convert_word_to_pdf(input_path)
-    # Delete the original file after conversion
-    if os.path.exists(input_path):
-        os.remove(input_path)
-    return send_file(output_path, as_attachment=True)
+    input_path, job_dir = _save_upload(request.files['file'])
+    return _run_conversion(convert_word_to_pdf, input_path, cleanup=[job_dir])
 
 @converter_bp.route('/archive', methods=['POST'])
 def convert_archive_endpoint():
@@ -477,112 +935,128 @@ def convert_archive_endpoint():
     if 'files' not in request.files:
         return jsonify({'error': 'Files required'}), 400
     files = request.files.getlist('files')
-    zip_name = archive_files_to_zip(files)
-    return send_file(zip_name, as_attachment=True, download_name='archive.zip')
+    if _wants_async():
+        job_dir = None
+        input_paths = []
+        for file in files:
+            input_path, job_dir = _save_upload(file, job_dir, unique=False)
+            input_paths.append(input_path)
+        return _run_conversion(archive_files_to_zip, input_paths, cleanup=[job_dir], download_name='archive.zip')
+    # Stream the ZIP while it is built, reading each member from its upload stream
+    used = set()
+    members = [(_unique_arcname(secure_filename(os.path.basename(f.filename)) or 'file', used), stream)
+               for f, stream in zip(files, _take_streams(files))]
+
+    def generate():
+        try:
+            yield from stream_zip(members)
+        finally:
+            for _, stream in members:
+                stream.close()
+
+    return Response(generate(), mimetype='application/zip',
+                    headers={'Content-Disposition': 'attachment; filename=archive.zip'})
 
 @converter_bp.route('/unzip', methods=['POST'])
 def convert_unzip_endpoint():
     if 'file' not in request.files:
         return jsonify({'error': 'ZIP file required'}), 400
-    zip_file = request.files['file']
-    from converter.archive_converter import extract_zip_to_zip
-    out_zip = extract_zip_to_zip(zip_file)
-    return send_file(out_zip, as_attachment=True, download_name='unzipped_contents.zip')
+    if _wants_async():
+        input_path, job_dir = _save_upload(request.files['file'])
+        return _run_conversion(extract_zip_to_zip, input_path, cleanup=[job_dir], download_name='unzipped_contents.zip')
+    stream = _take_streams([request.files['file']])[0]
+    try:
+        src = zipfile.ZipFile(stream)
+    except zipfile.BadZipFile:
+        stream.close()
+        return jsonify({'error': 'Not a valid ZIP file'}), 400
+
+    def generate():
+        # Members are copied from the uploaded archive into the new one without extracting
+        try:
+            with src:
+                yield from stream_zip(iter_zip_members(src))
+        finally:
+            stream.close()
+
+    return Response(generate(), mimetype='application/zip',
+                    headers={'Content-Disposition': 'attachment; filename=unzipped_contents.zip'})
 
 @converter_bp.route('/audio', methods=['POST'])
 def convert_audio_endpoint():
     if 'file' not in request.files or 'direction' not in request.form:
         return jsonify({'error': 'File and direction required'}), 400
-    file = request.files['file']
     direction = request.form['direction']
-    filename = secure_filename(os.path.basename(file.filename))
-    input_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    file.save(input_path)
     if direction == 'mp3_to_wav':
-        output_path = mp3_to_wav(input_path)
+        func = mp3_to_wav
     elif direction == 'wav_to_mp3':
-        output_path = wav_to_mp3(input_path)
+        func = wav_to_mp3
     else:
         return jsonify({'error': 'Invalid direction'}), 400
-    # Delete the original file after conversion
-    if os.path.exists(input_path):
-        os.remove(input_path)
-    return send_file(output_path, as_attachment=True)
+    input_path, job_dir = _save_upload(request.files['file'])
+    return _run_conversion(func, input_path, cleanup=[job_dir])
+
+@converter_bp.route('/stream/<direction>', methods=['POST'])
+def convert_stream_endpoint(direction):
+    """
+    Raw request body in, converted audio out. ffmpeg starts reading while the body is still
+    uploading. The original name can be given as ?filename= or an X-Filename header.
+    """
+    if direction not in PIPE_CONVERTERS:
+        return jsonify({'error': 'Invalid direction'}), 400
+    filename = request.args.get('filename') or request.headers.get('X-Filename') or f"input.{direction.split('_')[0]}"
+    if _wants_async():
+        input_path, job_dir = _save_upload(FileStorage(request.stream, filename=filename))
+        return _run_conversion(PIPE_CONVERTERS[direction], input_path, cleanup=[job_dir])
+    return _pipe_conversion(direction, request.stream, filename)
 
 @converter_bp.route('/gifmp4', methods=['POST'])
 def convert_gifmp4_endpoint():
     if 'file' not in request.files or 'direction' not in request.form:
         return jsonify({'error': 'File and direction required'}), 400
-    file = request.files['file']
     direction = request.form['direction']
-    filename = secure_filename(os.path.basename(file.filename))
-    input_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    file.save(input_path)
     if direction == 'gif_to_mp4':
-        output_path = gif_to_mp4(input_path)
+        func = gif_to_mp4
     elif direction == 'mp4_to_gif':
-        output_path = mp4_to_gif(input_path)
+        func = mp4_to_gif
     else:
         return jsonify({'error': 'Invalid direction'}), 400
-    # Delete the original file after conversion
-    if os.path.exists(input_path):
-        os.remove(input_path)
-    return send_file(output_path, as_attachment=True)
+    input_path, job_dir = _save_upload(request.files['file'])
+    return _run_conversion(func, input_path, cleanup=[job_dir])
 
 @converter_bp.route('/ico', methods=['POST'])
 def convert_ico_endpoint():
     if 'file' not in request.files:
         return jsonify({'error': 'File required'}), 400
-    file = request.files['file']
-    filename = secure_filename(os.path.basename(file.filename))
-    input_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    file.save(input_path)
-    output_path = image_to_ico(input_path)
-    # Delete the original file after conversion
-    if os.path.exists(input_path):
-        os.remove(input_path)
-    return send_file(output_path, as_attachment=True)
+    input_path, job_dir = _save_upload(request.files['file'])
+    return _run_conversion(image_to_ico, input_path, cleanup=[job_dir])
 
 @converter_bp.route('/svg', methods=['POST'])
 def convert_svg_endpoint():
     if 'file' not in request.files or 'direction' not in request.form:
         return jsonify({'error': 'File and direction required'}), 400
-    file = request.files['file']
     direction = request.form['direction']
-    filename = secure_filename(os.path.basename(file.filename))
-    input_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    file.save(input_path)
-    if direction == 'raster_to_svg':
-        output_path = raster_to_svg(input_path)
-    elif direction == 'svg_to_raster':
-        output_format = request.form.get('format', 'png')
-        output_path = svg_to_raster(input_path, output_format)
-    else:
+    if direction not in ('raster_to_svg', 'svg_to_raster'):
         return jsonify({'error': 'Invalid direction'}), 400
-    # Delete the original file after conversion
-    if os.path.exists(input_path):
-        os.remove(input_path)
-    return send_file(output_path, as_attachment=True)
+    input_path, job_dir = _save_upload(request.files['file'])
+    if direction == 'raster_to_svg':
+        return _run_conversion(raster_to_svg, input_path, cleanup=[job_dir])
+    output_format = request.form.get('format', 'png').strip().lower()
+    return _run_conversion(svg_to_raster, input_path, output_format, cleanup=[job_dir])
 
 @converter_bp.route('/m4amp3', methods=['POST'])
 def convert_m4amp3_endpoint():
     if 'file' not in request.files or 'direction' not in request.form:
         return jsonify({'error': 'File and direction required'}), 400
-    file = request.files['file']
     direction = request.form['direction']
-    filename = secure_filename(os.path.basename(file.filename))
-    input_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    file.save(input_path)
     if direction == 'm4a_to_mp3':
-        output_path = m4a_to_mp3(input_path)
+        func = m4a_to_mp3
     elif direction == 'mp3_to_m4a':
-        output_path = mp3_to_m4a(input_path)
+        func = mp3_to_m4a
     else:
         return jsonify({'error': 'Invalid direction'}), 400
-    # Delete the original file after conversion
-    if os.path.exists(input_path):
-        os.remove(input_path)
-    return send_file(output_path, as_attachment=True)
+    input_path, job_dir = _save_upload(request.files['file'])
+    return _run_conversion(func, input_path, cleanup=[job_dir])
 
 @converter_bp.route('/qr', methods=['POST'])
 def convert_qr_endpoint():
@@ -593,134 +1067,370 @@ def convert_qr_endpoint():
         text = request.form.get('text', '')
         if not text:
             return jsonify({'error': 'Text required'}), 400
-        output_path = text_to_qr(text)
-        return send_file(output_path, as_attachment=True)
+        return _run_conversion(text_to_qr, text)
     elif mode == 'qr_to_text':
         if 'file' not in request.files:
             return jsonify({'error': 'QR image file required'}), 400
-        file = request.files['file']
-        filename = secure_filename(os.path.basename(file.filename))
-        input_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(input_path)
-        decoded = qr_to_text(input_path)
-        # Delete the original file after conversion
-        if os.path.exists(input_path):
-            os.remove(input_path)
-        return jsonify({'text': decoded})
+        input_path, job_dir = _save_upload(request.files['file'])
+        return _run_conversion(qr_to_text, input_path, kind='json', cleanup=[job_dir])
     else:
         return jsonify({'error': 'Invalid mode'}), 400
 
+OCR_LANG_PATTERN = re.compile(r'^[A-Za-z_]+(\+[A-Za-z_]+)*$')
+
 @converter_bp.route('/ocr', methods=['POST'])
 def convert_ocr_endpoint():
     if 'file' not in request.files or 'mode' not in request.form:
         return jsonify({'error': 'File and mode required'}), 400
-    file = request.files['file']
     mode = request.form['mode']
-    filename = secure_filename(os.path.basename(file.filename))
-    input_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    file.save(input_path)
     if mode == 'image_to_text':
-        text = image_to_text(input_path)
+        func = image_to_text
     elif mode == 'pdf_to_text':
-        text = pdf_to_text(input_path)
+        func = pdf_to_text
     else:
         return jsonify({'error': 'Invalid mode'}), 400
-    # Delete the original file after conversion
-    if os.path.exists(input_path):
-        os.remove(input_path)
-    return text, 200, {'Content-Type': 'text/plain; charset=utf-8'}
+    # Tesseract language(s), e.g. 'eng' or 'eng+deu', and page segmentation mode
+    lang = request.form.get('lang', DEFAULT_LANG).strip()
+    if not OCR_LANG_PATTERN.match(lang):
+        return jsonify({'error': 'Invalid lang'}), 400
+    psm = request.form.get('psm', DEFAULT_PSM, type=int)
+    if psm is None or not 0 <= psm <= 13:
+        return jsonify({'error': 'psm must be between 0 and 13'}), 400
+    input_path, job_dir = _save_upload(request.files['file'])
+    if mode == 'pdf_to_text' and not _wants_async():
+        return _stream_pdf_text(input_path, job_dir, lang, psm)
+    return _run_conversion(func, input_path, lang, psm, kind='text', cleanup=[job_dir])
+
+def _page_ranges(pages):
+    """[1, 2, 3, 5] -> '1-3,5'"""
+    ranges = []
+    for page in pages:
+        if ranges and ranges[-1][1] == page - 1:
+            ranges[-1][1] = page
+        else:
+            ranges.append([page, page])
+    return ','.join(str(a) if a == b else f"{a}-{b}" for a, b in ranges)
+
+def _stream_pdf_text(input_path, job_dir, lang, psm):
+    """
+    Stream the text of a PDF page by page, in order, while later pages are still being processed.
+    Pages with a text layer are read directly, the rest are OCRed; the X-Page-Methods header lists
+    which is which. format=ndjson streams one {"page", "method", "text"} object per line instead.
+    """
+    output_format = request.form.get('format', 'text').strip().lower()
+    if output_format not in ('text', 'ndjson'):
+        shutil.rmtree(job_dir, ignore_errors=True)
+        return jsonify({'error': 'Invalid format, expected text or ndjson'}), 400
+    try:
+        plan = plan_pdf_pages(input_path)
+    except Exception as e:
+        shutil.rmtree(job_dir, ignore_errors=True)
+        logger.error(f"PDF OCR failed: {e}")
+        return jsonify({'error': f"PDF OCR processing failed: {e}"}), 500
+    text_pages = [page for page, text in plan if text is not None]
+    ocr_pages = [page for page, text in plan if text is None]
+    logger.info(f"PDF text: {len(text_pages)} pages from the text layer, {len(ocr_pages)} to OCR")
+    pages = iter_pdf_pages(input_path, plan, lang, psm)
+
+    def generate():
+        try:
+            for page, text, method in pages:
+                if output_format == 'ndjson':
+                    yield json.dumps({'page': page, 'method': method, 'text': text}) + '\n'
+                else:
+                    yield text + '\n'
+        finally:
+            pages.close()
+            shutil.rmtree(job_dir, ignore_errors=True)
+
+    headers = {'X-Page-Methods': f"text={_page_ranges(text_pages)}; ocr={_page_ranges(ocr_pages)}"}
+    mimetype = 'application/x-ndjson' if output_format == 'ndjson' else 'text/plain'
+    return Response(generate(), mimetype=mimetype, headers=headers)
+
+TTS_MIMETYPES = {'mp3': 'audio/mpeg', 'wav': 'audio/wav'}
+TTS_VOICE_PATTERN = re.compile(r'^[\w.\-\\{}]{1,200}$')
 
 @converter_bp.route('/tts', methods=['POST'])
 def convert_tts_endpoint():
     text = request.form.get('text', '')
     fmt = request.form.get('format', 'mp3')
-    if not text:
+    if not text.strip():
         return jsonify({'error': 'Text required'}), 400
-    if fmt == 'mp3':
-        output_path = text_to_mp3(text)
-    elif fmt == 'wav':
-        output_path = text_to_wav(text)
-    else:
+    if fmt not in TTS_MIMETYPES:
         return jsonify({'error': 'Invalid format'}), 400
-    return send_file(output_path, as_attachment=True)
+    # gTTS language for mp3 (e.g. 'en', 'de'), pyttsx3 voice id for wav
+    voice = request.form.get('voice', '').strip() or None
+    if voice is not None and not TTS_VOICE_PATTERN.match(voice):
+        return jsonify({'error': 'Invalid voice'}), 400
+    if _wants_async():
+        return _run_conversion(text_to_mp3 if fmt == 'mp3' else text_to_wav, text, None, voice)
+    return _stream_tts(text, fmt, voice)
+
+def _stream_tts(text, fmt, voice):
+    """Stream speech sentence by sentence, starting as soon as the first one is synthesized."""
+    audio = tts_service.get_service().stream(text, fmt, voice)
+    try:
+        # Wait for the first sentence so engine errors still get a proper error status
+        first = next(audio)
+    except Exception as e:
+        audio.close()
+        logger.error(f"TTS failed: {e}")
+        return jsonify({'error': str(e)}), 500
+
+    def generate():
+        try:
+            yield first
+            yield from audio
+        except Exception as e:
+            logger.error(f"TTS failed mid-stream: {e}")
+            raise
+        finally:
+            audio.close()
+
+    return Response(generate(), mimetype=TTS_MIMETYPES[fmt],
+                    headers={'Content-Disposition': f'attachment; filename=tts.{fmt}'})
+
+def _yt_download(url, fmt, playlist, message):
+    """
+    Start a download on the download manager. Async clients get its status URL at once
+    (per-item progress), otherwise the request waits until every item is done.
+    """
+    # refresh=1 re-reads a playlist instead of using its cached listing
+    refresh = request.form.get('refresh', '').lower() in ('1', 'true', 'yes')
+    task = yt_downloader.get_manager().start(url, fmt, playlist, refresh=refresh)
+    links = {'download_id': task.id, 'status': task.status,
+             'status_url': f"{converter_bp.url_prefix}/yt/downloads/{task.id}"}
+    if _wants_async():
+        return jsonify(links), 202, {'Location': links['status_url']}
+    task.wait()
+    links['status'] = task.status
+    if task.status == 'failed':
+        # Some items may still have been downloaded; the report and counts say which
+        return jsonify({'error': task.error, 'items': task.counts(), 'report': task.report(), **links}), 500
+    return jsonify({'status': 'success', 'message': message, 'items': task.counts(), 'report': task.report(), **links}), 200
 
 @converter_bp.route('/yt-mp3', methods=['POST'])
 def convert_yt_mp3_endpoint():
     url = request.form.get('url')
     if not url:
         return jsonify({'error': 'URL required'}), 400
-    try:
-        download_yt_mp3(url)
-        return jsonify({'status': 'success', 'message': 'Downloaded as mp3 to yt_converted'}), 200
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return _yt_download(url, 'mp3', False, 'Downloaded as mp3 to yt_converted')
 
 @converter_bp.route('/yt-mp4', methods=['POST'])
 def convert_yt_mp4_endpoint():
     url = request.form.get('url')
     if not url:
         return jsonify({'error': 'URL required'}), 400
-    try:
-        download_yt_mp4(url)
-        return jsonify({'status': 'success', 'message': 'Downloaded as mp4 to yt_converted'}), 200
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return _yt_download(url, 'mp4', False, 'Downloaded as mp4 to yt_converted')
 
 @converter_bp.route('/yt-playlist-mp3', methods=['POST'])
 def convert_yt_playlist_mp3_endpoint():
     url = request.form.get('url')
     if not url:
         return jsonify({'error': 'Playlist URL required'}), 400
-    try:
-        download_yt_playlist_mp3(url)
-        return jsonify({'status': 'success', 'message': 'Playlist downloaded as mp3 to yt_converted'}), 200
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return _yt_download(url, 'mp3', True, 'Playlist downloaded as mp3 to yt_converted')
 
 @converter_bp.route('/yt-playlist-mp4', methods=['POST'])
 def convert_yt_playlist_mp4_endpoint():
     url = request.form.get('url')
     if not url:
         return jsonify({'error': 'Playlist URL required'}), 400
-    try:
-        download_yt_playlist_mp4(url)
-        return jsonify({'status': 'success', 'message': 'Playlist downloaded as mp4 to yt_converted'}), 200
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return _yt_download(url, 'mp4', True, 'Playlist downloaded as mp4 to yt_converted')
+
+@converter_bp.route('/yt/downloads', methods=['GET'])
+def yt_downloads():
+    """Recent downloads with item counts by status, newest first"""
+    tasks = sorted(yt_downloader.get_manager().tasks(), key=lambda t: t.created, reverse=True)
+    return jsonify({'downloads': [t.to_dict(items=False) for t in tasks]})
+
+@converter_bp.route('/yt/downloads/<download_id>', methods=['GET'])
+def yt_download_status(download_id):
+    """Progress of one download: bytes, speed and eta of every item"""
+    task = yt_downloader.get_manager().get(download_id)
+    if task is None:
+        return jsonify({'error': 'Download not found'}), 404
+    return jsonify(task.to_dict())
 
 @converter_bp.route('/reduce', methods=['POST'])
 def reduce_file_size_endpoint():
     if 'file' not in request.files or 'type' not in request.form:
         return jsonify({'error': 'File and type required'}), 400
-    file = request.files['file']
     file_type = request.form['type']
-    filename = secure_filename(os.path.basename(file.filename))
-    input_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    file.save(input_path)
-    try:
-        if file_type == 'image':
-            output_format = request.form.get('format', 'jpg')
+    if file_type == 'image':
+        output_format = request.form.get('format', 'jpg').strip().lower()
+        try:
             quality = int(request.form.get('quality', 70))
-            max_width = request.form.get('max_width', type=int)
+        except ValueError:
+            return jsonify({'error': 'Invalid quality'}), 400
+        max_width = request.form.get('max_width', type=int)
+        max_height = request.form.get('max_height', type=int)
+        input_path, job_dir = _save_upload(request.files['file'])
+        return _run_conversion(reduce_image_size, input_path, output_format, quality, max_width, max_height,
+                               cleanup=[job_dir])
+    elif file_type == 'video':
+        # Either target_mb (two-pass to that size) or crf (quality level), optionally max_height
+        try:
+            target_mb = request.form.get('target_mb', type=float)
+            crf = request.form.get('crf', type=int)
             max_height = request.form.get('max_height', type=int)
-            output_path = reduce_image_size(input_path, output_format, quality, max_width, max_height)
-        elif file_type == 'video':
-            # TODO: Implement video size reduction (use FFmpeg)
-            return jsonify({'error': 'Video reduction not implemented yet'}), 501
-        elif file_type == 'audio':
-            # TODO: Implement audio size reduction (use FFmpeg)
-            return jsonify({'error': 'Audio reduction not implemented yet'}), 501
-        else:
-            return jsonify({'error': 'Unsupported file type'}), 400
-    except Exception as e:
-        if os.path.exists(input_path):
-            os.remove(input_path)
-        return jsonify({'error': str(e)}), 500
-    if os.path.exists(input_path):
-        os.remove(input_path)
-    return send_file(output_path, as_attachment=True)
+        except ValueError:
+            return jsonify({'error': 'Invalid numeric option'}), 400
+        preset = request.form.get('preset', 'medium').strip().lower()
+        if preset not in X264_PRESETS:
+            return jsonify({'error': f'Invalid preset, expected one of: {", ".join(X264_PRESETS)}'}), 400
+        if (target_mb is not None and target_mb <= 0) or (crf is not None and not 0 <= crf <= 51):
+            return jsonify({'error': 'target_mb must be positive and crf between 0 and 51'}), 400
+        input_path, job_dir = _save_upload(request.files['file'])
+        return _run_conversion(reduce_video_size, input_path, target_mb, crf, max_height, preset,
+                               cleanup=[job_dir])
+    elif file_type == 'audio':
+        # codec (opus/aac/mp3) with bitrate (kbps) or target_mb, optional mono and sample_rate
+        codec = request.form.get('codec', 'opus').strip().lower()
+        if codec not in REDUCE_CODECS:
+            return jsonify({'error': f'Invalid codec, expected one of: {", ".join(REDUCE_CODECS)}'}), 400
+        try:
+            bitrate = request.form.get('bitrate', type=int)
+            target_mb = request.form.get('target_mb', type=float)
+            sample_rate = request.form.get('sample_rate', type=int)
+        except ValueError:
+            return jsonify({'error': 'Invalid numeric option'}), 400
+        if any(value is not None and value <= 0 for value in (bitrate, target_mb, sample_rate)):
+            return jsonify({'error': 'bitrate, target_mb and sample_rate must be positive'}), 400
+        mono = request.form.get('mono', '').lower() in ('1', 'true', 'yes')
+        input_path, job_dir = _save_upload(request.files['file'])
+        return _run_conversion(reduce_audio_size, input_path, codec, bitrate, target_mb, mono, sample_rate,
+                               cleanup=[job_dir])
+    else:
+        return jsonify({'error': 'Unsupported file type'}), 400
+
+# Conversions accepted by /convert/batch: name -> (function, form fields passed as extra arguments)
+BATCH_CONVERSIONS = {
+    'image': (convert_image, ('format',)),
+    'image_to_ico': (image_to_ico, ()),
+    'raster_to_svg': (raster_to_svg, ()),
+    'svg_to_raster': (svg_to_raster, ('format',)),
+    'reduce_image': (reduce_image_size, ('format', 'quality', 'max_width', 'max_height')),
+    'reduce_video': (reduce_video_size, ('target_mb', 'crf', 'max_height', 'preset')),
+    'reduce_audio': (reduce_audio_size, ('codec', 'bitrate', 'target_mb', 'mono', 'sample_rate')),
+    'mp4_to_mp3': (convert_mp4_to_mp3, ()),
+    'gif_to_mp4': (gif_to_mp4, ()),
+    'mp4_to_gif': (mp4_to_gif, ()),
+    'mp3_to_wav': (mp3_to_wav, ()),
+    'wav_to_mp3': (wav_to_mp3, ()),
+    'm4a_to_mp3': (m4a_to_mp3, ()),
+    'mp3_to_m4a': (mp3_to_m4a, ()),
+    'word_to_pdf': (convert_word_to_pdf, ()),
+}
+BATCH_DEFAULTS = {'format': 'png', 'quality': '70', 'max_width': None, 'max_height': None, 'preset': 'medium',
+                  'codec': 'opus'}
+BATCH_INT_FIELDS = {'quality', 'max_width', 'max_height', 'crf', 'bitrate', 'sample_rate'}
+BATCH_FLOAT_FIELDS = {'target_mb'}
+BATCH_BOOL_FIELDS = {'mono'}
+
+def _batch_params(fields):
+    params = []
+    for field in fields:
+        value = request.form.get(field, BATCH_DEFAULTS.get(field))
+        if field in BATCH_INT_FIELDS | BATCH_FLOAT_FIELDS and value in (None, ''):
+            value = None
+        elif field in BATCH_INT_FIELDS:
+            value = int(value)
+        elif field in BATCH_FLOAT_FIELDS:
+            value = float(value)
+        elif field in BATCH_BOOL_FIELDS:
+            value = (value or '').lower() in ('1', 'true', 'yes')
+        elif isinstance(value, str):
+            value = value.strip().lower()
+        params.append(value)
+    return params
+
+def _batch_members(submitted, manifest):
+    """Yield (arcname, path) for each output as its job finishes; manifest.json goes last"""
+    used = {'manifest.json'}
+    try:
+        for job in jobs.as_completed(list(submitted)):
+            entry = submitted[job]
+            if job.status == 'done':
+                arcname = _unique_arcname(job.download_name or os.path.basename(job.result), used)
+                entry.update(status='done', output=arcname, cached=job.cached)
+                yield arcname, job.result
+            else:
+                entry.update(status='failed', error=job.error)
+        yield 'manifest.json', json.dumps(manifest, indent=2).encode('utf-8')
+    finally:
+        for job in submitted:
+            jobs.release(job)
+
+@converter_bp.route('/batch', methods=['POST'])
+def convert_batch_endpoint():
+    """
+    Convert many files with one spec: files[] plus conversion (see BATCH_CONVERSIONS) and its options.
+    The outputs run in parallel on the worker pool and are streamed back as a ZIP in completion order;
+    per-file failures are listed in manifest.json inside the ZIP.
+    """
+    files = request.files.getlist('files')
+    conversion = request.form.get('conversion') or request.form.get('direction', '')
+    if not files:
+        return jsonify({'error': 'Files required'}), 400
+    if conversion not in BATCH_CONVERSIONS:
+        return jsonify({'error': f'Invalid conversion, expected one of: {", ".join(sorted(BATCH_CONVERSIONS))}'}), 400
+    func, fields = BATCH_CONVERSIONS[conversion]
+    try:
+        params = _batch_params(fields)
+    except ValueError:
+        return jsonify({'error': 'Invalid numeric option'}), 400
+
+    manifest = {'conversion': conversion, 'files': []}
+    submitted = {}
+    for file in files:
+        entry = {'input': file.filename}
+        manifest['files'].append(entry)
+        input_path, job_dir = _save_upload(file)
+        args = [input_path] + params
+        try:
+            job = jobs.submit(func, *args, cleanup=[job_dir], **_job_options(func, args))
+        except jobs.QueueFull as e:
+            entry.update(status='failed', error=str(e))
+            continue
+        submitted[job] = entry
+    logger.info(f"Batch {conversion}: {len(submitted)} of {len(files)} files queued")
+    return Response(stream_zip(_batch_members(submitted, manifest)), mimetype='application/zip',
+                    headers={'Content-Disposition': f'attachment; filename=batch_{conversion}.zip'})
+
+def create_app(config=None):
+    """
+    Build the Flask app. Folders, the shared store and the caches are set up here
+    rather than at import, so a WSGI server can import this module in every worker
+    (see wsgi.py); the development server below does the same.
+    """
+    app = Flask(__name__)
+    CORS(app)  # Enable CORS for all routes
+
+    # Configure Flask for large file uploads
+    app.config['MAX_CONTENT_LENGTH'] = 2 * 1024 * 1024 * 1024  # 2GB max file size
+    app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+    # Let Apache/lighttpd stream downloads via X-Sendfile when running behind one
+    app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', '').lower() in ('1', 'true', 'yes')
+    app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp', 'mp4', 'avi', 'mov', 'mkv', 'mp3', 'wav', 'flac', 'aac', 'pdf', 'doc', 'docx', 'xls', 'xlsx', 'ppt', 'pptx', 'txt', 'csv', 'json', 'xml', 'zip', 'rar', '7z', 'tar', 'gz'}
+    app.config['STORE_PATH'] = STORE_PATH
+    if config:
+        app.config.update(config)
+
+    for folder in (app.config['UPLOAD_FOLDER'], MOBILE_UPLOADS_FOLDER, SEND_TO_MOBILE_FOLDER):
+        os.makedirs(folder, exist_ok=True)
+    resumable.cleanup_stale(RESUMABLE_FOLDER)
+
+    app.extensions['store'] = Store(app.config['STORE_PATH'])
+    app.extensions['upload_index'] = UploadIndex(MOBILE_UPLOADS_FOLDER, app.extensions['store'])
+    # Files stored before the index (or copied in by hand) are hashed in the background
+    threading.Thread(target=app.extensions['upload_index'].scan, name='upload-index-scan', daemon=True).start()
+    app.extensions['result_cache'] = ResultCache(os.path.join(UPLOAD_FOLDER, '.cache'), app.extensions['store'])
+    jobs.set_store(app.extensions['store'])
+    jobs.set_result_cache(app.extensions['result_cache'])
 
-app.register_blueprint(converter_bp)
+    app.register_blueprint(main_bp)
+    app.register_blueprint(converter_bp)
+    return app
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True) 
\ No newline at end of file
+    create_app().run(host='0.0.0.0', port=5000, debug=True) 
\ No newline at end of file
@@ -0,0 +1,525 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the Flask server.
+
+Usage:
+    python benchmark.py download [--size-mb 64] [--requests 20]
+    python benchmark.py download --url http://127.0.0.1:5000/download/big.bin --pid <server pid>
+    python benchmark.py images [--count 40] [--format jpg] [--threads 4]
+    python benchmark.py mixed [--videos 4] [--clips 16]
+    python benchmark.py reduce-video [--seconds 600] [--target-mb 50]
+    python benchmark.py ocr [--count 12]
+    python benchmark.py yt [--items 6] [--server-kbps 512]
+    python benchmark.py serve [--clients 16] [--seconds 10]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def _fmt_rate(nbytes, seconds):
+    if seconds <= 0:
+        return 'n/a'
+    return f"{nbytes / seconds / (1024 * 1024):.1f} MB/s"
+
+
+def _proc_cpu_seconds(pid):
+    """utime + stime of a process from /proc (Linux only)."""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def _drain(response):
+    total = 0
+    for chunk in response.response:
+        total += len(chunk)
+    response.close()
+    return total
+
+
+def bench_download(args):
+    """Bytes served per CPU-second: send_from_directory vs file_serving.serve_file."""
+    if args.url:
+        return _bench_download_url(args)
+    from flask import Flask, send_from_directory
+    from file_serving import serve_file
+
+    folder = tempfile.mkdtemp(prefix='bench_download_')
+    name = 'payload.bin'
+    size = args.size_mb * 1024 * 1024
+    with open(os.path.join(folder, name), 'wb') as f:
+        for _ in range(args.size_mb):
+            f.write(os.urandom(1024 * 1024))
+
+    app = Flask(__name__)
+
+    @app.route('/before/<filename>')
+    def before(filename):
+        return send_from_directory(folder, filename, as_attachment=True)
+
+    @app.route('/after/<filename>')
+    def after(filename):
+        return serve_file(folder, filename, as_attachment=True)
+
+    client = app.test_client()
+    rng = random.Random(0)
+    print(f"Payload: {args.size_mb} MB, {args.requests} requests per scenario")
+    for scenario in ('full', 'range'):
+        for variant in ('before', 'after'):
+            served = 0
+            cpu_start = time.process_time()
+            wall_start = time.perf_counter()
+            for _ in range(args.requests):
+                headers = {}
+                if scenario == 'range':
+                    start = rng.randrange(0, size - 1024 * 1024)
+                    headers['Range'] = f"bytes={start}-{start + 1024 * 1024 - 1}"
+                served += _drain(client.get(f"/{variant}/{name}", headers=headers, buffered=False))
+            cpu = time.process_time() - cpu_start
+            wall = time.perf_counter() - wall_start
+            print(f"  {scenario:5s} {variant:6s}: {served / (1024 * 1024):8.1f} MB, "
+                  f"{_fmt_rate(served, cpu)} per CPU-second, {_fmt_rate(served, wall)} wall")
+    os.remove(os.path.join(folder, name))
+    os.rmdir(folder)
+
+
+def _bench_download_url(args):
+    import requests
+    cpu_start = _proc_cpu_seconds(args.pid) if args.pid else None
+    wall_start = time.perf_counter()
+    served = 0
+    for _ in range(args.requests):
+        with requests.get(args.url, stream=True) as resp:
+            resp.raise_for_status()
+            for chunk in resp.iter_content(1024 * 1024):
+                served += len(chunk)
+    wall = time.perf_counter() - wall_start
+    print(f"Downloaded {served / (1024 * 1024):.1f} MB in {wall:.2f}s ({_fmt_rate(served, wall)})")
+    if cpu_start is not None:
+        cpu = _proc_cpu_seconds(args.pid) - cpu_start
+        print(f"Server CPU: {cpu:.2f}s -> {_fmt_rate(served, cpu)} per CPU-second")
+
+
+def bench_images(args):
+    """Images per second for convert_image: Pillow in a thread pool vs one ImageMagick process per image."""
+    import shutil
+    from concurrent.futures import ThreadPoolExecutor
+    from PIL import Image
+    from converter import image_converter
+
+    folder = tempfile.mkdtemp(prefix='bench_images_')
+    width, height = args.width, args.height
+    inputs = []
+    for i in range(args.count):
+        # Gradient plus noise, so encoders have realistic work to do
+        img = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+        noise = Image.frombytes('RGB', (width, height), os.urandom(width * height * 3))
+        path = os.path.join(folder, f"input_{i}.png")
+        Image.blend(img, noise, 0.2).save(path)
+        inputs.append(path)
+    image_converter.UPLOADS_DIR = os.path.join(folder, 'out')
+
+    engines = ['pillow']
+    try:
+        image_converter.find_magick()
+        engines.append('magick')
+    except FileNotFoundError:
+        print("ImageMagick not found, only measuring Pillow")
+    print(f"{args.count} images {width}x{height} PNG -> {args.format}, {args.threads} threads")
+    for engine in engines:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as pool:
+            list(pool.map(lambda p: image_converter.convert_image(p, args.format, engine=engine), inputs))
+        wall = time.perf_counter() - start
+        print(f"  {engine:6s}: {wall:6.2f}s, {args.count / wall:7.1f} images/s")
+    shutil.rmtree(folder, ignore_errors=True)
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def bench_mixed(args):
+    """
+    Mixed load of big video encodes and small audio conversions, started together:
+    every process on its own vs through converter.scheduler.
+    """
+    import shutil
+    import subprocess
+    from concurrent.futures import ThreadPoolExecutor
+    from converter import scheduler
+
+    folder = tempfile.mkdtemp(prefix='bench_mixed_')
+    clip = os.path.join(folder, 'clip.wav')
+    subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-f', 'lavfi', '-i', 'sine=duration=5', clip], check=True)
+
+    def video_job(n):
+        return ['ffmpeg', '-y', '-loglevel', 'error', '-f', 'lavfi', '-i',
+                f'testsrc2=duration={args.video_seconds}:size=1280x720:rate=30',
+                '-c:v', 'libx264', '-preset', 'medium', os.path.join(folder, f'video_{n}.mp4')]
+
+    def audio_job(n):
+        return ['ffmpeg', '-y', '-loglevel', 'error', '-i', clip, os.path.join(folder, f'clip_{n}.mp3')]
+
+    print(f"{args.videos} video encodes + {args.clips} audio clips, {scheduler.CORE_BUDGET} core budget")
+    for variant in ('direct', 'scheduled'):
+        sched = scheduler.Scheduler()
+
+        def timed(command, small):
+            start = time.perf_counter()
+            if variant == 'direct':
+                subprocess.run(command, check=True)
+            else:
+                sched.run(command, want=1 if small else None, express=small, check=True)
+            return small, time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.videos + args.clips) as pool:
+            futures = [pool.submit(timed, video_job(i), False) for i in range(args.videos)]
+            futures += [pool.submit(timed, audio_job(i), True) for i in range(args.clips)]
+            results = [f.result() for f in futures]
+        wall = time.perf_counter() - start
+        small = [t for is_small, t in results if is_small]
+        big = [t for is_small, t in results if not is_small]
+        print(f"  {variant:9s}: total {wall:6.2f}s, {len(results) / wall:5.2f} jobs/s, "
+              f"audio p50 {_percentile(small, 50):.2f}s p95 {_percentile(small, 95):.2f}s, "
+              f"video avg {sum(big) / len(big):.2f}s")
+    shutil.rmtree(folder, ignore_errors=True)
+
+
+def bench_reduce_video(args):
+    """Wall-clock time of reduce_video_size encoding in one piece vs keyframe segments in parallel."""
+    import shutil
+    import subprocess
+    from converter import video_converter, scheduler
+
+    folder = tempfile.mkdtemp(prefix='bench_reduce_')
+    source = os.path.join(folder, 'source.mp4')
+    subprocess.run(['ffmpeg', '-y', '-loglevel', 'error',
+                    '-f', 'lavfi', '-i', f'testsrc2=duration={args.seconds}:size={args.size}:rate=30',
+                    '-f', 'lavfi', '-i', f'sine=duration={args.seconds}',
+                    '-c:v', 'libx264', '-preset', 'ultrafast', '-g', '60', '-c:a', 'aac', '-shortest', source],
+                   check=True)
+    video_converter.UPLOADS_DIR = os.path.join(folder, 'out')
+    print(f"{args.seconds}s {args.size} source, target {args.target_mb} MB, {scheduler.CORE_BUDGET} core budget")
+    for variant, min_duration in (('single', float('inf')), ('segmented', 0)):
+        video_converter.PARALLEL_MIN_DURATION = min_duration
+        start = time.perf_counter()
+        output = video_converter.reduce_video_size(source, target_mb=args.target_mb, preset=args.preset)
+        wall = time.perf_counter() - start
+        print(f"  {variant:9s}: {wall:7.2f}s, {os.path.getsize(output) / (1024 * 1024):.1f} MB")
+        os.remove(output)
+    shutil.rmtree(folder, ignore_errors=True)
+
+
+def _edit_distance(a, b):
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+def _char_accuracy(expected, actual):
+    expected = ' '.join(expected.split())
+    actual = ' '.join(actual.split())
+    return max(0.0, 1 - _edit_distance(expected, actual) / max(1, len(expected)))
+
+
+def _ocr_corpus(count, seed=0):
+    """Synthetic pages: clean scans, skewed noisy scans with dark borders, and oversized photos."""
+    from PIL import Image, ImageDraw, ImageFont, ImageOps
+    import numpy as np
+    rng = random.Random(seed)
+    words = ('invoice total amount receipt number date paid customer order item price quantity '
+             'delivery address account balance tax discount payment reference').split()
+    corpus = []
+    for n in range(count):
+        lines = [' '.join(rng.choice(words) for _ in range(6)) + f" {rng.randint(10, 9999)}" for _ in range(8)]
+        page = Image.new('L', (1700, 1000), 245)
+        draw = ImageDraw.Draw(page)
+        font = ImageFont.load_default(size=36)
+        for i, line in enumerate(lines):
+            draw.text((80, 80 + i * 100), line, fill=25, font=font)
+        kind = ('clean', 'noisy', 'photo')[n % 3]
+        if kind == 'noisy':
+            page = page.rotate(rng.uniform(-4, 4), expand=True, fillcolor=245, resample=Image.BICUBIC)
+            noise = np.random.default_rng(n).normal(0, 25, (page.height, page.width))
+            page = Image.fromarray(np.clip(np.asarray(page, dtype=np.float32) + noise, 0, 255).astype(np.uint8))
+            page = ImageOps.expand(page, 60, fill=40)
+        elif kind == 'photo':
+            page = page.resize((page.width * 4, page.height * 4), Image.BICUBIC).convert('RGB')
+        corpus.append((kind, page, '\n'.join(lines)))
+    return corpus
+
+
+def bench_ocr(args):
+    """OCR latency and character accuracy on a synthetic corpus, raw images vs preprocess_for_ocr."""
+    import pytesseract
+    from converter.ocr_converter import preprocess_for_ocr
+
+    corpus = _ocr_corpus(args.count)
+    print(f"{len(corpus)} synthetic pages (clean, skewed+noisy+border, 4x oversized photo)")
+    try:
+        pytesseract.get_tesseract_version()
+        have_tesseract = True
+    except Exception:
+        have_tesseract = False
+        print("tesseract not found, only timing the preprocessing")
+    for variant in ('raw', 'preprocessed'):
+        results = {}
+        for kind, page, expected in corpus:
+            start = time.perf_counter()
+            image = preprocess_for_ocr(page) if variant == 'preprocessed' else page
+            text = pytesseract.image_to_string(image) if have_tesseract else expected
+            elapsed = time.perf_counter() - start
+            results.setdefault(kind, []).append((elapsed, _char_accuracy(expected, text)))
+        for kind, rows in results.items():
+            latency = sum(r[0] for r in rows) / len(rows)
+            accuracy = sum(r[1] for r in rows) / len(rows)
+            shown = f"{accuracy * 100:5.1f}% chars" if have_tesseract else "n/a"
+            print(f"  {variant:12s} {kind:5s}: {latency * 1000:7.1f} ms/page, {shown}")
+
+
+def _media_server(folder, kbps):
+    """Local stand-in for a media host: serves folder, each connection throttled to kbps."""
+    import functools
+    import threading
+    from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+    class Handler(SimpleHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def copyfile(self, source, outputfile):
+            chunk = 64 * 1024
+            try:
+                while True:
+                    data = source.read(chunk)
+                    if not data:
+                        break
+                    outputfile.write(data)
+                    time.sleep(len(data) / (kbps * 1024))
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(Handler, directory=folder))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def bench_yt(args):
+    """Playlist sync time against a local feed: one item at a time vs the download manager."""
+    import shutil
+    import subprocess
+    from converter.yt_downloader import DownloadManager
+
+    folder = tempfile.mkdtemp(prefix='bench_yt_')
+    media = os.path.join(folder, 'media')
+    os.makedirs(media)
+    for n in range(1, args.items + 1):
+        subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-f', 'lavfi',
+                        '-i', f'sine=frequency={200 + 50 * n}:duration={args.seconds}',
+                        '-c:a', 'aac', '-b:a', '128k', os.path.join(media, f'track{n}.m4a')], check=True)
+    server = _media_server(media, args.server_kbps)
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    entries = ''.join(f'<item><title>Track {n}</title><guid>track{n}</guid>'
+                      f'<enclosure url="{base}/track{n}.m4a" type="audio/mp4"/></item>'
+                      for n in range(1, args.items + 1))
+    with open(os.path.join(media, 'feed.xml'), 'w') as f:
+        f.write(f'<?xml version="1.0"?><rss version="2.0"><channel><title>Bench</title>'
+                f'<link>{base}/</link>{entries}</channel></rss>')
+    print(f"{args.items} items of {args.seconds}s AAC, server {args.server_kbps} KB/s per connection")
+    managers = {}
+    # 'resync' repeats the manager run: the listing comes from cache and every item from the archive
+    for variant, options in (('serial', {'concurrent_items': 1, 'fragment_threads': 1}),
+                             ('manager', {'rate_limit': args.rate_limit}),
+                             ('resync', None)):
+        manager = managers['manager'] if options is None else DownloadManager(out_dir=os.path.join(folder, variant), **options)
+        managers[variant] = manager
+        start = time.perf_counter()
+        task = manager.start(f"{base}/feed.xml", 'mp3', playlist=True)
+        task.wait()
+        wall = time.perf_counter() - start
+        info = task.to_dict(items=False)
+        print(f"  {variant:7s}: {wall:6.2f}s, {_fmt_rate(info['downloaded_bytes'], wall)}, {info['report']}")
+    server.shutdown()
+    shutil.rmtree(folder, ignore_errors=True)
+
+
+def _free_port():
+    import socket
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _start_server(variant, port, env):
+    """Start the app under the dev server or wsgi.py and wait until /test answers."""
+    import subprocess
+    import urllib.request
+    here = os.path.dirname(os.path.abspath(__file__))
+    if variant == 'dev':
+        command = [sys.executable, '-c', 'from app import create_app; '
+                   f'create_app().run(host="127.0.0.1", port={port}, threaded=True)']
+    else:
+        command = [sys.executable, os.path.join(here, 'wsgi.py')]
+    env = dict(os.environ, WEB_BIND=f'127.0.0.1:{port}', **env)
+    process = subprocess.Popen(command, cwd=here, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/test', timeout=1).read()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"{variant} server did not start on port {port}")
+
+
+def _hammer(port, request, clients, seconds):
+    """Requests per second and p95 latency of clients keep-alive connections sending request for seconds."""
+    import http.client
+    from concurrent.futures import ThreadPoolExecutor
+
+    def client(n):
+        latencies = []
+        connection = None
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            if connection is None:
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            method, path, body, headers = request(n, len(latencies))
+            start = time.perf_counter()
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            if response.status >= 400:
+                raise RuntimeError(f"{method} {path}: HTTP {response.status}")
+            latencies.append(time.perf_counter() - start)
+            if response.will_close:
+                connection.close()
+                connection = None
+        if connection is not None:
+            connection.close()
+        return latencies
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        latencies = [t for result in pool.map(client, range(clients)) for t in result]
+    wall = time.perf_counter() - start
+    return len(latencies) / wall, _percentile(latencies, 95)
+
+
+def bench_serve(args):
+    """Requests per second for /test, /files and small uploads: Flask dev server vs wsgi.py workers."""
+    import shutil
+    import uuid
+    folder = tempfile.mkdtemp(prefix='bench_serve_')
+    payload = os.urandom(args.upload_kb * 1024)
+    boundary = uuid.uuid4().hex
+    names = []
+
+    def upload(n, i):
+        name = f"bench_{boundary[:8]}_{n}_{i}.txt"
+        names.append(name)
+        body = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{name}"\r\n'
+                f'Content-Type: application/octet-stream\r\n\r\n').encode() + payload + f'\r\n--{boundary}--\r\n'.encode()
+        return 'POST', '/upload', body, {'Content-Type': f'multipart/form-data; boundary={boundary}'}
+
+    requests = {
+        'test': lambda n, i: ('GET', '/test', None, {}),
+        'files': lambda n, i: ('GET', '/files?limit=50', None, {}),
+        'upload': upload,
+    }
+    env = {'WEB_APP_STORE': os.path.join(folder, 'state.sqlite3'),
+           'WEB_WORKERS': str(args.workers), 'WEB_THREADS': str(args.threads)}
+    print(f"{args.clients} clients, {args.seconds}s per endpoint, wsgi: {args.workers} workers x {args.threads} threads, "
+          f"uploads of {args.upload_kb} KB")
+    try:
+        for variant in ('dev', 'wsgi'):
+            port = _free_port()
+            process = _start_server(variant, port, env)
+            try:
+                for endpoint, request in requests.items():
+                    rate, p95 = _hammer(port, request, args.clients, args.seconds)
+                    print(f"  {variant:4s} {endpoint:6s}: {rate:8.1f} req/s, p95 {p95 * 1000:7.1f} ms")
+            finally:
+                process.terminate()
+                process.wait()
+    finally:
+        uploads = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
+        for name in names:
+            try:
+                os.remove(os.path.join(uploads, name))
+            except OSError:
+                pass
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('download', help='bytes served per CPU-second for /download and /uploads')
+    p.add_argument('--size-mb', type=int, default=64)
+    p.add_argument('--requests', type=int, default=20)
+    p.add_argument('--url', help='measure a running server instead of the in-process comparison')
+    p.add_argument('--pid', type=int, help='server process id, to read its CPU time from /proc')
+    p.set_defaults(func=bench_download)
+
+    p = sub.add_parser('images', help='images per second for convert_image, Pillow vs ImageMagick')
+    p.add_argument('--count', type=int, default=40)
+    p.add_argument('--format', default='jpg')
+    p.add_argument('--width', type=int, default=1920)
+    p.add_argument('--height', type=int, default=1080)
+    p.add_argument('--threads', type=int, default=os.cpu_count() or 2)
+    p.set_defaults(func=bench_images)
+
+    p = sub.add_parser('mixed', help='throughput and small-job latency under mixed ffmpeg load, with and without the scheduler')
+    p.add_argument('--videos', type=int, default=4)
+    p.add_argument('--clips', type=int, default=16)
+    p.add_argument('--video-seconds', type=int, default=10)
+    p.set_defaults(func=bench_mixed)
+
+    p = sub.add_parser('reduce-video', help='video reduction wall time, single encode vs parallel segments')
+    p.add_argument('--seconds', type=int, default=600)
+    p.add_argument('--size', default='1280x720')
+    p.add_argument('--target-mb', type=float, default=50)
+    p.add_argument('--preset', default='veryfast')
+    p.set_defaults(func=bench_reduce_video)
+
+    p = sub.add_parser('ocr', help='OCR latency and character accuracy, with and without preprocessing')
+    p.add_argument('--count', type=int, default=12)
+    p.set_defaults(func=bench_ocr)
+
+    p = sub.add_parser('yt', help='playlist sync time against a local media server: serial, download manager, re-sync')
+    p.add_argument('--items', type=int, default=6)
+    p.add_argument('--seconds', type=int, default=60)
+    p.add_argument('--server-kbps', type=int, default=512)
+    p.add_argument('--rate-limit', type=int, default=0, help='total bytes/s cap for the manager run, 0 = none')
+    p.set_defaults(func=bench_yt)
+
+    p = sub.add_parser('serve', help='requests per second for /test, /files and small uploads, dev server vs wsgi.py')
+    p.add_argument('--clients', type=int, default=16)
+    p.add_argument('--seconds', type=float, default=10)
+    p.add_argument('--workers', type=int, default=min(4, os.cpu_count() or 2))
+    p.add_argument('--threads', type=int, default=8)
+    p.add_argument('--upload-kb', type=int, default=64)
+    p.set_defaults(func=bench_serve)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,33 +1,111 @@
 import os
+import time
 import zipfile
 import tempfile
-from werkzeug.utils import secure_filename
-
-def archive_files_to_zip(files):
-    temp_dir = tempfile.mkdtemp()
-    zip_name = os.path.join(temp_dir, 'archive.zip')
-    with zipfile.ZipFile(zip_name, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        for file in files:
-            filename = secure_filename(os.path.basename(file.filename))
-            file_path = os.path.join(temp_dir, filename)
-            file.save(file_path)
-            zipf.write(file_path, arcname=filename)
+from converter import progress
+
+UPLOADS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'uploads'))
+
+CHUNK_SIZE = 256 * 1024
+# Already-compressed formats are stored as-is; deflating them only burns CPU
+STORED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.ico', '.mp3', '.m4a', '.aac', '.ogg', '.opus',
+                     '.mp4', '.mkv', '.mov', '.avi', '.webm', '.zip', '.rar', '.7z', '.gz', '.pdf', '.docx'}
+
+class _ChunkBuffer:
+    """Write-only sink for ZipFile; what has been written so far is collected with drain()."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def stream_zip(members, total=None):
+    """
+    Build a ZIP on the fly and yield it in chunks. members yields
+    (arcname, source) pairs where source is a path, a binary file object or bytes.
+    Each member is read and compressed chunk by chunk, so nothing is staged on disk.
+    total (the number of members, if known) only goes into the progress reports.
+    """
+    sink = _ChunkBuffer()
+    written = 0
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        for arcname, source in members:
+            progress.report('zip', members=written, total=total)
+            ext = os.path.splitext(arcname)[1].lower()
+            info = zipfile.ZipInfo(arcname, date_time=time.localtime()[:6])
+            info.compress_type = zipfile.ZIP_STORED if ext in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+            info.external_attr = 0o644 << 16
+            if isinstance(source, (bytes, bytearray)):
+                zipf.writestr(info, source)
+            else:
+                close_source = isinstance(source, str)
+                src = open(source, 'rb') if close_source else source
+                try:
+                    with zipf.open(info, 'w', force_zip64=True) as dest:
+                        while True:
+                            chunk = src.read(CHUNK_SIZE)
+                            if not chunk:
+                                break
+                            dest.write(chunk)
+                            data = sink.drain()
+                            if data:
+                                yield data
+                finally:
+                    if close_source:
+                        src.close()
+            data = sink.drain()
+            if data:
+                yield data
+            written += 1
+    yield sink.drain()
+    progress.report('zip', force=True, members=written, total=total)
+
+def _new_zip_path(name):
+    out_dir = os.path.join(UPLOADS_DIR, 'archives')
+    os.makedirs(out_dir, exist_ok=True)
+    fd, zip_path = tempfile.mkstemp(suffix=f'_{name}', dir=out_dir)
+    os.close(fd)
+    return zip_path
+
+def iter_zip_members(zipf):
+    """
+    Yield (arcname, file object) for every file in an open ZipFile, read
+    straight from the archive without extracting. Folder structure is kept;
+    absolute and '..' path parts are dropped.
+    """
+    for info in zipf.infolist():
+        if info.is_dir():
+            continue
+        parts = [p for p in info.filename.replace('\\', '/').split('/') if p not in ('', '.', '..')]
+        if not parts:
+            continue
+        with zipf.open(info) as member:
+            yield '/'.join(parts), member
+
+def _write_stream(chunks, path):
+    with open(path, 'wb') as f:
+        for chunk in chunks:
+            f.write(chunk)
+
+def archive_files_to_zip(file_paths):
+    zip_name = _new_zip_path('archive.zip')
+    _write_stream(stream_zip(((os.path.basename(p), p) for p in file_paths), len(file_paths)), zip_name)
     return zip_name
 
-def extract_zip_to_zip(zip_file):
-    temp_dir = tempfile.mkdtemp()
-    zip_path = os.path.join(temp_dir, secure_filename(os.path.basename(zip_file.filename)))
-    zip_file.save(zip_path)
-    extract_dir = os.path.join(temp_dir, 'extracted')
-    os.makedirs(extract_dir, exist_ok=True)
-    with zipfile.ZipFile(zip_path, 'r') as zipf:
-        zipf.extractall(extract_dir)
-    # Re-zip the extracted files (preserving folder structure)
-    out_zip = os.path.join(temp_dir, 'unzipped_contents.zip')
-    with zipfile.ZipFile(out_zip, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        for root, dirs, files in os.walk(extract_dir):
-            for file in files:
-                abs_path = os.path.join(root, file)
-                rel_path = os.path.relpath(abs_path, extract_dir)
-                zipf.write(abs_path, arcname=rel_path)
-    return out_zip 
\ No newline at end of file
+def extract_zip_to_zip(zip_path):
+    # Re-zip the contents (preserving folder structure) member by member, nothing is extracted to disk
+    out_zip = _new_zip_path('unzipped_contents.zip')
+    with zipfile.ZipFile(zip_path, 'r') as src:
+        total = sum(1 for info in src.infolist() if not info.is_dir())
+        _write_stream(stream_zip(iter_zip_members(src), total), out_zip)
+    return out_zip
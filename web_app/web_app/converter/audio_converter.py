@@ -1,5 +1,7 @@
 import os
 import subprocess
+from converter import scheduler
+from converter.video_converter import probe_media
 
 UPLOADS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'uploads'))
 
@@ -11,7 +13,7 @@ def mp3_to_wav(input_path):
     command = [
         "ffmpeg", "-i", input_path, "-y", output_path
     ]
-    subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    scheduler.run(command, want=1, express=True, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
     return output_path
 
 def wav_to_mp3(input_path):
@@ -22,7 +24,7 @@ def wav_to_mp3(input_path):
     command = [
         "ffmpeg", "-i", input_path, "-y", output_path
     ]
-    subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    scheduler.run(command, want=1, express=True, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
     return output_path
 
 def m4a_to_mp3(input_path):
@@ -33,7 +35,7 @@ def m4a_to_mp3(input_path):
     command = [
         "ffmpeg", "-i", input_path, "-y", output_path
     ]
-    subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    scheduler.run(command, want=1, express=True, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
     return output_path
 
 def mp3_to_m4a(input_path):
@@ -44,5 +46,53 @@ def mp3_to_m4a(input_path):
     command = [
         "ffmpeg", "-i", input_path, "-y", output_path
     ]
-    subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    return output_path 
\ No newline at end of file
+    scheduler.run(command, want=1, express=True, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return output_path
+
+
+# Size reduction: codec -> (ffmpeg encoder, extension, lowest sensible bitrate in kbps)
+REDUCE_CODECS = {
+    'opus': ('libopus', 'opus', 6),
+    'aac': ('aac', 'm4a', 16),
+    'mp3': ('libmp3lame', 'mp3', 32),
+}
+DEFAULT_BITRATE_KBPS = {'opus': 48, 'aac': 96, 'mp3': 96}
+OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+CONTAINER_OVERHEAD = 0.02
+
+def reduce_audio_size(input_path, codec='opus', bitrate_kbps=None, target_mb=None, mono=False, sample_rate=None):
+    """
+    Re-encode audio (or the audio track of a video) to a smaller file.
+    codec: 'opus' (best for voice), 'aac' or 'mp3'.
+    bitrate_kbps, or target_mb to derive the bitrate from the duration; otherwise a per-codec default.
+    mono: downmix to one channel. sample_rate: resample, e.g. 16000 for voice memos.
+    Returns the output file path.
+    """
+    if codec not in REDUCE_CODECS:
+        raise ValueError(f"Unsupported codec for audio reduction: {codec}")
+    encoder, ext, min_kbps = REDUCE_CODECS[codec]
+    if sample_rate and codec == 'opus' and sample_rate not in OPUS_SAMPLE_RATES:
+        raise ValueError(f"Opus supports sample rates {', '.join(map(str, OPUS_SAMPLE_RATES))}")
+    if target_mb:
+        duration = probe_media(input_path)['duration']
+        bitrate_kbps = int(target_mb * 8 * 1024 * (1 - CONTAINER_OVERHEAD) / max(duration, 0.1))
+        if bitrate_kbps < min_kbps:
+            raise ValueError(f"Target size of {target_mb} MB is too small for {duration:.0f}s of {codec}")
+    bitrate_kbps = max(min_kbps, int(bitrate_kbps or DEFAULT_BITRATE_KBPS[codec]))
+
+    out_dir = os.path.join(UPLOADS_DIR, f'audio_reduced_{codec}')
+    os.makedirs(out_dir, exist_ok=True)
+    base = os.path.splitext(os.path.basename(input_path))[0]
+    output_path = os.path.join(out_dir, f"{base}_reduced.{ext}")
+    command = ["ffmpeg", "-i", input_path, "-vn", "-map_metadata", "0", "-c:a", encoder, "-b:a", f"{bitrate_kbps}k"]
+    if mono:
+        command += ["-ac", "1"]
+    if sample_rate:
+        command += ["-ar", str(sample_rate)]
+    if codec == 'opus':
+        command += ["-application", "voip" if bitrate_kbps <= 32 else "audio"]
+    if codec == 'aac':
+        command += ["-movflags", "+faststart"]
+    command += ["-y", output_path]
+    scheduler.run(command, want=1, express=True, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return output_path
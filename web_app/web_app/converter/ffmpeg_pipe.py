@@ -0,0 +1,225 @@
+"""
+Pipe-mode ffmpeg: the input is fed to ffmpeg's stdin while its stdout is
+streamed back, so conversion overlaps with upload and download and no input
+temp file is written.
+
+ffmpeg runs on its own thread and its output is spooled (in memory, on disk
+past SPOOL_MEMORY), so it finishes and frees its scheduler slot at its own
+pace, however slowly the client downloads.
+
+MP4-family inputs can only be read from a pipe when the 'moov' atom comes
+before 'mdat' (faststart). is_streamable() checks the first bytes so callers
+can fall back to the file-based converters otherwise.
+"""
+import os
+import struct
+import logging
+import tempfile
+import threading
+import subprocess
+
+from converter import scheduler
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+PROBE_SIZE = 64 * 1024  # enough to see the top-level atoms before moov/mdat
+SPOOL_MEMORY = 8 * 1024 * 1024  # output kept in memory before the spool moves to disk
+
+# direction -> (ffmpeg output arguments, output extension, mimetype)
+PIPE_DIRECTIONS = {
+    'mp3_to_wav': (['-f', 'wav'], 'wav', 'audio/wav'),
+    'wav_to_mp3': (['-f', 'mp3'], 'mp3', 'audio/mpeg'),
+    'm4a_to_mp3': (['-f', 'mp3'], 'mp3', 'audio/mpeg'),
+    'mp3_to_m4a': (['-c:a', 'aac', '-f', 'mp4', '-movflags', 'frag_keyframe+empty_moov'], 'm4a', 'audio/mp4'),
+    'mp4_to_mp3': (['-vn', '-acodec', 'libmp3lame', '-f', 'mp3'], 'mp3', 'audio/mpeg'),
+}
+# Inputs in MP4 containers, which need the moov atom up front to be read from a pipe
+MP4_INPUTS = {'m4a_to_mp3', 'mp4_to_mp3'}
+
+
+def is_streamable(direction, head):
+    """True if the input starting with head can be converted from a pipe."""
+    if direction not in MP4_INPUTS:
+        return True
+    offset = 0
+    while offset + 8 <= len(head):
+        size, box_type = struct.unpack('>I4s', head[offset:offset + 8])
+        if box_type == b'moov':
+            return True
+        if box_type == b'mdat':
+            return False
+        if size == 1:  # 64-bit size follows the type
+            if offset + 16 > len(head):
+                return False
+            size = struct.unpack('>Q', head[offset + 8:offset + 16])[0]
+        elif size == 0:  # box runs to end of file
+            return False
+        if size < 8:
+            return False
+        offset += size
+    return False
+
+
+class PrefixedStream:
+    """A read()-able stream that yields head before the rest of stream (after probing it)."""
+
+    def __init__(self, head, stream):
+        self.head = head
+        self.stream = stream
+
+    def read(self, size=-1):
+        if not self.head:
+            return self.stream.read(size)
+        if size is None or size < 0:
+            data, self.head = self.head + self.stream.read(), b''
+            return data
+        data, self.head = self.head[:size], self.head[size:]
+        return data
+
+    def close(self):
+        self.stream.close()
+
+
+def _feed(process, head, stream):
+    try:
+        if head:
+            process.stdin.write(head)
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            process.stdin.write(chunk)
+    except (BrokenPipeError, OSError, ValueError):
+        # ffmpeg exited early (bad input or the client went away); the reader reports it
+        pass
+    finally:
+        try:
+            process.stdin.close()
+        except OSError:
+            pass
+
+
+class _Spool:
+    """ffmpeg's output, written by the ffmpeg thread and read at the client's pace."""
+
+    def __init__(self):
+        self._file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY)
+        self._cond = threading.Condition()
+        self._written = 0
+        self._read = 0
+        self._finished = False
+        self._closed = False
+
+    def write(self, data):
+        with self._cond:
+            if self._closed:
+                return
+            self._file.seek(0, os.SEEK_END)
+            self._file.write(data)
+            self._written += len(data)
+            self._cond.notify_all()
+
+    def finish(self):
+        with self._cond:
+            self._finished = True
+            self._cond.notify_all()
+
+    def read(self, size):
+        """Up to size bytes, waiting for ffmpeg if need be; b'' once all output was read."""
+        with self._cond:
+            while self._read == self._written and not self._finished:
+                self._cond.wait()
+            self._file.seek(self._read)
+            data = self._file.read(min(size, self._written - self._read))
+            self._read += len(data)
+            return data
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._file.close()
+
+
+class _PipeRun(threading.Thread):
+    """One ffmpeg process, run under a scheduler slot that is freed as soon as it exits."""
+
+    def __init__(self, direction, command, stream, head):
+        super().__init__(name=f'ffmpeg-{direction}', daemon=True)
+        self.direction = direction
+        self.command = command
+        self.stream = stream
+        self.head = head
+        self.output = _Spool()
+        self.error = None
+        self._process = None
+        self._stopped = False
+        self._lock = threading.Lock()
+
+    def run(self):
+        try:
+            # Audio codecs are single-threaded, one core slot is enough
+            with scheduler.slots('ffmpeg', express=True) as cores:
+                with self._lock:
+                    if self._stopped:
+                        return
+                    self._process = subprocess.Popen(scheduler.with_threads(self.command, cores), stdin=subprocess.PIPE,
+                                                     stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                self._pump(self._process)
+        except Exception as e:
+            self.error = f"ffmpeg {self.direction} failed: {e}"
+        finally:
+            self.output.finish()
+
+    def _pump(self, process):
+        errors = []
+        feeder = threading.Thread(target=_feed, args=(process, self.head, self.stream), daemon=True)
+        drainer = threading.Thread(target=lambda: errors.append(process.stderr.read()), daemon=True)
+        feeder.start()
+        drainer.start()
+        try:
+            while True:
+                chunk = process.stdout.read1(CHUNK_SIZE)
+                if not chunk:
+                    break
+                self.output.write(chunk)
+            process.wait()
+            drainer.join()
+        finally:
+            process.stdout.close()
+            feeder.join(timeout=5)
+        if process.returncode != 0 and not self._stopped:
+            message = b''.join(errors).decode('utf-8', 'replace').strip()
+            self.error = f"ffmpeg {self.direction} failed: {message or process.returncode}"
+
+    def stop(self):
+        """Kill ffmpeg if it is still running (the consumer gave up)."""
+        with self._lock:
+            self._stopped = True
+            process = self._process
+        if process is not None and process.poll() is None:
+            process.kill()
+
+
+def stream_convert(direction, stream, head=b''):
+    """
+    Convert head + the rest of stream with ffmpeg and yield the output in chunks.
+    Raises RuntimeError if ffmpeg fails; the process is killed if the consumer
+    stops early.
+    """
+    out_args = PIPE_DIRECTIONS[direction][0]
+    command = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-i', 'pipe:0'] + out_args + ['pipe:1']
+    run = _PipeRun(direction, command, stream, head)
+    run.start()
+    try:
+        while True:
+            chunk = run.output.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+        run.join()
+        if run.error:
+            raise RuntimeError(run.error)
+    finally:
+        run.stop()
+        run.output.close()
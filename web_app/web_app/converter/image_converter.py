@@ -1,24 +1,94 @@
 import os
+import shutil
 import subprocess
-from PIL import Image
+from PIL import Image, UnidentifiedImageError
+from converter import scheduler
 
 UPLOADS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'uploads'))
 
-def convert_image(input_path, output_format):
+# Output formats the in-process Pillow engine writes; anything else goes to ImageMagick
+PILLOW_FORMATS = {
+    'png': 'PNG',
+    'jpg': 'JPEG',
+    'jpeg': 'JPEG',
+    'bmp': 'BMP',
+    'webp': 'WEBP',
+    'gif': 'GIF',
+    'tif': 'TIFF',
+    'tiff': 'TIFF',
+}
+ANIMATED_FORMATS = {'GIF', 'WEBP'}
+NO_ALPHA_FORMATS = {'JPEG'}
+
+MAGICK_CANDIDATES = [
+    os.environ.get('MAGICK_PATH'),
+    shutil.which('magick'),
+    shutil.which('convert') if os.name != 'nt' else None,  # ImageMagick 6 on Linux
+    r"C:\Program Files\ImageMagick-7.1.1-Q16-HDRI\magick.exe",
+]
+
+
+def find_magick():
+    for path in MAGICK_CANDIDATES:
+        if path and os.path.exists(path):
+            return path
+    raise FileNotFoundError("ImageMagick not found. Install it or set MAGICK_PATH.")
+
+
+def pillow_can_convert(input_path, output_format):
+    """True if the Pillow engine handles this input extension and output format."""
+    ext = os.path.splitext(input_path)[1].lower()
+    return output_format.lower() in PILLOW_FORMATS and ext in Image.registered_extensions()
+
+
+def _convert_with_pillow(input_path, output_path, output_format):
+    pil_format = PILLOW_FORMATS[output_format.lower()]
+    with Image.open(input_path) as img:
+        if getattr(img, 'n_frames', 1) > 1 and pil_format in ANIMATED_FORMATS:
+            img.save(output_path, pil_format, save_all=True)
+            return
+        img.load()
+        if pil_format in NO_ALPHA_FORMATS:
+            if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+                # Flatten onto white like ImageMagick does for JPEG
+                rgba = img.convert('RGBA')
+                flat = Image.new('RGB', rgba.size, (255, 255, 255))
+                flat.paste(rgba, mask=rgba.getchannel('A'))
+                img = flat
+            elif img.mode != 'RGB':
+                img = img.convert('RGB')
+        img.save(output_path, pil_format)
+
+
+def _convert_with_magick(input_path, output_path):
+    result = scheduler.run(
+        [find_magick(), input_path, output_path], tool='magick', express=True,
+        capture_output=False, text=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    if result.returncode != 0:
+        raise RuntimeError("ImageMagick failed")
+
+
+def convert_image(input_path, output_format, engine='auto'):
     """
-    Convert an image to the specified format (e.g., 'png', 'jpg') using ImageMagick.
+    Convert an image to the specified format (e.g., 'png', 'jpg').
+    Common raster formats are converted in-process with Pillow; other formats, or inputs
+    Pillow can't read, go to ImageMagick. engine can force 'pillow' or 'magick'.
     Returns the output file path.
     """
     out_dir = os.path.join(UPLOADS_DIR, f'image_to_{output_format}')
     os.makedirs(out_dir, exist_ok=True)
     base = os.path.splitext(os.path.basename(input_path))[0]
     output_path = os.path.join(out_dir, f"{base}_converted.{output_format}")
-    result = subprocess.run(
-        [r"C:\Program Files\ImageMagick-7.1.1-Q16-HDRI\magick.exe", input_path, output_path],
-        capture_output=False, text=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
-    )
-    if result.returncode != 0:
-        raise RuntimeError("ImageMagick failed")
+    if engine == 'magick' or (engine == 'auto' and output_format.lower() not in PILLOW_FORMATS):
+        _convert_with_magick(input_path, output_path)
+        return output_path
+    try:
+        _convert_with_pillow(input_path, output_path, output_format)
+    except (UnidentifiedImageError, KeyError, OSError):
+        if engine == 'pillow':
+            raise
+        _convert_with_magick(input_path, output_path)
     return output_path
 
 def image_to_ico(input_path):
@@ -48,7 +118,7 @@ def raster_to_svg(input_path):
     img.save(pbm_path, 'PBM')
     # Call potrace
     command = ["potrace", pbm_path, "-s", "-o", svg_path]
-    subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    scheduler.run(command, express=True, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
     # Clean up temporary PBM file
     if os.path.exists(pbm_path):
         os.remove(pbm_path)
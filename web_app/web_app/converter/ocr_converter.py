@@ -1,46 +1,374 @@
 import pytesseract
-from PIL import Image
+import numpy as np
+from PIL import Image, ImageOps
 import os
 import time
+import atexit
+import shutil
+import hashlib
+import threading
+import subprocess
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from converter import scheduler
+from converter import progress
 
-# Set Tesseract path explicitly to avoid PATH issues
-# Try multiple common installation paths
-tesseract_paths = [
+# Tesseract's OpenMP threads would go around the scheduler's core budget; one per page is faster under load
+os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+
+try:
+    import tesserocr
+    HAVE_TESSEROCR = True
+except ImportError:
+    HAVE_TESSEROCR = False
+
+# Where to look for the tesseract binary (then PATH); resolved on first use, not at import
+TESSERACT_CANDIDATES = [
+    os.environ.get('TESSERACT_PATH'),
     r'C:\Program Files\Tesseract-OCR\tesseract.exe',
     r'C:\Program Files (x86)\Tesseract-OCR\tesseract.exe',
-    r'C:\Users\alsth\AppData\Local\Programs\Tesseract-OCR\tesseract.exe'
 ]
 
-tesseract_found = False
-for path in tesseract_paths:
-    if os.path.exists(path):
-        pytesseract.pytesseract.tesseract_cmd = path
-        tesseract_found = True
-        break
+UPLOADS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'uploads'))
+
+# Preprocessing: tesseract works best on clean black-on-white text at roughly 300 DPI
+OCR_PREPROCESS = os.environ.get('OCR_PREPROCESS', '1').lower() in ('1', 'true', 'yes')
+TARGET_DPI = 300
+MIN_LONG_SIDE = 1000   # upscale smaller images (screenshots, thumbnails)
+MAX_LONG_SIDE = 3500   # downscale huge phone photos; letters stay well above tesseract's minimum height
+THRESHOLD_BIAS = 0.15  # pixels this much darker than their neighbourhood are ink
+MAX_SKEW_DEGREES = 5.0
+SKEW_STEP_DEGREES = 0.25
 
-if not tesseract_found:
-    # If no explicit path found, try to use PATH (fallback)
-    try:
-        import subprocess
-        result = subprocess.run(['tesseract', '--version'], capture_output=True, text=True)
-        if result.returncode == 0:
-            tesseract_found = True
-    except:
-        pass
+def _normalize_scale(img):
+    """Resample to about TARGET_DPI when the DPI is known, and into [MIN_LONG_SIDE, MAX_LONG_SIDE] pixels."""
+    scale = 1.0
+    dpi = img.info.get('dpi')
+    if dpi and dpi[0] and not 200 <= dpi[0] <= 400:
+        scale = TARGET_DPI / float(dpi[0])
+    long_side = max(img.size) * scale
+    if long_side > MAX_LONG_SIDE:
+        scale *= MAX_LONG_SIDE / long_side
+    elif long_side < MIN_LONG_SIDE:
+        scale *= MIN_LONG_SIDE / long_side
+    if abs(scale - 1.0) < 0.05:
+        return img
+    size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+    if scale <= 0.5:
+        # Cheap integer box reduction first, so LANCZOS only sees a few megapixels
+        img = img.reduce(int(1 / scale))
+    return img.resize(size, Image.LANCZOS if scale < 1 else Image.BICUBIC)
 
-if not tesseract_found:
-    raise RuntimeError("Tesseract not found. Please install Tesseract OCR and ensure it's in your PATH or update the paths in this file.")
+def _box_mean(values, radius, axis):
+    """Mean over a sliding window of 2 * radius + 1 along axis (edges padded by repetition)."""
+    pad = [(0, 0), (0, 0)]
+    pad[axis] = (radius + 1, radius)
+    sums = np.cumsum(np.pad(values, pad, mode='edge'), axis=axis, dtype=np.float64)
+    size = 2 * radius + 1
+    if axis == 0:
+        window = sums[size:] - sums[:-size]
+    else:
+        window = sums[:, size:] - sums[:, :-size]
+    return (window / size).astype(np.float32)
 
-UPLOADS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'uploads'))
+def _adaptive_threshold(gray):
+    """Bradley-style local mean threshold (separable box filter); returns a bool array, True = ink."""
+    radius = max(8, min(gray.shape) // 32)
+    local_mean = _box_mean(_box_mean(gray, radius, 0), radius, 1)
+    return gray < local_mean * (1.0 - THRESHOLD_BIAS)
+
+def _estimate_skew(ink):
+    """Angle (degrees) whose horizontal projection of the ink pixels has the sharpest line structure."""
+    step = max(1, max(ink.shape) // 1000)  # a ~1000 px sample is plenty for the angle
+    ys, xs = np.nonzero(ink[::step, ::step])
+    if len(ys) < 100:
+        return 0.0
+    if len(ys) > 200000:
+        keep = np.random.default_rng(0).choice(len(ys), 200000, replace=False)
+        ys, xs = ys[keep], xs[keep]
+    angles = np.arange(-MAX_SKEW_DEGREES, MAX_SKEW_DEGREES + SKEW_STEP_DEGREES / 2, SKEW_STEP_DEGREES)
+    radians = np.deg2rad(angles)
+    # Row of every ink pixel after rotating by each candidate angle, all angles at once
+    rows = np.round(ys[None, :] * np.cos(radians)[:, None] - xs[None, :] * np.sin(radians)[:, None]).astype(np.int64)
+    rows -= rows.min(axis=1, keepdims=True)
+    scores = [np.var(np.bincount(r)) for r in rows]
+    return float(angles[int(np.argmax(scores))])
+
+def _trim_dark_borders(gray):
+    """Slice of gray without the dark scanner borders: outer rows/columns that are mostly dark."""
+    dark = gray < 0.5 * np.median(gray)
+    rows = dark.mean(axis=1)
+    cols = dark.mean(axis=0)
+    top, bottom, left, right = 0, len(rows), 0, len(cols)
+    while top < bottom - 1 and rows[top] > 0.5:
+        top += 1
+    while bottom > top + 1 and rows[bottom - 1] > 0.5:
+        bottom -= 1
+    while left < right - 1 and cols[left] > 0.5:
+        left += 1
+    while right > left + 1 and cols[right - 1] > 0.5:
+        right -= 1
+    return gray[top:bottom, left:right]
+
+def _content_box(ink, margin=10):
+    """Bounding box of the ink plus a margin, or None for a blank image."""
+    rows = np.nonzero(ink.any(axis=1))[0]
+    cols = np.nonzero(ink.any(axis=0))[0]
+    if len(rows) == 0:
+        return None
+    h, w = ink.shape
+    return (max(0, cols[0] - margin), max(0, rows[0] - margin),
+            min(w, cols[-1] + margin + 1), min(h, rows[-1] + margin + 1))
+
+def preprocess_for_ocr(img):
+    """
+    Scale to the DPI range tesseract likes, grayscale, trim scanner borders, binarize with
+    a local threshold, deskew and crop to the text. Returns a black-on-white 'L' image.
+    """
+    if img.format == 'JPEG' and max(img.size) > 2 * MAX_LONG_SIDE:
+        # Let the JPEG decoder downscale huge photos while decoding
+        ratio = MAX_LONG_SIDE / max(img.size)
+        img.draft('L', (int(img.width * ratio), int(img.height * ratio)))
+    img = ImageOps.exif_transpose(img)
+    gray = _trim_dark_borders(np.asarray(_normalize_scale(img.convert('L')), dtype=np.float32))
+    ink = _adaptive_threshold(gray)
+    angle = _estimate_skew(ink)
+    binary = Image.fromarray(np.where(ink, 0, 255).astype(np.uint8), 'L')
+    if abs(angle) >= SKEW_STEP_DEGREES:
+        # The text lines are straight after rotating the pixel rows by angle
+        binary = binary.rotate(angle, resample=Image.NEAREST, expand=True, fillcolor=255)
+        ink = np.asarray(binary) < 128
+    box = _content_box(ink)
+    if box is not None:
+        binary = binary.crop(box)
+    return binary
+
+# OCR engine: tesserocr keeps the language data loaded between images; without it every
+# image starts a tesseract process through pytesseract
+DEFAULT_LANG = 'eng'
+DEFAULT_PSM = 3  # fully automatic page segmentation
+OCR_WORKERS = int(os.environ.get('OCR_WORKERS', scheduler.CORE_BUDGET))  # parallel OCR runs, and loaded APIs
+OCR_CACHE_MEMORY_ENTRIES = 512
+OCR_CACHE_MAX_ENTRIES = int(os.environ.get('OCR_CACHE_MAX_ENTRIES', 20000))
+CHUNK_SIZE = 1024 * 1024
+
+_tesseract_cmd = None
+
+def find_tesseract():
+    """Configure pytesseract with the tesseract binary, looked up once per process."""
+    global _tesseract_cmd
+    if _tesseract_cmd is None:
+        for path in TESSERACT_CANDIDATES + [shutil.which('tesseract')]:
+            if path and os.path.exists(path):
+                _tesseract_cmd = path
+                break
+        else:
+            raise RuntimeError("Tesseract not found. Please install Tesseract OCR and ensure it's in your PATH or set TESSERACT_PATH.")
+        pytesseract.pytesseract.tesseract_cmd = _tesseract_cmd
+    return _tesseract_cmd
+
+class OcrEngine:
+    """
+    Loaded tesserocr APIs per (lang, psm), reused across images; pytesseract when tesserocr is missing.
+    At most max_apis are loaded: further callers wait for one, and an idle API of another
+    language or mode is ended to make room for a new one.
+    """
+
+    def __init__(self, max_apis=OCR_WORKERS):
+        self.name = 'tesserocr' if HAVE_TESSEROCR else 'pytesseract'
+        self.max_apis = max(1, max_apis)
+        self._idle = {}
+        self._loaded = 0
+        self._slots = threading.BoundedSemaphore(self.max_apis)
+        self._lock = threading.Lock()
+
+    def _checkout(self, lang, psm):
+        self._slots.acquire()
+        try:
+            with self._lock:
+                apis = self._idle.get((lang, psm))
+                if apis:
+                    return apis.pop()
+                if self._loaded >= self.max_apis:
+                    other = next(idle for idle in self._idle.values() if idle)
+                    other.pop().End()
+                    self._loaded -= 1
+                self._loaded += 1
+            try:
+                return tesserocr.PyTessBaseAPI(lang=lang, psm=psm)
+            except Exception:
+                with self._lock:
+                    self._loaded -= 1
+                raise
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _checkin(self, lang, psm, api):
+        with self._lock:
+            self._idle.setdefault((lang, psm), []).append(api)
+        self._slots.release()
+
+    def close(self):
+        """End the idle APIs, freeing their language data."""
+        with self._lock:
+            for idle in self._idle.values():
+                while idle:
+                    idle.pop().End()
+                    self._loaded -= 1
+
+    def recognize(self, image, lang=DEFAULT_LANG, psm=DEFAULT_PSM):
+        if not HAVE_TESSEROCR:
+            find_tesseract()
+            return pytesseract.image_to_string(image, lang=lang, config=f'--psm {psm}')
+        api = self._checkout(lang, psm)
+        try:
+            api.SetImage(image)
+            return api.GetUTF8Text()
+        finally:
+            self._checkin(lang, psm, api)
+
+class OcrCache:
+    """
+    OCR text by key, in memory (LRU) in front of one small file per entry on disk, so worker
+    processes share results and they survive restarts.
+    """
+
+    def __init__(self, root, max_entries=OCR_CACHE_MAX_ENTRIES):
+        self.root = root
+        self.max_entries = max_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._puts = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], f"{key}.txt")
 
-def image_to_text(input_path):
+    def _remember(self, key, text):
+        self._memory[key] = text
+        self._memory.move_to_end(key)
+        while len(self._memory) > OCR_CACHE_MEMORY_ENTRIES:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            if key in self._memory:
+                self.hits += 1
+                self._memory.move_to_end(key)
+                return self._memory[key]
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as f:
+                text = f.read()
+            os.utime(self._path(key))
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+            self._remember(key, text)
+        return text
+
+    def put(self, key, text):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._remember(key, text)
+            self._puts += 1
+            prune = self._puts % 100 == 0
+        if prune:
+            self._prune()
+
+    def _prune(self):
+        """Drop the least recently used entries once the disk cache is over max_entries."""
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith('.txt'):
+                    path = os.path.join(dirpath, name)
+                    try:
+                        entries.append((os.stat(path).st_mtime, path))
+                    except OSError:
+                        pass
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort()
+        for _, path in entries[:len(entries) - self.max_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_rate': round(self.hits / total, 3) if total else None}
+
+_engine = None
+_cache = None
+_state_lock = threading.Lock()
+
+def get_engine():
+    global _engine
+    with _state_lock:
+        if _engine is None:
+            _engine = OcrEngine()
+            atexit.register(_engine.close)
+        return _engine
+
+def get_cache():
+    global _cache
+    with _state_lock:
+        if _cache is None:
+            _cache = OcrCache(os.path.join(UPLOADS_DIR, '.ocr_cache'))
+        return _cache
+
+def _file_digest(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def _image_digest(image):
+    hasher = hashlib.sha256(f"{image.mode}:{image.size}".encode('ascii'))
+    hasher.update(image.tobytes())
+    return hasher.hexdigest()
+
+def ocr_image(image, lang=DEFAULT_LANG, psm=DEFAULT_PSM, digest=None):
+    """
+    Text of an image, from the OCR cache when the same image was read before with the same
+    language and segmentation mode. digest identifies the source (file hash); by default
+    the pixels are hashed.
+    """
+    if digest is None:
+        digest = _image_digest(image)
+    key = hashlib.sha256(f"{digest}:{lang}:{psm}:{int(OCR_PREPROCESS)}".encode('utf-8')).hexdigest()
+    cache = get_cache()
+    text = cache.get(key)
+    if text is not None:
+        return text
+    if OCR_PREPROCESS:
+        image = preprocess_for_ocr(image)
+    with scheduler.slots('tesseract', express=True):
+        text = get_engine().recognize(image, lang, psm)
+    cache.put(key, text)
+    return text
+
+def image_to_text(input_path, lang=DEFAULT_LANG, psm=DEFAULT_PSM):
     try:
         # Create OCR output directory
         ocr_out_dir = os.path.join(UPLOADS_DIR, 'ocr_results')
         os.makedirs(ocr_out_dir, exist_ok=True)
         
-        img = Image.open(input_path)
-        text = pytesseract.image_to_string(img)
+        with Image.open(input_path) as img:
+            text = ocr_image(img, lang, psm, digest=_file_digest(input_path))
         
         # Save extracted text to file
         base = os.path.splitext(os.path.basename(input_path))[0]
@@ -55,20 +383,85 @@ def image_to_text(input_path):
         # Provide detailed error information
         error_msg = f"OCR processing failed: {str(e)}"
         if "tesseract" in str(e).lower():
-            error_msg += "\nTesseract path: " + pytesseract.pytesseract.tesseract_cmd
+            error_msg += "\nTesseract path: " + str(pytesseract.pytesseract.tesseract_cmd)
         raise RuntimeError(error_msg)
 
-def pdf_to_text(input_path):
+# Pages with an embedded text layer are read directly; the others are rasterized
+# a few at a time and OCRed in parallel tesseract processes
+OCR_DPI = int(os.environ.get('OCR_DPI', 300))
+PAGE_WINDOW = int(os.environ.get('OCR_PAGE_WINDOW', 4))
+MIN_TEXT_LAYER_CHARS = 20
+
+def _ocr_page(image, lang, psm):
+    try:
+        return ocr_image(image, lang, psm)
+    finally:
+        image.close()
+
+def read_text_layer(input_path, page_count):
+    """
+    Embedded text of every page via pdftotext (one run for the whole document), or None
+    for pages without usable text. Without pdftotext every page is None.
+    """
+    try:
+        result = scheduler.run(['pdftotext', '-enc', 'UTF-8', '-layout', input_path, '-'], express=True,
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except FileNotFoundError:
+        return [None] * page_count
+    if result.returncode != 0:
+        return [None] * page_count
+    pages = result.stdout.decode('utf-8', 'replace').split('\f')[:page_count]
+    pages += [''] * (page_count - len(pages))
+    # A page number or a stray header is not a text layer
+    return [text if len(text.strip()) >= MIN_TEXT_LAYER_CHARS else None for text in pages]
+
+def plan_pdf_pages(input_path):
+    """[(page_number, text or None)]: pages with None have no text layer and need OCR."""
+    from pdf2image import pdfinfo_from_path
+    page_count = pdfinfo_from_path(input_path)['Pages']
+    return list(enumerate(read_text_layer(input_path, page_count), start=1))
+
+def iter_pdf_pages(input_path, plan=None, lang=DEFAULT_LANG, psm=DEFAULT_PSM, window=PAGE_WINDOW, workers=OCR_WORKERS):
+    """
+    Yield (page_number, text, method) for every page of a PDF, in page order.
+    method is 'text' for pages read from the embedded text layer and 'ocr' for the rest.
+    Only window pages are rasterized at a time (plus at most two windows waiting
+    for OCR), so memory stays flat however long the document is.
+    """
+    from pdf2image import convert_from_path
+    if plan is None:
+        plan = plan_pdf_pages(input_path)
+    to_ocr = deque(page for page, text in plan if text is None)
+    ocr_futures = {}
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        try:
+            for page, text in plan:
+                progress.report('ocr', force=page == len(plan), page=page, pages=len(plan))
+                if text is not None:
+                    yield page, text, 'text'
+                    continue
+                while to_ocr and len(ocr_futures) < 2 * window:
+                    # Rasterize the next run of consecutive image-only pages, up to window pages
+                    first_page = last_page = to_ocr.popleft()
+                    while to_ocr and to_ocr[0] == last_page + 1 and last_page - first_page + 1 < window:
+                        last_page = to_ocr.popleft()
+                    with scheduler.slots('pdftoppm'):
+                        images = convert_from_path(input_path, dpi=OCR_DPI, first_page=first_page, last_page=last_page)
+                    for offset, image in enumerate(images):
+                        ocr_futures[first_page + offset] = pool.submit(_ocr_page, image, lang, psm)
+                yield page, ocr_futures.pop(page).result(), 'ocr'
+        finally:
+            # The consumer went away: don't OCR the rest
+            for future in ocr_futures.values():
+                future.cancel()
+
+def pdf_to_text(input_path, lang=DEFAULT_LANG, psm=DEFAULT_PSM):
     try:
-        from pdf2image import convert_from_path
         # Create OCR output directory
         ocr_out_dir = os.path.join(UPLOADS_DIR, 'ocr_results')
         os.makedirs(ocr_out_dir, exist_ok=True)
         
-        pages = convert_from_path(input_path)
-        text = ''
-        for page in pages:
-            text += pytesseract.image_to_string(page) + '\n'
+        text = ''.join(page_text + '\n' for _, page_text, _ in iter_pdf_pages(input_path, lang=lang, psm=psm))
         
         # Save extracted text to file
         base = os.path.splitext(os.path.basename(input_path))[0]
@@ -83,5 +476,5 @@ def pdf_to_text(input_path):
         # Provide detailed error information
         error_msg = f"PDF OCR processing failed: {str(e)}"
         if "tesseract" in str(e).lower():
-            error_msg += "\nTesseract path: " + pytesseract.pytesseract.tesseract_cmd
-        raise RuntimeError(error_msg) 
\ No newline at end of file
+            error_msg += "\nTesseract path: " + str(pytesseract.pytesseract.tesseract_cmd)
+        raise RuntimeError(error_msg)
@@ -0,0 +1,264 @@
+"""
+Pool of long-lived headless LibreOffice processes for document conversion.
+
+Every worker has its own user profile directory, so concurrent conversions
+never fight over the profile lock. When the Python UNO bridge is available
+each worker keeps one soffice listening on a local socket and documents are
+converted over UNO without paying the startup cost again. Without UNO the
+workers fall back to one-shot 'soffice --convert-to' runs, still with their
+own profile and a timeout.
+
+Document conversions run on the thread pool of the web process (see
+THREADED_CONVERTERS in app.py), so each server process keeps one pool of
+OFFICE_POOL_SIZE soffice processes, however many converter processes it has.
+"""
+import os
+import time
+import queue
+import atexit
+import shutil
+import socket
+import logging
+import tempfile
+import threading
+import subprocess
+
+from converter import scheduler
+
+logger = logging.getLogger(__name__)
+
+POOL_SIZE = int(os.environ.get('OFFICE_POOL_SIZE', 1))
+CONVERT_TIMEOUT = int(os.environ.get('OFFICE_CONVERT_TIMEOUT', 120))  # seconds per document
+START_TIMEOUT = 30
+HEALTH_CHECK_INTERVAL = 30
+
+SOFFICE_CANDIDATES = [
+    os.environ.get('SOFFICE_PATH'),
+    shutil.which('soffice'),
+    shutil.which('libreoffice'),
+    r"C:\Program Files\LibreOffice\program\soffice.exe",
+    '/Applications/LibreOffice.app/Contents/MacOS/soffice',
+]
+
+try:
+    import uno
+    from com.sun.star.beans import PropertyValue
+    HAVE_UNO = True
+except ImportError:
+    HAVE_UNO = False
+
+
+def find_soffice():
+    for path in SOFFICE_CANDIDATES:
+        if path and os.path.exists(path):
+            return path
+    raise FileNotFoundError("LibreOffice (soffice) not found. Install it or set SOFFICE_PATH.")
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _file_uri(path):
+    return 'file:///' + os.path.abspath(path).replace('\\', '/').lstrip('/')
+
+
+def _prop(name, value):
+    p = PropertyValue()
+    p.Name = name
+    p.Value = value
+    return p
+
+
+class OfficeWorker:
+    def __init__(self, index, soffice):
+        self.index = index
+        self.soffice = soffice
+        self.profile_dir = tempfile.mkdtemp(prefix=f'soffice_profile_{index}_')
+        self.port = None
+        self.process = None
+        self.desktop = None
+        self.conversions = 0
+        self.restarts = 0
+
+    def _base_command(self):
+        return [self.soffice, '--headless', '--invisible', '--nologo', '--norestore', '--nodefault',
+                f'-env:UserInstallation={_file_uri(self.profile_dir)}']
+
+    def healthy(self):
+        if not HAVE_UNO:
+            return True
+        if self.process is None or self.process.poll() is not None:
+            return False
+        try:
+            with socket.create_connection(('127.0.0.1', self.port), timeout=2):
+                return True
+        except OSError:
+            return False
+
+    def start(self):
+        self.stop()
+        self.port = _free_port()
+        command = self._base_command() + [f'--accept=socket,host=127.0.0.1,port={self.port};urp;StarOffice.ComponentContext']
+        self.process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.time() + START_TIMEOUT
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"soffice worker {self.index} exited during startup")
+            try:
+                local_ctx = uno.getComponentContext()
+                resolver = local_ctx.ServiceManager.createInstanceWithContext(
+                    'com.sun.star.bridge.UnoUrlResolver', local_ctx)
+                ctx = resolver.resolve(f'uno:socket,host=127.0.0.1,port={self.port};urp;StarOffice.ComponentContext')
+                self.desktop = ctx.ServiceManager.createInstanceWithContext('com.sun.star.frame.Desktop', ctx)
+                logger.info(f"soffice worker {self.index} listening on port {self.port}")
+                return
+            except Exception:
+                time.sleep(0.25)
+        self.stop()
+        raise RuntimeError(f"soffice worker {self.index} did not start within {START_TIMEOUT}s")
+
+    def ensure_running(self):
+        if HAVE_UNO and not self.healthy():
+            if self.process is not None:
+                self.restarts += 1
+                logger.warning(f"soffice worker {self.index} is not responding, restarting")
+            self.start()
+
+    def stop(self):
+        self.desktop = None
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                pass
+        self.process = None
+
+    def _convert_uno(self, input_path, output_path):
+        doc = self.desktop.loadComponentFromURL(uno.systemPathToFileUrl(os.path.abspath(input_path)),
+                                                '_blank', 0, (_prop('Hidden', True),))
+        if doc is None:
+            raise RuntimeError(f"LibreOffice could not open {input_path}")
+        try:
+            doc.storeToURL(uno.systemPathToFileUrl(os.path.abspath(output_path)),
+                           (_prop('FilterName', 'writer_pdf_Export'),))
+        finally:
+            doc.close(True)
+
+    def _convert_oneshot(self, input_path, output_path, timeout):
+        out_dir = tempfile.mkdtemp(prefix='soffice_out_')
+        try:
+            command = self._base_command() + ['--convert-to', 'pdf', '--outdir', out_dir, input_path]
+            result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=timeout)
+            if result.returncode != 0:
+                raise RuntimeError("LibreOffice failed")
+            produced = os.path.join(out_dir, os.path.splitext(os.path.basename(input_path))[0] + '.pdf')
+            if not os.path.exists(produced):
+                raise FileNotFoundError(f"LibreOffice did not create {produced}")
+            os.replace(produced, output_path)
+        finally:
+            shutil.rmtree(out_dir, ignore_errors=True)
+
+    def convert(self, input_path, output_path, timeout=CONVERT_TIMEOUT):
+        if not HAVE_UNO:
+            self._convert_oneshot(input_path, output_path, timeout)
+            self.conversions += 1
+            return
+        self.ensure_running()
+        outcome = {}
+
+        def run():
+            try:
+                self._convert_uno(input_path, output_path)
+            except Exception as e:
+                outcome['error'] = e
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        thread.join(timeout)
+        if thread.is_alive():
+            # A hung document: kill this soffice, the next conversion restarts it
+            self.stop()
+            raise TimeoutError(f"LibreOffice conversion of {os.path.basename(input_path)} exceeded {timeout}s")
+        if 'error' in outcome:
+            raise outcome['error']
+        self.conversions += 1
+
+    def close(self):
+        self.stop()
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+
+
+class OfficePool:
+    def __init__(self, size=POOL_SIZE):
+        soffice = find_soffice()
+        self.workers = [OfficeWorker(i, soffice) for i in range(size)]
+        self._idle = queue.Queue()
+        for worker in self.workers:
+            self._idle.put(worker)
+        self._closed = threading.Event()
+        if HAVE_UNO:
+            threading.Thread(target=self._monitor, daemon=True).start()
+        logger.info(f"Office pool: {size} workers ({'UNO listener' if HAVE_UNO else 'one-shot'} mode)")
+
+    def _monitor(self):
+        """Restart idle workers whose soffice died, so the next document doesn't wait for startup."""
+        while not self._closed.wait(HEALTH_CHECK_INTERVAL):
+            for _ in range(self._idle.qsize()):
+                try:
+                    worker = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    if worker.process is not None:
+                        worker.ensure_running()
+                except Exception as e:
+                    logger.error(f"Health check failed for soffice worker {worker.index}: {e}")
+                finally:
+                    self._idle.put(worker)
+
+    def convert(self, input_path, output_path, timeout=CONVERT_TIMEOUT):
+        with scheduler.slots('soffice'):
+            self._convert(input_path, output_path, timeout)
+
+    def _convert(self, input_path, output_path, timeout):
+        worker = self._idle.get()
+        try:
+            try:
+                worker.convert(input_path, output_path, timeout)
+            except TimeoutError:
+                raise
+            except Exception as e:
+                if not HAVE_UNO or worker.healthy():
+                    raise
+                # soffice crashed under this document; retry once on a fresh process
+                logger.warning(f"soffice worker {worker.index} crashed ({e}), retrying")
+                worker.convert(input_path, output_path, timeout)
+        finally:
+            self._idle.put(worker)
+
+    def stats(self):
+        return [{'worker': w.index, 'conversions': w.conversions, 'restarts': w.restarts,
+                 'running': w.process is not None and w.process.poll() is None} for w in self.workers]
+
+    def close(self):
+        self._closed.set()
+        for worker in self.workers:
+            worker.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """The office pool for this process, started on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = OfficePool()
+            atexit.register(_pool.close)
+        return _pool
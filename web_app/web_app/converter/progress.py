@@ -0,0 +1,228 @@
+"""
+Progress events for jobs, uploads and downloads, streamed to clients over SSE.
+
+Every channel (a job id, resumable upload id or download id) keeps its last
+event and the queues of its subscribers. Converters call report() while they
+run; in the converter pool processes the events travel back over a
+multiprocessing queue (handed over by the pool initializer, like the
+scheduler) and a listener thread publishes them in the web process.
+
+ffmpeg runs started through the scheduler during a job get '-progress pipe:1'
+and report output time, speed, fps and percent of the input duration.
+"""
+import os
+import re
+import time
+import queue
+import logging
+import threading
+import subprocess
+import multiprocessing
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_TTL = int(os.environ.get('PROGRESS_CHANNEL_TTL', 3600))  # seconds a finished channel is kept
+MIN_INTERVAL = 0.2  # seconds between two progress events of one job, final events always go out
+TERMINAL = ('done', 'failed')
+
+
+class Channel:
+    def __init__(self):
+        self.last = None
+        self.seq = 0
+        self.finished = None
+        self.subscribers = []
+
+
+class ProgressHub:
+    def __init__(self):
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def publish(self, channel_id, event):
+        with self._lock:
+            self._prune()
+            channel = self._channels.setdefault(channel_id, Channel())
+            channel.seq += 1
+            event = dict(event, seq=channel.seq, time=time.time())
+            channel.last = event
+            if event.get('status') in TERMINAL:
+                channel.finished = time.time()
+            subscribers = list(channel.subscribers)
+        for q in subscribers:
+            q.put(event)
+
+    def last(self, channel_id):
+        with self._lock:
+            channel = self._channels.get(channel_id)
+            return channel.last if channel else None
+
+    def exists(self, channel_id):
+        with self._lock:
+            return channel_id in self._channels
+
+    def subscribe(self, channel_id, heartbeat=15):
+        """
+        Yield the last event of the channel and then every new one, until an event
+        with a final status. Yields None every heartbeat seconds without events.
+        """
+        q = queue.Queue()
+        with self._lock:
+            channel = self._channels.setdefault(channel_id, Channel())
+            channel.subscribers.append(q)
+            last = channel.last
+        try:
+            if last is not None:
+                yield last
+                if last.get('status') in TERMINAL:
+                    return
+            while True:
+                try:
+                    event = q.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield None
+                    continue
+                if last is not None and event['seq'] <= last['seq']:
+                    continue
+                yield event
+                if event.get('status') in TERMINAL:
+                    return
+        finally:
+            with self._lock:
+                channel.subscribers.remove(q)
+
+    def _prune(self):
+        """Forget finished channels nobody listens to after CHANNEL_TTL. Caller holds _lock."""
+        cutoff = time.time() - CHANNEL_TTL
+        for channel_id in [c for c, ch in self._channels.items()
+                           if ch.finished and ch.finished < cutoff and not ch.subscribers]:
+            del self._channels[channel_id]
+
+
+_hub = ProgressHub()
+_queue = None  # set in the converter pool processes, see install()
+_listener_lock = threading.Lock()
+_current = threading.local()
+_last_report = {}
+
+
+def get_hub():
+    return _hub
+
+
+def get_queue():
+    """The queue pool processes send their events over; starts the listener on first use."""
+    global _queue
+    with _listener_lock:
+        if _queue is None:
+            _queue = multiprocessing.Queue()
+            threading.Thread(target=_listen, args=(_queue,), name='progress-listener', daemon=True).start()
+        return _queue
+
+
+def _listen(events):
+    while True:
+        try:
+            channel_id, event = events.get()
+            _hub.publish(channel_id, event)
+        except Exception as e:
+            logger.warning(f"Dropped progress event: {e}")
+
+
+def install(events):
+    """Send events to the parent process (called from the pool initializer)."""
+    global _queue, _hub
+    _queue = events
+    _hub = None
+
+
+def publish(channel_id, event):
+    if _hub is not None:
+        _hub.publish(channel_id, event)
+    else:
+        try:
+            _queue.put_nowait((channel_id, event))
+        except Exception as e:
+            logger.warning(f"Could not send progress event: {e}")
+
+
+def set_current(job_id):
+    """Attribute report() calls of this thread to job_id (None to stop)."""
+    _current.job_id = job_id
+
+
+def current():
+    return getattr(_current, 'job_id', None)
+
+
+def report(stage, force=False, **fields):
+    """Publish progress of the job running in this thread, at most every MIN_INTERVAL unless force."""
+    job_id = current()
+    if job_id is None:
+        return
+    now = time.monotonic()
+    if not force and now - _last_report.get(job_id, 0) < MIN_INTERVAL:
+        return
+    _last_report[job_id] = now
+    publish(job_id, dict(fields, status='running', stage=stage))
+
+
+def finish(job_id):
+    _last_report.pop(job_id, None)
+
+
+_DURATION = re.compile(r'Duration: (\d+):(\d+):(\d+(?:\.\d+)?)')
+
+
+def _seconds(h, m, s):
+    return int(h) * 3600 + int(m) * 60 + float(s)
+
+
+def run_ffmpeg(command, check=False, stderr=None, **kwargs):
+    """
+    subprocess.run for an ffmpeg command, reporting its '-progress' output for the current job.
+    stdout is taken by the progress stream; stderr is returned if stderr=PIPE was asked for.
+    """
+    kwargs.pop('stdout', None)
+    command = [command[0], '-progress', 'pipe:1', '-nostats'] + list(command[1:])
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs)
+    errors = []
+    duration = []
+
+    def drain():
+        # Only the first 'Duration:' is the input's; the rest of stderr is kept for errors
+        for line in process.stderr:
+            if not duration:
+                match = _DURATION.search(line.decode('utf-8', 'replace'))
+                if match:
+                    duration.append(_seconds(*match.groups()))
+            errors.append(line)
+
+    drainer = threading.Thread(target=drain, daemon=True)
+    drainer.start()
+    block = {}
+    for raw in process.stdout:
+        key, _, value = raw.decode('utf-8', 'replace').strip().partition('=')
+        block[key] = value
+        if key != 'progress':
+            continue
+        # One block of key=value lines ends with progress=continue or progress=end
+        fields = {}
+        out_time = block.get('out_time_us') or block.get('out_time_ms')
+        if out_time and out_time.lstrip('-').isdigit() and int(out_time) >= 0:
+            fields['out_time'] = round(int(out_time) / 1e6, 2)
+            if duration and duration[0] > 0:
+                fields['percent'] = round(min(100.0, fields['out_time'] * 100 / duration[0]), 1)
+        if block.get('speed', 'N/A') != 'N/A':
+            fields['speed'] = block['speed'].strip()
+        if block.get('fps', '0') not in ('0', '0.00', 'N/A'):
+            fields['fps'] = float(block['fps'])
+        report('ffmpeg', force=value == 'end', **fields)
+        block = {}
+    process.wait()
+    drainer.join()
+    err = b''.join(errors)
+    if check and process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command, b'', err)
+    return subprocess.CompletedProcess(command, process.returncode, None,
+                                       err if stderr == subprocess.PIPE else None)
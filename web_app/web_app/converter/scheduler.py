@@ -0,0 +1,178 @@
+"""
+Central scheduler for the external tools the converters start (ffmpeg,
+ImageMagick, potrace, soffice, tesseract).
+
+Every run takes a slot from a machine-wide core budget plus a slot for its
+tool, so a handful of concurrent video conversions can't each spread over
+every core. ffmpeg jobs may take extra core slots when they are free and get
+a matching -threads value; under load they run single-threaded. A few
+express slots are reserved for single-core runs, so short jobs don't queue
+behind long encodes. The semaphores and counters are multiprocessing primitives,
+shared with the converter pool processes through the pool initializer.
+"""
+import os
+import time
+import logging
+import threading
+import subprocess
+import multiprocessing
+from contextlib import contextmanager
+
+from converter import progress
+
+logger = logging.getLogger(__name__)
+
+CORE_BUDGET = int(os.environ.get('CONVERTER_CORES', os.cpu_count() or 2))
+EXPRESS_SLOTS = int(os.environ.get('CONVERTER_EXPRESS_SLOTS', max(1, CORE_BUDGET // 4)))
+FFMPEG_MAX_THREADS = int(os.environ.get('FFMPEG_MAX_THREADS', max(1, CORE_BUDGET // 2)))
+_MAX_RUNS = CORE_BUDGET + EXPRESS_SLOTS
+
+# Concurrent runs allowed per tool, on top of the core budget
+TOOL_LIMITS = {
+    'ffmpeg': int(os.environ.get('SCHEDULER_LIMIT_FFMPEG', _MAX_RUNS)),
+    'magick': int(os.environ.get('SCHEDULER_LIMIT_MAGICK', _MAX_RUNS)),
+    'potrace': int(os.environ.get('SCHEDULER_LIMIT_POTRACE', _MAX_RUNS)),
+    'soffice': int(os.environ.get('SCHEDULER_LIMIT_SOFFICE', 2)),
+    'tesseract': int(os.environ.get('SCHEDULER_LIMIT_TESSERACT', _MAX_RUNS)),
+    'pdftoppm': int(os.environ.get('SCHEDULER_LIMIT_PDFTOPPM', _MAX_RUNS)),
+    'pdftotext': int(os.environ.get('SCHEDULER_LIMIT_PDFTOTEXT', _MAX_RUNS)),
+}
+
+# Per-tool counters in a shared array: runs, waiting, running, wait total, wait max, run total
+_FIELDS = ('runs', 'waiting', 'running', 'wait_seconds', 'max_wait_seconds', 'run_seconds')
+
+
+class Scheduler:
+    def __init__(self, cores=CORE_BUDGET, limits=None, express=EXPRESS_SLOTS):
+        self.cores = cores
+        self.express = express
+        self.limits = dict(limits or TOOL_LIMITS)
+        self.tools = sorted(self.limits)
+        self._cores = multiprocessing.BoundedSemaphore(cores)
+        self._express = multiprocessing.BoundedSemaphore(max(1, express))
+        self._tools = {tool: multiprocessing.BoundedSemaphore(max(1, n)) for tool, n in self.limits.items()}
+        self._stats = multiprocessing.Array('d', len(self.tools) * len(_FIELDS))
+        self._cores_in_use = multiprocessing.Value('i', 0)
+
+    def _update(self, tool, **changes):
+        base = self.tools.index(tool) * len(_FIELDS)
+        with self._stats.get_lock():
+            for name, value in changes.items():
+                i = base + _FIELDS.index(name)
+                if name == 'max_wait_seconds':
+                    self._stats[i] = max(self._stats[i], value)
+                else:
+                    self._stats[i] += value
+
+    def _acquire_core(self, express):
+        """Take a core slot, or for express runs whichever of a core or an express slot frees first."""
+        if not express or self.express <= 0:
+            self._cores.acquire()
+            return self._cores
+        while True:
+            if self._cores.acquire(timeout=0.05):
+                return self._cores
+            if self._express.acquire(block=False):
+                return self._express
+
+    @contextmanager
+    def slots(self, tool, want=1, express=False):
+        """
+        Hold one slot of tool and between 1 and want core slots while the block runs.
+        Short single-core runs pass express=True to use the reserved express slots too.
+        Yields the number of cores granted.
+        """
+        if tool not in self._tools:
+            raise ValueError(f"Unknown tool for scheduler: {tool}")
+        self._update(tool, waiting=1)
+        start = time.perf_counter()
+        self._tools[tool].acquire()
+        first = self._acquire_core(express and want <= 1)
+        granted = 1
+        # Extra cores only if they're idle right now, never wait for them
+        while granted < want and self._cores.acquire(block=False):
+            granted += 1
+        waited = time.perf_counter() - start
+        with self._cores_in_use.get_lock():
+            self._cores_in_use.value += granted
+        self._update(tool, waiting=-1, running=1, runs=1, wait_seconds=waited, max_wait_seconds=waited)
+        if waited > 1:
+            logger.info(f"{tool} waited {waited:.1f}s for a slot")
+        started = time.perf_counter()
+        try:
+            yield granted
+        finally:
+            first.release()
+            for _ in range(granted - 1):
+                self._cores.release()
+            self._tools[tool].release()
+            with self._cores_in_use.get_lock():
+                self._cores_in_use.value -= granted
+            self._update(tool, running=-1, run_seconds=time.perf_counter() - started)
+
+    def run(self, command, tool=None, want=None, express=False, **kwargs):
+        """
+        subprocess.run(command, **kwargs) once a slot is free. ffmpeg commands get a
+        -threads option (before the output path) matching the cores granted, and
+        report their progress when they run for a job.
+        """
+        tool = tool or os.path.splitext(os.path.basename(command[0]))[0].lower()
+        if want is None:
+            want = FFMPEG_MAX_THREADS if tool == 'ffmpeg' else 1
+        with self.slots(tool, want, express) as cores:
+            if tool == 'ffmpeg':
+                command = with_threads(command, cores)
+                if progress.current() is not None:
+                    return progress.run_ffmpeg(command, **kwargs)
+            return subprocess.run(command, **kwargs)
+
+    def stats(self):
+        fields = len(_FIELDS)
+        with self._stats.get_lock():
+            values = list(self._stats)
+        tools = {}
+        for n, tool in enumerate(self.tools):
+            row = dict(zip(_FIELDS, values[n * fields:(n + 1) * fields]))
+            runs = int(row['runs'])
+            tools[tool] = {
+                'limit': self.limits[tool],
+                'runs': runs,
+                'waiting': int(row['waiting']),
+                'running': int(row['running']),
+                'avg_wait_seconds': round(row['wait_seconds'] / runs, 3) if runs else 0.0,
+                'max_wait_seconds': round(row['max_wait_seconds'], 3),
+                'avg_run_seconds': round(row['run_seconds'] / runs, 3) if runs else 0.0,
+            }
+        return {'cores': self.cores, 'express_slots': self.express, 'cores_in_use': self._cores_in_use.value, 'tools': tools}
+
+
+def with_threads(command, threads):
+    """ffmpeg command with -threads inserted before the output path (its last argument)."""
+    return list(command[:-1]) + ['-threads', str(threads), command[-1]]
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """The scheduler shared by this process and the converter pool processes."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler()
+        return _scheduler
+
+
+def install(scheduler):
+    """Use the scheduler of the parent process (called from the pool initializer)."""
+    global _scheduler
+    _scheduler = scheduler
+
+
+def run(command, tool=None, want=None, express=False, **kwargs):
+    return get_scheduler().run(command, tool=tool, want=want, express=express, **kwargs)
+
+
+def slots(tool, want=1, express=False):
+    return get_scheduler().slots(tool, want, express)
@@ -1,26 +1,26 @@
 import os
+import tempfile
 
-def text_to_mp3(text, output_path=None):
-    from gtts import gTTS
-    out_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'uploads', 'text_to_mp3'))
+from converter.tts_service import get_service
+
+UPLOADS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'uploads'))
+
+
+def _output_path(subdir, suffix):
+    out_dir = os.path.join(UPLOADS_DIR, subdir)
     os.makedirs(out_dir, exist_ok=True)
-    if output_path is None:
-        import tempfile
-        fd, output_path = tempfile.mkstemp(suffix='.mp3', dir=out_dir)
-        os.close(fd)
-    tts = gTTS(text)
-    tts.save(output_path)
+    fd, output_path = tempfile.mkstemp(suffix=suffix, dir=out_dir)
+    os.close(fd)
     return output_path
 
-def text_to_wav(text, output_path=None):
-    import pyttsx3
-    out_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'uploads', 'text_to_wav'))
-    os.makedirs(out_dir, exist_ok=True)
-    if output_path is None:
-        import tempfile
-        fd, output_path = tempfile.mkstemp(suffix='.wav', dir=out_dir)
-        os.close(fd)
-    engine = pyttsx3.init()
-    engine.save_to_file(text, output_path)
-    engine.runAndWait()
-    return output_path 
\ No newline at end of file
+
+def text_to_mp3(text, output_path=None, lang=None):
+    """gTTS speech, synthesized sentence by sentence in parallel (see tts_service.py)."""
+    output_path = output_path or _output_path('text_to_mp3', '.mp3')
+    return get_service().synthesize(text, output_path, 'mp3', lang)
+
+
+def text_to_wav(text, output_path=None, voice=None):
+    """pyttsx3 speech from the engine kept running by the TTS service."""
+    output_path = output_path or _output_path('text_to_wav', '.wav')
+    return get_service().synthesize(text, output_path, 'wav', voice)
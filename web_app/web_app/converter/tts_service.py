@@ -0,0 +1,341 @@
+"""
+Long-lived text-to-speech service.
+
+Text is split into sentences that are synthesized separately and joined in
+order, so output can be streamed as soon as the first sentence is ready and
+every sentence is cached on its own (by engine, voice and text): repeated
+phrases cost nothing.
+
+MP3 comes from gTTS, whose requests run in parallel on a thread pool; MP3
+frames can simply be concatenated. WAV comes from pyttsx3, which is not
+thread-safe (and needs COM on its own thread on Windows), so one dedicated
+thread keeps an initialized engine and works through the sentences in turn.
+"""
+import io
+import os
+import re
+import wave
+import queue
+import struct
+import hashlib
+import logging
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'uploads', '.tts_cache'))
+CACHE_MAX_BYTES = int(os.environ.get('TTS_CACHE_MAX_MB', 256)) * 1024 * 1024
+GTTS_PARALLEL = int(os.environ.get('TTS_PARALLEL', 4))
+SENTENCE_TIMEOUT = int(os.environ.get('TTS_SENTENCE_TIMEOUT', 60))  # seconds one sentence may take
+MAX_CHUNK_CHARS = 300  # sentences are merged up to this length, longer ones split at commas/spaces
+DEFAULT_LANG = 'en'
+
+_SENTENCE_END = re.compile(r'(?<=[.!?;:。！？])\s+|\n{2,}')
+
+
+def split_sentences(text, max_chars=MAX_CHUNK_CHARS):
+    """Sentence-sized chunks of text, in order, none longer than max_chars."""
+    pieces = []
+    for sentence in _SENTENCE_END.split(text):
+        sentence = ' '.join(sentence.split())
+        while len(sentence) > max_chars:
+            cut = max(sentence.rfind(', ', 0, max_chars), sentence.rfind(' ', 0, max_chars))
+            cut = cut + 1 if cut > 0 else max_chars
+            pieces.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+        if sentence:
+            pieces.append(sentence)
+    # Merge short sentences so each request/engine run does a useful amount of work
+    chunks = []
+    for piece in pieces:
+        if chunks and len(chunks[-1]) + len(piece) + 1 <= max_chars // 2:
+            chunks[-1] = f"{chunks[-1]} {piece}"
+        else:
+            chunks.append(piece)
+    return chunks
+
+
+class AudioCache:
+    """Synthesized sentences on disk, one file per engine+voice+text hash, pruned by size (LRU by mtime)."""
+
+    def __init__(self, root=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(engine, voice, text):
+        return hashlib.sha256(f"{engine}\0{voice}\0{text}".encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._puts += 1
+            prune = self._puts % 50 == 0
+        if prune:
+            self._prune()
+
+    def _prune(self):
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_rate': round(self.hits / total, 3) if total else None}
+
+
+class Pyttsx3Worker(threading.Thread):
+    """
+    Owns one initialized pyttsx3 engine; sentences are rendered to WAV bytes one at a time.
+    If the engine can't be started, or hangs and is abandoned, every request fails with that
+    error (error is set and the service starts a new worker for the next request).
+    """
+
+    def __init__(self):
+        super().__init__(name='pyttsx3-worker', daemon=True)
+        self.error = None
+        self._requests = queue.Queue()
+        self._current = None  # future of the sentence being rendered
+        self._lock = threading.Lock()
+        self._tmp_dir = tempfile.mkdtemp(prefix='tts_')
+        self.start()
+
+    def synthesize(self, text, voice=None):
+        future = Future()
+        with self._lock:
+            if self.error is None:
+                self._requests.put((text, voice, future))
+                return future
+        future.set_exception(self.error)
+        return future
+
+    def abandon(self, reason):
+        """
+        Give up on this worker, e.g. when its engine hangs in runAndWait(): the sentence in
+        progress and the queued ones fail, and the thread exits once the engine returns.
+        """
+        logger.error(f"Abandoning pyttsx3 worker: {reason}")
+        self._fail(RuntimeError(reason))
+        self._requests.put(None)  # wakes the thread if it is idle
+
+    def _fail(self, error):
+        with self._lock:
+            if self.error is None:
+                self.error = error
+            if self._current is not None and not self._current.done():
+                self._current.set_exception(self.error)
+            while not self._requests.empty():
+                request = self._requests.get()
+                if request is not None and request[2].set_running_or_notify_cancel():
+                    request[2].set_exception(self.error)
+
+    def run(self):
+        try:
+            import pyttsx3
+            engine = pyttsx3.init()
+            default_voice = engine.getProperty('voice')
+        except Exception as e:
+            logger.error(f"Could not start pyttsx3: {e}")
+            self._fail(RuntimeError(f"Could not start pyttsx3: {e}"))
+            return
+        path = os.path.join(self._tmp_dir, 'sentence.wav')
+        while True:
+            request = self._requests.get()
+            with self._lock:
+                if self.error is not None or request is None:
+                    return
+                text, voice, future = request
+                if not future.set_running_or_notify_cancel():
+                    continue
+                self._current = future
+            try:
+                engine.setProperty('voice', voice or default_voice)
+                engine.save_to_file(text, path)
+                engine.runAndWait()
+                with open(path, 'rb') as f:
+                    data, error = f.read(), None
+            except Exception as e:
+                data, error = None, e
+            with self._lock:
+                self._current = None
+                # An abandoned worker has failed this future already
+                if not future.done():
+                    if error is None:
+                        future.set_result(data)
+                    else:
+                        future.set_exception(error)
+
+
+def _gtts_mp3(text, lang):
+    from gtts import gTTS
+    buf = io.BytesIO()
+    gTTS(text, lang=lang).write_to_fp(buf)
+    return buf.getvalue()
+
+
+def _wav_header(channels, sample_width, frame_rate, data_size=0xFFFFFFFF - 36):
+    """RIFF header; the default sizes mark a stream whose length isn't known yet."""
+    return (b'RIFF' + struct.pack('<I', min(data_size + 36, 0xFFFFFFFF)) + b'WAVE' +
+            b'fmt ' + struct.pack('<IHHIIHH', 16, 1, channels, frame_rate,
+                                  frame_rate * channels * sample_width, channels * sample_width, sample_width * 8) +
+            b'data' + struct.pack('<I', data_size))
+
+
+def _wav_frames(data):
+    with wave.open(io.BytesIO(data), 'rb') as w:
+        return (w.getnchannels(), w.getsampwidth(), w.getframerate()), w.readframes(w.getnframes())
+
+
+class TTSService:
+    def __init__(self, cache=None):
+        self.cache = cache or AudioCache()
+        self._pool = ThreadPoolExecutor(max_workers=GTTS_PARALLEL, thread_name_prefix='gtts')
+        self._pyttsx3 = None
+        self._lock = threading.Lock()
+
+    def _pyttsx3_worker(self):
+        with self._lock:
+            if self._pyttsx3 is None or self._pyttsx3.error is not None:
+                self._pyttsx3 = Pyttsx3Worker()
+            return self._pyttsx3
+
+    def _abandon_pyttsx3(self, reason):
+        with self._lock:
+            worker = self._pyttsx3
+        if worker is not None:
+            worker.abandon(reason)
+
+    def _sentence(self, fmt, voice, text):
+        """Future with the audio of one sentence: MP3 bytes, or a complete WAV file."""
+        engine = 'gtts' if fmt == 'mp3' else 'pyttsx3'
+        key = AudioCache.key(engine, voice, text)
+        data = self.cache.get(key)
+        if data is not None:
+            future = Future()
+            future.set_result(data)
+            return future
+        if fmt == 'mp3':
+            future = self._pool.submit(_gtts_mp3, text, voice or DEFAULT_LANG)
+        else:
+            future = self._pyttsx3_worker().synthesize(text, voice)
+
+        def store(done):
+            if done.exception() is None:
+                try:
+                    self.cache.put(key, done.result())
+                except OSError as e:
+                    logger.warning(f"Could not cache TTS audio: {e}")
+
+        future.add_done_callback(store)
+        return future
+
+    def iter_sentences(self, text, fmt='mp3', voice=None, ahead=GTTS_PARALLEL * 2):
+        """Yield the audio of each sentence in order, keeping up to ahead sentences in flight."""
+        sentences = split_sentences(text)
+        if not sentences:
+            raise ValueError('No text to synthesize')
+        pending = []
+        try:
+            for n in range(len(sentences)):
+                while len(pending) < ahead and n + len(pending) < len(sentences):
+                    pending.append(self._sentence(fmt, voice, sentences[n + len(pending)]))
+                try:
+                    yield pending.pop(0).result(timeout=SENTENCE_TIMEOUT)
+                except FutureTimeout:
+                    reason = f"TTS engine gave no audio within {SENTENCE_TIMEOUT}s"
+                    if fmt != 'mp3':
+                        # The pyttsx3 thread is stuck: later requests go to a new one
+                        self._abandon_pyttsx3(reason)
+                    raise RuntimeError(reason) from None
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def stream(self, text, fmt='mp3', voice=None):
+        """Audio bytes of the whole text, as a stream that starts with the first sentence."""
+        if fmt == 'mp3':
+            yield from self.iter_sentences(text, fmt, voice)
+            return
+        params = None
+        for data in self.iter_sentences(text, fmt, voice):
+            sentence_params, frames = _wav_frames(data)
+            if params is None:
+                params = sentence_params
+                yield _wav_header(*params)
+            elif sentence_params != params:
+                raise RuntimeError('TTS engine changed the audio format between sentences')
+            yield frames
+
+    def synthesize(self, text, output_path, fmt='mp3', voice=None):
+        """Write the whole text to output_path (a WAV with exact sizes in its header)."""
+        if fmt == 'mp3':
+            with open(output_path, 'wb') as f:
+                for data in self.iter_sentences(text, fmt, voice):
+                    f.write(data)
+            return output_path
+        with wave.open(output_path, 'wb') as out:
+            for n, data in enumerate(self.iter_sentences(text, fmt, voice)):
+                params, frames = _wav_frames(data)
+                if n == 0:
+                    out.setnchannels(params[0])
+                    out.setsampwidth(params[1])
+                    out.setframerate(params[2])
+                out.writeframes(frames)
+        return output_path
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_service():
+    """The TTS service of this process, started on first use."""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = TTSService()
+        return _service
@@ -1,5 +1,11 @@
 import os
+import re
+import shutil
+import tempfile
 import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from converter import scheduler
+from converter import progress
 
 UPLOADS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'uploads'))
 
@@ -11,7 +17,7 @@ def convert_mp4_to_mp3(input_path):
     command = [
         "ffmpeg", "-i", input_path, "-vn", "-acodec", "libmp3lame", "-y", output_path
     ]
-    subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    scheduler.run(command, want=1, express=True, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
     return output_path
 
 def gif_to_mp4(input_path):
@@ -22,7 +28,7 @@ def gif_to_mp4(input_path):
     command = [
         "ffmpeg", "-f", "gif", "-i", input_path, "-movflags", "+faststart", "-pix_fmt", "yuv420p", "-vf", "scale=trunc(iw/2)*2:trunc(ih/2)*2", "-y", output_path
     ]
-    subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    scheduler.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
     return output_path
 
 def mp4_to_gif(input_path):
@@ -33,5 +39,131 @@ def mp4_to_gif(input_path):
     command = [
         "ffmpeg", "-i", input_path, "-vf", "fps=10,scale=320:-1:flags=lanczos", "-y", output_path
     ]
-    subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    return output_path
\ No newline at end of file
+    scheduler.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return output_path
+
+
+# Size reduction
+AUDIO_BITRATE_KBPS = 128
+LOW_AUDIO_BITRATE_KBPS = 64  # used when the target leaves little room for video
+MIN_VIDEO_BITRATE_KBPS = 100
+CONTAINER_OVERHEAD = 0.02
+DEFAULT_CRF = 28
+X264_PRESETS = ('ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium', 'slow', 'slower', 'veryslow')
+SEGMENT_MIN_SECONDS = 60  # shorter videos are encoded in one piece
+PARALLEL_MIN_DURATION = 180
+
+
+def probe_media(input_path):
+    """Duration in seconds and whether there is an audio stream, from ffmpeg's banner."""
+    # Only reads the header, so it doesn't take a scheduler slot (and has no output for -threads)
+    result = subprocess.run(["ffmpeg", "-hide_banner", "-i", input_path],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, errors='replace')
+    match = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", result.stderr)
+    if not match:
+        raise ValueError(f"Could not read the duration of {os.path.basename(input_path)}")
+    hours, minutes, seconds = match.groups()
+    return {
+        'duration': int(hours) * 3600 + int(minutes) * 60 + float(seconds),
+        'has_audio': bool(re.search(r"Stream #\S+.*: Audio:", result.stderr)),
+    }
+
+
+def _video_args(video_kbps, crf, max_height, preset):
+    args = ["-c:v", "libx264", "-preset", preset, "-pix_fmt", "yuv420p"]
+    if max_height:
+        args += ["-vf", f"scale=-2:'min({int(max_height)},ih)'"]
+    if video_kbps:
+        args += ["-b:v", f"{video_kbps}k"]
+    else:
+        args += ["-crf", str(crf)]
+    return args
+
+
+def _encode_video(input_path, output_path, video_args, audio_args, passlog):
+    """One x264 encode; two passes when a bitrate is set (target size), else a single CRF pass."""
+    if "-b:v" in video_args:
+        scheduler.run(["ffmpeg", "-y", "-i", input_path] + video_args +
+                      ["-pass", "1", "-passlogfile", passlog, "-an", "-f", "null", os.devnull],
+                      check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        video_args = video_args + ["-pass", "2", "-passlogfile", passlog]
+    scheduler.run(["ffmpeg", "-y", "-i", input_path] + video_args + audio_args + [output_path],
+                  check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def _encode_segmented(input_path, output_path, video_args, audio_args, has_audio, duration, work_dir):
+    """
+    Split the video at keyframes (stream copy), encode the segments in parallel and
+    join them with the concat demuxer, again without re-encoding. Audio is encoded
+    once from the original so there are no gaps at the segment joins.
+    """
+    segments = max(2, min(scheduler.CORE_BUDGET, int(duration // SEGMENT_MIN_SECONDS)))
+    scheduler.run(["ffmpeg", "-y", "-i", input_path, "-map", "0:v:0", "-an", "-c", "copy",
+                   "-f", "segment", "-segment_time", f"{duration / segments:.3f}", "-reset_timestamps", "1",
+                   os.path.join(work_dir, "src_%03d.mp4")],
+                  want=1, express=True, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    sources = sorted(name for name in os.listdir(work_dir) if name.startswith("src_"))
+    encoded = [os.path.join(work_dir, name.replace("src_", "enc_")) for name in sources]
+    with ThreadPoolExecutor(max_workers=len(sources) + 1) as pool:
+        futures = [pool.submit(_encode_video, os.path.join(work_dir, src), dst, video_args, [],
+                               os.path.join(work_dir, f"pass_{n}"))
+                   for n, (src, dst) in enumerate(zip(sources, encoded))]
+        audio_path = os.path.join(work_dir, "audio.m4a")
+        if has_audio:
+            futures.append(pool.submit(
+                scheduler.run, ["ffmpeg", "-y", "-i", input_path, "-vn"] + audio_args + [audio_path],
+                want=1, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        # Progress is counted here: the pool threads don't carry the job id
+        for done, future in enumerate(as_completed(futures), 1):
+            future.result()
+            progress.report('segments', force=True, done=done, total=len(futures))
+    list_path = os.path.join(work_dir, "segments.txt")
+    with open(list_path, "w", encoding="utf-8") as f:
+        for path in encoded:
+            f.write("file '{}'\n".format(path.replace("\\", "/").replace("'", "'\\''")))
+    command = ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", list_path]
+    if has_audio:
+        command += ["-i", audio_path, "-map", "0:v", "-map", "1:a"]
+    command += ["-c", "copy", "-movflags", "+faststart", output_path]
+    scheduler.run(command, want=1, express=True, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def reduce_video_size(input_path, target_mb=None, crf=None, max_height=None, preset='medium'):
+    """
+    Re-encode a video to H.264/AAC MP4, smaller than the input.
+    target_mb: size to aim for; the video bitrate is derived from it and encoded in two passes.
+    crf: quality level (18 = near lossless, 28 = default, 35+ = small) when no target is given.
+    max_height: also scale down to at most this height.
+    Videos longer than a few minutes are split at keyframes and the parts encoded in parallel.
+    Returns the output file path.
+    """
+    if preset not in X264_PRESETS:
+        raise ValueError(f"Invalid x264 preset: {preset}")
+    info = probe_media(input_path)
+    duration = info['duration']
+    audio_kbps = AUDIO_BITRATE_KBPS
+    video_kbps = None
+    if target_mb:
+        total_kbps = target_mb * 8 * 1024 * (1 - CONTAINER_OVERHEAD) / max(duration, 0.1)
+        if total_kbps - audio_kbps < 4 * LOW_AUDIO_BITRATE_KBPS:
+            audio_kbps = LOW_AUDIO_BITRATE_KBPS
+        video_kbps = int(total_kbps - (audio_kbps if info['has_audio'] else 0))
+        if video_kbps < MIN_VIDEO_BITRATE_KBPS:
+            raise ValueError(f"Target size of {target_mb} MB is too small for {duration:.0f}s of video")
+    video_args = _video_args(video_kbps, crf or DEFAULT_CRF, max_height, preset)
+    audio_args = ["-c:a", "aac", "-b:a", f"{audio_kbps}k"] if info['has_audio'] else ["-an"]
+
+    out_dir = os.path.join(UPLOADS_DIR, 'video_reduced')
+    os.makedirs(out_dir, exist_ok=True)
+    base = os.path.splitext(os.path.basename(input_path))[0]
+    output_path = os.path.join(out_dir, f"{base}_reduced.mp4")
+    work_dir = tempfile.mkdtemp(prefix=f"{base}_", dir=out_dir)
+    try:
+        if duration >= PARALLEL_MIN_DURATION and scheduler.CORE_BUDGET > 1:
+            _encode_segmented(input_path, output_path, video_args, audio_args, info['has_audio'], duration, work_dir)
+        else:
+            _encode_video(input_path, output_path, video_args, audio_args + ["-movflags", "+faststart"],
+                          os.path.join(work_dir, "pass"))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return output_path
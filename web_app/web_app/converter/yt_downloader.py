@@ -1,76 +1,542 @@
+"""
+yt_dlp downloads into yt_converted.
+
+A DownloadManager runs several playlist items at once, each with concurrent
+fragment downloads, under one bandwidth cap shared by all of them. Audio
+extraction runs as a separate ffmpeg stage, so item k is converted while
+item k+1 downloads. Every download is a DownloadTask whose per-item progress
+can be read while it runs (see /convert/yt/downloads) or followed as progress
+events on the channel named after the download id.
+
+Playlist listings are cached for INFO_TTL, and a download archive per output
+format remembers which videos are already in yt_converted, so re-syncing a
+playlist only downloads its new entries.
+"""
 import os
+import re
+import json
+import time
+import uuid
+import hashlib
+import shutil
+import logging
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+
 import yt_dlp
+from yt_dlp.utils import sanitize_filename
+
+from converter import scheduler
+from converter import progress
+
+logger = logging.getLogger(__name__)
 
 YT_CONVERTED_DIR = os.path.join(os.path.dirname(__file__), 'yt_converted')
 os.makedirs(YT_CONVERTED_DIR, exist_ok=True)
 
-def _progress_hook(d):
-    if d['status'] == 'downloading':
-        print(f"Downloading: {d.get('filename', '')} - {d.get('downloaded_bytes', 0)}/{d.get('total_bytes', 0)} bytes")
-    elif d['status'] == 'finished':
-        print(f"Done downloading: {d.get('filename', '')}")
+
+def parse_rate(value):
+    """'5M', '500K' or a plain number of bytes per second; 0 or empty means unlimited."""
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMG]?)I?B?\s*', str(value or '0'), re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Invalid rate: {value}")
+    number, unit = match.groups()
+    return int(float(number) * 1024 ** ' KMG'.index(unit.upper() or ' '))
+
+
+CONCURRENT_ITEMS = int(os.environ.get('YT_CONCURRENT_ITEMS', 3))
+FRAGMENT_THREADS = int(os.environ.get('YT_FRAGMENT_THREADS', 4))
+RATE_LIMIT = parse_rate(os.environ.get('YT_RATE_LIMIT', 0))  # bytes/s over all downloads, 0 = unlimited
+TASK_TTL = int(os.environ.get('YT_TASK_TTL', 3600))  # seconds a finished download is kept for status queries
+INFO_TTL = int(os.environ.get('YT_INFO_TTL', 6 * 3600))  # seconds a playlist listing is reused
+MP3_BITRATE = '192k'
+
+FORMATS = {
+    'mp3': {'format': 'bestaudio/best'},
+    'mp4': {'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/mp4', 'merge_output_format': 'mp4'},
+}
+
+
+class Throttle:
+    """Token bucket shared by every download thread; progress hooks sleep to stay under rate."""
+
+    BURST_SECONDS = 1.0
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._clock = 0.0
+        self._lock = threading.Lock()
+
+    def consume(self, nbytes):
+        if not self.rate or nbytes <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._clock = max(self._clock, now - self.BURST_SECONDS) + nbytes / self.rate
+            delay = self._clock - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+class InfoCache:
+    """Playlist listings as JSON files keyed by URL hash, reused until they are ttl seconds old."""
+
+    def __init__(self, root, ttl=INFO_TTL):
+        self.root = root
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, url):
+        return os.path.join(self.root, hashlib.sha256(url.encode('utf-8')).hexdigest() + '.json')
+
+    def get(self, url):
+        try:
+            with open(self._path(url), encoding='utf-8') as f:
+                listing = json.load(f)
+        except (OSError, ValueError):
+            listing = None
+        if listing is None or time.time() - listing.get('fetched', 0) > self.ttl:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return listing
+
+    def put(self, url, listing):
+        os.makedirs(self.root, exist_ok=True)
+        path = self._path(url)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(dict(listing, fetched=time.time()), f)
+        os.replace(tmp_path, path)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'ttl_seconds': self.ttl}
+
+
+class DownloadArchive:
+    """
+    Videos already downloaded in one output format: lines of 'extractor id<TAB>file<TAB>url'
+    (file relative to the archive's directory) in an append-only text file. The URL lets
+    playlist entries listed without an id be matched without resolving them again.
+    An entry whose file has since been deleted no longer counts.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.root = os.path.dirname(path)
+        self._entries = {}
+        self._keys_by_url = {}
+        self._lock = threading.Lock()
+        try:
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    key, filename, url = (line.rstrip('\n').split('\t') + ['', ''])[:3]
+                    if key:
+                        self._entries[key] = filename
+                        if url:
+                            self._keys_by_url[url] = key
+        except OSError:
+            pass
+
+    def __contains__(self, key):
+        with self._lock:
+            filename = self._entries.get(key)
+        return filename is not None and os.path.exists(os.path.join(self.root, filename))
+
+    def key_for(self, url):
+        with self._lock:
+            return self._keys_by_url.get(url)
+
+    def add(self, key, path, url=''):
+        filename = os.path.relpath(path, self.root)
+        with self._lock:
+            self._entries[key] = filename
+            if url:
+                self._keys_by_url[url] = key
+            os.makedirs(self.root, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(f"{key}\t{filename}\t{url}\n")
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+def archive_key(extractor, video_id):
+    if not extractor or not video_id:
+        return None
+    return f"{extractor.lower()} {video_id}"
+
+
+class DownloadItem:
+    def __init__(self, index, url, title=None, key=None):
+        self.index = index
+        self.url = url
+        self.title = title
+        self.key = key  # archive key ('extractor id'), known up front for most playlist entries
+        self.status = 'queued'  # queued, downloading, converting, done, skipped, failed
+        self.downloaded_bytes = 0
+        self.total_bytes = None
+        self.speed = None
+        self.eta = None
+        self.filename = None
+        self.error = None
+        self._file_bytes = {}  # bytes seen per file, an item can have separate video and audio files
+
+    def to_dict(self):
+        info = {
+            'index': self.index,
+            'url': self.url,
+            'title': self.title,
+            'status': self.status,
+            'downloaded_bytes': self.downloaded_bytes,
+            'total_bytes': self.total_bytes,
+            'speed': self.speed,
+            'eta': self.eta,
+        }
+        if self.filename:
+            info['filename'] = os.path.basename(self.filename)
+        if self.error:
+            info['error'] = self.error
+        return info
+
+
+class DownloadTask:
+    def __init__(self, url, fmt, playlist):
+        self.id = uuid.uuid4().hex
+        self.url = url
+        self.fmt = fmt
+        self.playlist = playlist
+        self.title = None
+        self.status = 'queued'  # queued, running, done, failed
+        self.listing = None  # 'cache' or 'fresh' for playlists
+        self.items = []
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self._done = threading.Event()
+        self._published = 0.0
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def counts(self):
+        counts = {}
+        for item in self.items:
+            counts[item.status] = counts.get(item.status, 0) + 1
+        return counts
+
+    def report(self):
+        """How much of this sync came from cache or the archive and how much was fetched."""
+        counts = self.counts()
+        return {
+            'listing': self.listing,
+            'already_downloaded': counts.get('skipped', 0),
+            'downloaded': counts.get('done', 0),
+            'failed': counts.get('failed', 0),
+        }
+
+    def to_dict(self, items=True):
+        info = {
+            'download_id': self.id,
+            'url': self.url,
+            'format': self.fmt,
+            'playlist': self.playlist,
+            'title': self.title,
+            'status': self.status,
+            'created': self.created,
+            'finished': self.finished,
+            'total_items': len(self.items),
+            'items_by_status': self.counts(),
+            'downloaded_bytes': sum(item.downloaded_bytes for item in self.items),
+            'report': self.report(),
+        }
+        if self.error:
+            info['error'] = self.error
+        if items:
+            info['items'] = [item.to_dict() for item in self.items]
+        return info
+
+
+class DownloadManager:
+    def __init__(self, out_dir=YT_CONVERTED_DIR, concurrent_items=CONCURRENT_ITEMS,
+                 fragment_threads=FRAGMENT_THREADS, rate_limit=RATE_LIMIT):
+        self.out_dir = out_dir
+        self.fragment_threads = fragment_threads
+        self.throttle = Throttle(rate_limit)
+        self.info_cache = InfoCache(os.path.join(out_dir, '.cache', 'info'))
+        self._archives = {fmt: DownloadArchive(os.path.join(out_dir, f'.archive_{fmt}.txt')) for fmt in FORMATS}
+        self._counters = {'archive_hits': 0, 'downloads': 0}
+        self._downloads = ThreadPoolExecutor(max_workers=concurrent_items, thread_name_prefix='yt-download')
+        # ffmpeg runs are limited by the scheduler, this pool only has to keep them queued
+        self._conversions = ThreadPoolExecutor(max_workers=concurrent_items, thread_name_prefix='yt-convert')
+        self._tasks = {}
+        self._lock = threading.Lock()
+
+    def start(self, url, fmt='mp3', playlist=False, refresh=False):
+        """
+        Start downloading url (a playlist if playlist) in the background and return its task.
+        refresh re-reads the playlist even if its cached listing is still fresh.
+        """
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported format: {fmt}")
+        task = DownloadTask(url, fmt, playlist)
+        with self._lock:
+            self._prune()
+            self._tasks[task.id] = task
+        progress.publish(task.id, {'status': 'queued'})
+        threading.Thread(target=self._run, args=(task, refresh), name=f'yt-task-{task.id[:8]}', daemon=True).start()
+        return task
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        return dict(counters, info_cache=self.info_cache.stats(),
+                    archived={fmt: len(archive) for fmt, archive in self._archives.items()})
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def get(self, task_id):
+        with self._lock:
+            return self._tasks.get(task_id)
+
+    def tasks(self):
+        with self._lock:
+            return list(self._tasks.values())
+
+    def _prune(self):
+        cutoff = time.time() - TASK_TTL
+        for task_id in [t.id for t in self._tasks.values() if t.finished and t.finished < cutoff]:
+            del self._tasks[task_id]
+
+    def _run(self, task, refresh=False):
+        task.status = 'running'
+        try:
+            out_dir = self.out_dir
+            if task.playlist:
+                listing = None if refresh else self.info_cache.get(task.url)
+                task.listing = 'cache' if listing else 'fresh'
+                if listing is None:
+                    listing = self._list_playlist(task.url)
+                    self.info_cache.put(task.url, listing)
+                task.title = listing['title']
+                out_dir = os.path.join(out_dir, sanitize_filename(task.title or 'playlist'))
+                task.items = [DownloadItem(n, e['url'], e['title'], e['key'])
+                              for n, e in enumerate(listing['entries'], 1)]
+            else:
+                task.items = [DownloadItem(1, task.url)]
+            archive = self._archives[task.fmt]
+            for item in task.items:
+                item.key = item.key or archive.key_for(item.url)
+                if item.key and item.key in archive:
+                    self._skip(task, item)
+            pending = [item for item in task.items if item.status == 'queued']
+            downloads = [self._downloads.submit(self._process, task, item, out_dir) for item in pending]
+            # Each finished download hands back its pending audio extraction, if any
+            conversions = [future.result() for future in downloads]
+            wait_futures([c for c in conversions if c is not None])
+            failed = [item for item in task.items if item.status == 'failed']
+            unfinished = [item for item in task.items if item.status not in ('done', 'skipped', 'failed')]
+            for item in unfinished:
+                self._fail(task, item, f"Item stopped while {item.status}")
+            failed += unfinished
+            if len(failed) == 1 and len(task.items) == 1:
+                task.status = 'failed'
+                task.error = failed[0].error
+            elif failed:
+                # Items that made it are kept and archived; the report says how many did
+                task.status = 'failed'
+                task.error = f"{len(failed)} of {len(task.items)} items failed (first: {failed[0].error})"
+                logger.warning(f"Download {task.id}: {task.error}")
+            else:
+                task.status = 'done'
+        except Exception as e:
+            logger.error(f"Download {task.id} failed: {e}")
+            task.status = 'failed'
+            task.error = str(e)
+        task.finished = time.time()
+        task._done.set()
+        event = {'status': task.status, 'report': task.report()}
+        if task.error:
+            event['error'] = task.error
+        progress.publish(task.id, event)
+
+    def _list_playlist(self, url):
+        """Playlist title and url, title and archive key of its entries, without resolving every entry."""
+        opts = {'extract_flat': 'in_playlist', 'quiet': True, 'no_warnings': True}
+        with yt_dlp.YoutubeDL(opts) as ydl:
+            info = ydl.extract_info(url, download=False)
+        if info is None:
+            raise RuntimeError(f"Could not read playlist {url}")
+        entries = []
+        for entry in info.get('entries') or []:
+            entry_url = entry and (entry.get('webpage_url') or entry.get('url'))
+            if entry_url:
+                entries.append({'url': entry_url, 'title': entry.get('title'),
+                                'key': archive_key(entry.get('ie_key'), entry.get('id'))})
+        return {'title': info.get('title'), 'entries': entries}
+
+    def _publish(self, task, item=None, force=False):
+        """Progress event on the download's channel, at most every progress.MIN_INTERVAL unless force."""
+        now = time.monotonic()
+        if not force and now - task._published < progress.MIN_INTERVAL:
+            return
+        task._published = now
+        event = {'status': 'running', 'stage': 'download', 'items_by_status': task.counts(),
+                 'downloaded_bytes': sum(i.downloaded_bytes for i in task.items)}
+        if item is not None:
+            event['item'] = item.to_dict()
+        progress.publish(task.id, event)
+
+    def _skip(self, task, item):
+        item.status = 'skipped'
+        self._count('archive_hits')
+        self._publish(task, item, force=True)
+
+    def _fail(self, task, item, error):
+        item.status = 'failed'
+        item.error = error
+        self._publish(task, item, force=True)
+
+    def _finish(self, task, item, path):
+        item.filename = path
+        item.status = 'done'
+        self._count('downloads')
+        if item.key:
+            self._archives[task.fmt].add(item.key, path, item.url)
+        self._publish(task, item, force=True)
+
+    def _process(self, task, item, out_dir):
+        """
+        Download one item. Audio extraction goes to the conversion pool and its future is
+        returned, so this download thread moves on to the next item while ffmpeg runs.
+        """
+        try:
+            path = self._download(task, item, out_dir)
+        except Exception as e:
+            self._fail(task, item, str(e))
+            logger.error(f"Download of {item.url} failed: {e}")
+            return
+        if path is None:
+            return
+        if task.fmt != 'mp3' or path.lower().endswith('.mp3'):
+            self._finish(task, item, path)
+            return
+        item.status = 'converting'
+        self._publish(task, item, force=True)
+        return self._conversions.submit(self._extract_audio, task, item, path)
+
+    def _download(self, task, item, out_dir):
+        item.status = 'downloading'
+        # Part and fragment files go to a directory of this item, so concurrent items never share them
+        temp_dir = tempfile.mkdtemp(prefix='yt_item_')
+        opts = {
+            'format': FORMATS[task.fmt]['format'],
+            'paths': {'home': out_dir, 'temp': temp_dir},
+            'outtmpl': '%(title)s.%(ext)s',
+            'quiet': True,
+            'no_warnings': True,
+            'noprogress': True,
+            'noplaylist': True,
+            'concurrent_fragment_downloads': self.fragment_threads,
+            'progress_hooks': [lambda d: self._on_progress(task, item, d)],
+        }
+        if 'merge_output_format' in FORMATS[task.fmt]:
+            opts['merge_output_format'] = FORMATS[task.fmt]['merge_output_format']
+        try:
+            with yt_dlp.YoutubeDL(opts) as ydl:
+                # Resolve first: entries without an id in the listing are checked against the archive here
+                info = ydl.extract_info(item.url, download=False)
+                if info is None:
+                    raise RuntimeError(f"Nothing downloaded from {item.url}")
+                item.title = item.title or info.get('title')
+                item.key = item.key or archive_key(info.get('extractor_key'), info.get('id'))
+                if item.key and item.key in self._archives[task.fmt]:
+                    self._skip(task, item)
+                    return None
+                info = ydl.process_ie_result(info, download=True)
+                downloads = info.get('requested_downloads') or []
+                return downloads[0]['filepath'] if downloads else ydl.prepare_filename(info)
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    def _on_progress(self, task, item, d):
+        if d['status'] not in ('downloading', 'finished'):
+            return
+        filename = d.get('filename', '')
+        downloaded = d.get('downloaded_bytes') or 0
+        previous = item._file_bytes.get(filename, 0)
+        item._file_bytes[filename] = downloaded
+        item.downloaded_bytes = sum(item._file_bytes.values())
+        total = d.get('total_bytes') or d.get('total_bytes_estimate')
+        if total:
+            item.total_bytes = int(total) + sum(v for k, v in item._file_bytes.items() if k != filename)
+        item.speed = d.get('speed')
+        item.eta = d.get('eta')
+        self._publish(task, item)
+        self.throttle.consume(downloaded - previous)
+
+    def _extract_audio(self, task, item, path):
+        output = os.path.splitext(path)[0] + '.mp3'
+        command = ['ffmpeg', '-y', '-hide_banner', '-loglevel', 'error', '-i', path,
+                   '-vn', '-codec:a', 'libmp3lame', '-b:a', MP3_BITRATE, output]
+        try:
+            scheduler.run(command, want=1, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            os.remove(path)
+            self._finish(task, item, output)
+        except subprocess.CalledProcessError as e:
+            self._fail(task, item, f"ffmpeg failed: {(e.stderr or b'').decode('utf-8', 'replace').strip()}")
+            logger.error(f"Audio extraction of {path} failed: {item.error}")
+        except Exception as e:
+            # ffmpeg missing (FileNotFoundError), disk errors and the like
+            self._fail(task, item, f"Audio extraction failed: {e}")
+            logger.error(f"Audio extraction of {path} failed: {e}")
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_manager():
+    """The download manager of this process, started on first use."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = DownloadManager()
+        return _manager
+
+
+def _download_and_wait(url, fmt, playlist):
+    task = get_manager().start(url, fmt, playlist)
+    task.wait()
+    if task.status == 'failed':
+        raise RuntimeError(task.error)
+    return task
+
 
 def download_yt_mp3(url):
     """Download a single YouTube video as mp3 to yt_converted."""
-    ydl_opts = {
-        'format': 'bestaudio/best',
-        'outtmpl': os.path.join(YT_CONVERTED_DIR, '%(title)s.%(ext)s'),
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'mp3',
-            'preferredquality': '192',
-        }],
-        'quiet': True,
-        'ignoreerrors': True,
-        'progress_hooks': [_progress_hook],
-    }
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        ydl.download([url])
+    _download_and_wait(url, 'mp3', playlist=False)
 
 
 def download_yt_mp4(url):
     """Download a single YouTube video as mp4 to yt_converted."""
-    ydl_opts = {
-        'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/mp4',
-        'outtmpl': os.path.join(YT_CONVERTED_DIR, '%(title)s.%(ext)s'),
-        'merge_output_format': 'mp4',
-        'quiet': True,
-        'ignoreerrors': True,
-        'progress_hooks': [_progress_hook],
-    }
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        ydl.download([url])
+    _download_and_wait(url, 'mp4', playlist=False)
 
 
 def download_yt_playlist_mp3(playlist_url):
     """Download all videos in a YouTube playlist as mp3 to yt_converted."""
-    ydl_opts = {
-        'format': 'bestaudio/best',
-        'outtmpl': os.path.join(YT_CONVERTED_DIR, '%(playlist_title)s/%(title)s.%(ext)s'),
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'mp3',
-            'preferredquality': '192',
-        }],
-        'quiet': True,
-        'ignoreerrors': True,
-        'yesplaylist': True,
-        'progress_hooks': [_progress_hook],
-    }
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        ydl.download([playlist_url])
+    _download_and_wait(playlist_url, 'mp3', playlist=True)
 
 
 def download_yt_playlist_mp4(playlist_url):
     """Download all videos in a YouTube playlist as mp4 to yt_converted."""
-    ydl_opts = {
-        'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/mp4',
-        'outtmpl': os.path.join(YT_CONVERTED_DIR, '%(playlist_title)s/%(title)s.%(ext)s'),
-        'merge_output_format': 'mp4',
-        'quiet': True,
-        'ignoreerrors': True,
-        'yesplaylist': True,
-        'progress_hooks': [_progress_hook],
-    }
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        ydl.download([playlist_url]) 
\ No newline at end of file
+    _download_and_wait(playlist_url, 'mp4', playlist=True)
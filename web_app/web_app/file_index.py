@@ -0,0 +1,133 @@
+"""
+In-memory index of a folder for the /files listing.
+
+The folder is only rescanned when its own mtime changes (a file was added,
+removed or renamed), plus a periodic full rescan as a polling fallback for
+files rewritten in place. Sorted views are cached per sort order until the
+next change, and every state has a fingerprint that clients can use as ETag.
+"""
+import os
+import json
+import time
+import base64
+import bisect
+import hashlib
+import threading
+
+SORT_FIELDS = ('modified', 'name', 'size')
+
+
+def format_size(file_size):
+    if file_size < 1024:
+        return f"{file_size} B"
+    elif file_size < 1024 * 1024:
+        return f"{file_size // 1024} KB"
+    return f"{file_size // (1024 * 1024)} MB"
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError for anything that isn't one."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if not isinstance(key, list) or len(key) != 2:
+        raise ValueError('Invalid cursor')
+    return tuple(key)
+
+
+class FolderIndex:
+    def __init__(self, folder, rescan_interval=30):
+        self.folder = folder
+        self.rescan_interval = rescan_interval
+        self.fingerprint = ''
+        self._entries = {}
+        self._dir_mtime_ns = None
+        self._last_scan = 0.0
+        self._views = {}
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self._dir_mtime_ns = None
+
+    def refresh(self):
+        """Rescan if the folder changed (or the fallback interval passed); returns the fingerprint."""
+        with self._lock:
+            try:
+                dir_mtime_ns = os.stat(self.folder).st_mtime_ns
+            except OSError:
+                dir_mtime_ns = -1
+            if dir_mtime_ns == self._dir_mtime_ns and time.time() - self._last_scan < self.rescan_interval:
+                return self.fingerprint
+            entries = {}
+            if dir_mtime_ns != -1:
+                with os.scandir(self.folder) as it:
+                    for entry in it:
+                        try:
+                            if not entry.is_file():
+                                continue
+                            st = entry.stat()
+                        except OSError:
+                            continue
+                        entries[entry.name] = {
+                            'name': entry.name,
+                            'size': format_size(st.st_size),
+                            'size_bytes': st.st_size,
+                            'modified': int(st.st_mtime),
+                            'extension': os.path.splitext(entry.name)[1].lower(),
+                        }
+            self._dir_mtime_ns = dir_mtime_ns
+            self._last_scan = time.time()
+            digest = hashlib.sha1()
+            for name in sorted(entries):
+                e = entries[name]
+                digest.update(f"{name}\0{e['size_bytes']}\0{e['modified']}\n".encode('utf-8', 'surrogateescape'))
+            fingerprint = digest.hexdigest()
+            if fingerprint != self.fingerprint:
+                self._entries = entries
+                self._views = {}
+                self.fingerprint = fingerprint
+            return self.fingerprint
+
+    def _view(self, sort):
+        """Entries sorted ascending by (sort field, name), with the parallel list of keys."""
+        view = self._views.get(sort)
+        if view is None:
+            items = sorted(self._entries.values(), key=lambda e: (e[sort], e['name']))
+            view = (items, [(e[sort], e['name']) for e in items])
+            self._views[sort] = view
+        return view
+
+    def listing(self, sort='modified', descending=True, extensions=None, cursor=None, limit=None):
+        """
+        Return (files, total, next_cursor). The cursor is the key of the last
+        file returned, so pages stay consistent when files are added meanwhile.
+        """
+        if sort not in SORT_FIELDS:
+            raise ValueError(f"Invalid sort field: {sort}")
+        self.refresh()
+        with self._lock:
+            items, keys = self._view(sort)
+        if extensions:
+            filtered = [(e, k) for e, k in zip(items, keys) if e['extension'] in extensions]
+            items = [e for e, _ in filtered]
+            keys = [k for _, k in filtered]
+        total = len(items)
+        if descending:
+            end = bisect.bisect_left(keys, decode_cursor(cursor)) if cursor else total
+            start = 0 if limit is None else max(end - limit, 0)
+            page = items[start:end][::-1]
+            more = start > 0
+        else:
+            start = bisect.bisect_right(keys, decode_cursor(cursor)) if cursor else 0
+            end = total if limit is None else min(start + limit, total)
+            page = items[start:end]
+            more = end < total
+        next_cursor = encode_cursor([page[-1][sort], page[-1]['name']]) if page and more else None
+        return page, total, next_cursor
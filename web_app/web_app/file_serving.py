@@ -0,0 +1,207 @@
+"""
+File responses with HTTP validators and byte ranges.
+
+Supports strong ETags, If-None-Match / If-Modified-Since (304), Range with
+single and multiple ranges (206, multipart/byteranges), If-Range, and hands
+whole files to the server's wsgi.file_wrapper so gunicorn and friends can
+use the kernel sendfile path. With USE_X_SENDFILE the front server does the
+transfer instead.
+"""
+import os
+import uuid
+import mimetypes
+from urllib.parse import quote
+from flask import request, current_app, Response
+from werkzeug.exceptions import NotFound
+from werkzeug.http import http_date, parse_date, parse_etags, quote_header_value
+from werkzeug.security import safe_join
+from werkzeug.wsgi import wrap_file
+
+CHUNK_SIZE = 256 * 1024
+MAX_RANGES = 64  # more ranges than this in one request get the whole file instead
+
+
+def make_etag(st):
+    """Strong ETag from inode, size and nanosecond mtime: changes whenever the file is replaced or rewritten."""
+    return f"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"
+
+
+def _content_disposition(name):
+    try:
+        name.encode('latin-1')
+        return f"attachment; filename={quote_header_value(name)}"
+    except UnicodeEncodeError:
+        return f"attachment; filename*=UTF-8''{quote(name, safe='')}"
+
+
+def _iter_range(f, start, length):
+    try:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def _iter_multipart(path, ranges, size, content_type, boundary):
+    with open(path, 'rb') as f:
+        for start, stop in ranges:
+            yield (f"\r\n--{boundary}\r\n"
+                   f"Content-Type: {content_type}\r\n"
+                   f"Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n").encode('latin-1')
+            f.seek(start)
+            remaining = stop - start
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+        yield f"\r\n--{boundary}--\r\n".encode('latin-1')
+
+
+def _multipart_length(ranges, size, content_type, boundary):
+    total = 0
+    for start, stop in ranges:
+        total += len(f"\r\n--{boundary}\r\nContent-Type: {content_type}\r\n"
+                     f"Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n")
+        total += stop - start
+    return total + len(f"\r\n--{boundary}--\r\n")
+
+
+def parse_ranges(value):
+    """
+    Byte ranges of a Range header as (start, stop) pairs, stop exclusive or None for
+    open-ended, start negative for a suffix range; None if the header is absent or invalid.
+    Unlike werkzeug's parse_range_header this keeps unsorted and overlapping ranges,
+    which _satisfiable_ranges merges.
+    """
+    if not value:
+        return None
+    unit, _, spec = value.partition('=')
+    if unit.strip().lower() != 'bytes':
+        return None
+    ranges = []
+    for part in spec.split(','):
+        first, dash, last = part.strip().partition('-')
+        first, last = first.strip(), last.strip()
+        if not dash or not (first.isdigit() or first == '') or not (last.isdigit() or last == ''):
+            return None
+        if first == '':
+            if last == '' or int(last) == 0:
+                return None
+            ranges.append((-int(last), None))
+        elif last == '':
+            ranges.append((int(first), None))
+        elif int(last) < int(first):
+            return None
+        else:
+            ranges.append((int(first), int(last) + 1))
+    if not ranges or len(ranges) > MAX_RANGES:
+        return None
+    return ranges
+
+
+def _satisfiable_ranges(ranges, size):
+    """Resolve parsed ranges against size; overlapping and adjacent ranges are coalesced."""
+    resolved = []
+    for start, stop in ranges:
+        if start < 0:  # suffix range: last -start bytes
+            start, stop = max(size + start, 0), size
+        else:
+            stop = size if stop is None else min(stop, size)
+        if start < stop:
+            resolved.append([start, stop])
+    resolved.sort()
+    merged = []
+    for start, stop in resolved:
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], stop)
+        else:
+            merged.append([start, stop])
+    return [tuple(r) for r in merged]
+
+
+def _if_range_allows(etag, mtime):
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        # If-Range requires a strong comparison
+        return not if_range.startswith('W/') and if_range.strip('"') == etag
+    date = parse_date(if_range)
+    return date is not None and int(mtime) <= int(date.timestamp())
+
+
+def _not_modified(etag, mtime):
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match:
+        return parse_etags(if_none_match).contains_weak(etag)
+    since = parse_date(request.headers.get('If-Modified-Since'))
+    return since is not None and int(mtime) <= int(since.timestamp())
+
+
+def serve_file(folder, filename, as_attachment=False, download_name=None):
+    path = safe_join(folder, filename)
+    if path is None:
+        raise NotFound()
+    try:
+        st = os.stat(path)
+    except OSError:
+        raise NotFound()
+    if not os.path.isfile(path):
+        raise NotFound()
+
+    size = st.st_size
+    etag = make_etag(st)
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    headers = {
+        'ETag': f'"{etag}"',
+        'Last-Modified': http_date(st.st_mtime),
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'no-cache',
+    }
+    if as_attachment:
+        headers['Content-Disposition'] = _content_disposition(download_name or os.path.basename(path))
+
+    if request.method in ('GET', 'HEAD') and _not_modified(etag, st.st_mtime):
+        return Response(status=304, headers=headers)
+
+    if current_app.config.get('USE_X_SENDFILE'):
+        # The front server (Apache/lighttpd) streams the file and handles Range itself
+        headers['X-Sendfile'] = path
+        return Response(status=200, headers=headers, content_type=content_type)
+
+    requested = parse_ranges(request.headers.get('Range'))
+    if requested is not None and _if_range_allows(etag, st.st_mtime):
+        ranges = _satisfiable_ranges(requested, size)
+        if not ranges:
+            headers['Content-Range'] = f"bytes */{size}"
+            return Response(status=416, headers=headers)
+        if len(ranges) == 1:
+            start, stop = ranges[0]
+            headers['Content-Range'] = f"bytes {start}-{stop - 1}/{size}"
+            headers['Content-Length'] = str(stop - start)
+            f = open(path, 'rb')
+            if request.environ.get('SERVER_SOFTWARE', '').startswith('gunicorn'):
+                # gunicorn's file_wrapper sendfile()s exactly Content-Length bytes from the current offset
+                f.seek(start)
+                body = wrap_file(request.environ, f, CHUNK_SIZE)
+            else:
+                body = _iter_range(f, start, stop - start)
+            return Response(body, status=206, headers=headers, content_type=content_type,
+                            direct_passthrough=True)
+        boundary = uuid.uuid4().hex
+        headers['Content-Length'] = str(_multipart_length(ranges, size, content_type, boundary))
+        body = _iter_multipart(path, ranges, size, content_type, boundary)
+        return Response(body, status=206, headers=headers,
+                        content_type=f"multipart/byteranges; boundary={boundary}", direct_passthrough=True)
+
+    headers['Content-Length'] = str(size)
+    body = wrap_file(request.environ, open(path, 'rb'), CHUNK_SIZE)
+    return Response(body, status=200, headers=headers, content_type=content_type, direct_passthrough=True)
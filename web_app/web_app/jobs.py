@@ -0,0 +1,396 @@
+"""
+Background job queue for the /convert endpoints.
+
+Conversions run in a bounded pool of worker processes that import the heavy
+converter dependencies once at startup. A request only has to hand over the
+paths of its saved inputs, so it can return a job id straight away and let the
+client fetch the status and result later.
+
+Converters that work in-process on libraries releasing the GIL (Pillow) can
+run on a thread pool instead, which skips pickling and the process hop.
+
+Status changes and the converters' progress reports are published on a
+progress channel named after the job id (see converter/progress.py). With a
+store set (see store.py), every status change is also saved there, so other
+server processes can report on the job and serve its result.
+
+A file result is moved into the result cache when the job has a cache key; any
+other output belongs to the job and is removed with release() once it has been
+served, or when the job expires.
+"""
+import os
+import time
+import uuid
+import shutil
+import logging
+import queue
+import importlib
+import threading
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait as wait_futures
+
+from result_cache import rename_for
+from converter import scheduler
+from converter import progress
+
+logger = logging.getLogger(__name__)
+
+# Every server process (see wsgi.py) starts its own pools, so by default each gets its share of the cores
+WEB_WORKERS = max(1, int(os.environ.get('WEB_WORKERS', 1)))
+MAX_WORKERS = int(os.environ.get('CONVERTER_WORKERS', max(1, (os.cpu_count() or 2) // WEB_WORKERS)))
+THREAD_WORKERS = int(os.environ.get('CONVERTER_THREADS', max(1, (os.cpu_count() or 2) // WEB_WORKERS)))
+STORE_PRUNE_INTERVAL = 60  # seconds between removals of expired jobs from the store
+MAX_PENDING = int(os.environ.get('CONVERTER_MAX_PENDING', MAX_WORKERS * 8))
+JOB_TTL = int(os.environ.get('CONVERTER_JOB_TTL', 3600))  # seconds a finished job is kept
+
+# Imported once in every worker so the first conversion doesn't pay for it
+PREWARM_MODULES = [
+    'PIL.Image',
+    'cairosvg',
+    'pytesseract',
+    'yt_dlp',
+    'converter.image_converter',
+    'converter.audio_converter',
+    'converter.video_converter',
+    'converter.document_converter',
+    'converter.archive_converter',
+    'converter.ocr_converter',
+    'converter.tts_converter',
+    'converter.yt_downloader',
+]
+
+
+class QueueFull(RuntimeError):
+    """Raised when the pool already has MAX_PENDING jobs waiting."""
+
+
+class Job:
+    def __init__(self, kind='file', download_name=None, message=None, cleanup=None, cache_key=None,
+                 input_base=None, saved_base=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind  # 'file', 'text' or 'json'
+        self.download_name = download_name
+        self.message = message
+        self.cleanup = cleanup or []
+        self.cache_key = cache_key
+        self.input_base = input_base  # base name of the uploaded file, used to name the output
+        self.saved_base = saved_base or input_base  # base name the input was saved under
+        self.cached = False
+        self.output = None  # converter output to remove when the job is released or expires
+        self.followers = []  # jobs sharing this one's run, finished along with it
+        self.status = 'queued'
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.future = None
+
+    def done(self):
+        return self.status in ('done', 'failed')
+
+    def to_dict(self):
+        status = self.status
+        if status == 'queued' and self.future is not None and self.future.running():
+            status = 'running'
+        info = {
+            'job_id': self.id,
+            'status': status,
+            'kind': self.kind,
+            'created': self.created,
+            'finished': self.finished,
+        }
+        if self.cached:
+            info['cached'] = True
+        if self.error:
+            info['error'] = self.error
+        if status == 'running':
+            last = progress.get_hub().last(self.id)
+            if last and last.get('stage'):
+                info['progress'] = last
+        return info
+
+    def record(self):
+        """What another process needs to report on this job and serve its result."""
+        return {'id': self.id, 'kind': self.kind, 'status': self.status, 'result': self.result,
+                'error': self.error, 'download_name': self.download_name, 'message': self.message,
+                'cached': self.cached, 'created': self.created, 'finished': self.finished}
+
+    @classmethod
+    def from_record(cls, record):
+        job = cls(kind=record['kind'], download_name=record['download_name'], message=record['message'])
+        job.id = record['id']
+        for field in ('status', 'result', 'error', 'cached', 'created', 'finished'):
+            setattr(job, field, record[field])
+        return job
+
+
+_executor = None
+_thread_executor = None
+_jobs = {}
+_inflight = {}  # cache key -> Job computing it, so identical requests share one run
+_cache = None
+_store = None
+_store_pruned = 0
+_lock = threading.Lock()
+
+
+def set_result_cache(cache):
+    """Use a result_cache.ResultCache for jobs submitted with a cache_key."""
+    global _cache
+    _cache = cache
+
+
+def set_store(store):
+    """Save job status in a store.Store shared with the other server processes."""
+    global _store
+    _store = store
+
+
+def _init_worker(shared_scheduler, progress_queue):
+    scheduler.install(shared_scheduler)
+    progress.install(progress_queue)
+    _prewarm()
+
+
+def _tracked(job_id, func, *args, **kwargs):
+    """Run func with the progress reports of this thread attributed to job_id."""
+    progress.set_current(job_id)
+    progress.publish(job_id, {'status': 'running'})
+    try:
+        return func(*args, **kwargs)
+    finally:
+        progress.set_current(None)
+        progress.finish(job_id)
+
+
+def _prewarm():
+    for name in PREWARM_MODULES:
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            logger.warning(f"Worker could not preload {name}: {e}")
+
+
+def get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            logger.info(f"Starting converter pool with {MAX_WORKERS} workers")
+            _executor = ProcessPoolExecutor(max_workers=MAX_WORKERS, initializer=_init_worker,
+                                            initargs=(scheduler.get_scheduler(), progress.get_queue()))
+        return _executor
+
+
+def get_thread_executor():
+    global _thread_executor
+    with _lock:
+        if _thread_executor is None:
+            logger.info(f"Starting converter thread pool with {THREAD_WORKERS} threads")
+            _thread_executor = ThreadPoolExecutor(max_workers=THREAD_WORKERS, thread_name_prefix='converter')
+        return _thread_executor
+
+
+def _remove_paths(paths):
+    for path in paths:
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.exists(path):
+                os.remove(path)
+        except OSError as e:
+            logger.warning(f"Could not remove {path}: {e}")
+
+
+def _prune():
+    """Forget finished jobs older than JOB_TTL; returns their outputs to remove. Caller holds _lock."""
+    cutoff = time.time() - JOB_TTL
+    outputs = []
+    for job_id in [j.id for j in _jobs.values() if j.finished and j.finished < cutoff]:
+        job = _jobs.pop(job_id)
+        if job.output:
+            outputs.append(job.output)
+            job.output = None
+    return outputs
+
+
+def release(job):
+    """Remove the output of a job whose result has been served, unless another job shares it."""
+    with _lock:
+        output = job.output if not job.followers else None
+        job.output = None
+    if output:
+        _remove_paths([output])
+
+
+def pending_count():
+    with _lock:
+        return sum(1 for j in _jobs.values() if not j.done())
+
+
+def _on_done(job, future):
+    result, error, output_name = None, None, None
+    try:
+        result = future.result()
+        status = 'done'
+    except Exception as e:
+        logger.error(f"Job {job.id} failed: {e}")
+        error = str(e)
+        status = 'failed'
+    if status == 'done' and job.kind == 'file':
+        output_name = os.path.basename(result)
+        if job.cache_key and _cache is not None:
+            try:
+                result = _cache.put(job.cache_key, result, job.saved_base)
+            except (OSError, sqlite3.Error) as e:
+                logger.warning(f"Could not cache result of job {job.id}: {e}")
+                job.output = result
+        else:
+            job.output = result
+    with _lock:
+        if job.cache_key:
+            _inflight.pop(job.cache_key, None)
+        followers = list(job.followers)
+    _finish(job, status, result, error, output_name, job)
+    for follower in followers:
+        _finish(follower, status, result, error, output_name, job)
+
+
+def _finish(job, status, result, error, output_name, producer):
+    """Fill in the job's result, then mark it finished: wait() returns once the status is set."""
+    if status == 'done' and job.kind == 'file' and job.download_name is None:
+        job.download_name = rename_for(output_name, producer.saved_base, job.input_base)
+    job.result = result
+    job.error = error
+    job.finished = time.time()
+    _remove_paths(job.cleanup)
+    job.status = status
+    _publish_status(job)
+
+
+def _publish_status(job):
+    event = {'status': job.status}
+    if job.error:
+        event['error'] = job.error
+    if job.cached:
+        event['cached'] = True
+    progress.publish(job.id, event)
+    _persist(job)
+
+
+def _persist(job):
+    if _store is None:
+        return
+    try:
+        _store.save_job(job.id, job.record(), job.finished)
+    except sqlite3.Error as e:
+        logger.warning(f"Could not save status of job {job.id}: {e}")
+
+
+def _prune_store():
+    global _store_pruned
+    now = time.time()
+    if _store is None or now - _store_pruned < STORE_PRUNE_INTERVAL:
+        return
+    _store_pruned = now
+    try:
+        _store.prune_jobs(now - JOB_TTL)
+    except sqlite3.Error as e:
+        logger.warning(f"Could not prune stored jobs: {e}")
+
+
+def _from_cache(job):
+    hit = _cache.get(job.cache_key, job.input_base)
+    if hit is None:
+        return False
+    job.result, name = hit
+    if job.download_name is None:
+        job.download_name = name
+    job.cached = True
+    job.finished = time.time()
+    _remove_paths(job.cleanup)
+    job.status = 'done'
+    _publish_status(job)
+    return True
+
+
+def submit(func, *args, kind='file', download_name=None, message=None, cleanup=None,
+           cache_key=None, input_base=None, saved_base=None, threaded=False, **kwargs):
+    """
+    Queue func(*args, **kwargs) on the worker pool (the thread pool if threaded) and return its Job.
+    Paths in cleanup are removed once the job has finished (or was rejected).
+    With a cache_key, a cached result finishes the job at once and a request
+    identical to one already running shares that run instead of starting another.
+    """
+    job = Job(kind=kind, download_name=download_name, message=message, cleanup=cleanup,
+              cache_key=cache_key, input_base=input_base, saved_base=saved_base)
+    if cache_key and _cache is not None and _from_cache(job):
+        with _lock:
+            _jobs[job.id] = job
+        return job
+    executor = get_thread_executor() if threaded else get_executor()
+    _prune_store()
+    with _lock:
+        expired = _prune()
+        # A leader stays in _inflight until its _on_done takes its followers, so it can't miss this one
+        leader = _inflight.get(cache_key) if cache_key else None
+        if leader is None:
+            pending = sum(1 for j in _jobs.values() if not j.done())
+            if pending >= MAX_PENDING:
+                _remove_paths(job.cleanup)
+                raise QueueFull(f"Converter queue is full ({pending} jobs pending), try again later")
+            _publish_status(job)
+            job.future = executor.submit(_tracked, job.id, func, *args, **kwargs)
+            if cache_key:
+                _inflight[cache_key] = job
+        else:
+            _publish_status(job)
+            job.future = leader.future
+            leader.followers.append(job)
+        _jobs[job.id] = job
+    _remove_paths(expired)
+    if leader is None:
+        job.future.add_done_callback(lambda f: _on_done(job, f))
+    elif _cache is not None:
+        _cache.note_shared()
+    return job
+
+
+def get(job_id):
+    """The job with this id; one submitted by another server process comes from the store."""
+    with _lock:
+        job = _jobs.get(job_id)
+    if job is not None or _store is None:
+        return job
+    try:
+        record = _store.get_job(job_id)
+    except sqlite3.Error as e:
+        logger.warning(f"Could not load job {job_id}: {e}")
+        return None
+    return Job.from_record(record) if record else None
+
+
+def wait(job, timeout=None):
+    """Block until job has finished; returns True if it did within timeout."""
+    if job.future is not None:
+        wait_futures([job.future], timeout=timeout)
+    # The done callback may still be running on the executor thread
+    deadline = None if timeout is None else time.time() + timeout
+    while not job.done():
+        if deadline is not None and time.time() >= deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def as_completed(job_list):
+    """Yield the given jobs in the order they finish."""
+    finished = queue.Queue()
+    for job in job_list:
+        if job.done() or job.future is None:
+            finished.put(job)
+        else:
+            job.future.add_done_callback(lambda f, job=job: finished.put(job))
+    for _ in job_list:
+        job = finished.get()
+        wait(job)
+        yield job
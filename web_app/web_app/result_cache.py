@@ -0,0 +1,172 @@
+"""
+Content-addressed cache for conversion outputs.
+
+Entries are keyed by the sha256 of the input content, the converter and its
+normalized parameters, and live on disk as <root>/<key[:2]>/<key>.<tag>/<file>.
+A converter's output is moved into the cache, which then owns it: results are
+served from the cache copy and leave the disk with it.
+
+The index and byte count live in the shared store (see store.py), so all
+server processes keep to one budget. The least recently used entries are
+evicted once it is exceeded.
+"""
+import os
+import json
+import time
+import uuid
+import shutil
+import sqlite3
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = int(os.environ.get('CONVERSION_CACHE_MAX_MB', 1024)) * 1024 * 1024
+
+# Stored file names starting with this marker only keep the part after the
+# input's base name, so a hit can be renamed after the requester's own file.
+_SUFFIX_MARK = '@'
+
+
+def make_key(converter, input_digests, *params):
+    """Cache key for converter applied to inputs with the given sha256 digests and parameters."""
+    name = converter if isinstance(converter, str) else f"{converter.__module__}.{converter.__qualname__}"
+    normalized = [p.strip().lower() if isinstance(p, str) else p for p in params]
+    payload = json.dumps([name, list(input_digests), normalized], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def rename_for(output_name, producer_base, input_base):
+    """Swap the base name an output was produced from for another input's base name."""
+    if producer_base and input_base and output_name.startswith(producer_base):
+        return input_base + output_name[len(producer_base):]
+    return output_name
+
+
+class ResultCache:
+    def __init__(self, root, store, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root
+        self.store = store
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.evictions = 0
+        self.hit_seconds = 0.0
+        os.makedirs(root, exist_ok=True)
+        self._load()
+
+    def _entry_dir(self, key):
+        # Tagged, so two processes storing the same key never write into one directory
+        return os.path.join(self.root, key[:2], f"{key}.{uuid.uuid4().hex[:8]}")
+
+    def _load(self):
+        """Forget index entries whose files are gone and adopt entry directories missing from the index."""
+        for key, path in self.store.cache_entries():
+            if not os.path.exists(path):
+                self.store.forget_cache_entry(key, path)
+        for prefix in os.listdir(self.root):
+            prefix_dir = os.path.join(self.root, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for dir_name in os.listdir(prefix_dir):
+                entry_dir = os.path.join(prefix_dir, dir_name)
+                names = os.listdir(entry_dir) if os.path.isdir(entry_dir) else []
+                if len(names) != 1:
+                    shutil.rmtree(entry_dir, ignore_errors=True)
+                    continue
+                key = dir_name.split('.')[0]
+                path = os.path.join(entry_dir, names[0])
+                indexed = self.store.cache_entry(key, touch=False)
+                if indexed is None and self.store.add_cache_entry(key, path, os.path.getsize(path)):
+                    continue
+                if indexed is None or indexed[0] != path:
+                    shutil.rmtree(entry_dir, ignore_errors=True)
+        entries, size = self.store.cache_usage()
+        if entries:
+            logger.info(f"Conversion cache: {entries} entries, {size / (1024 * 1024):.1f} MB")
+
+    def get(self, key, input_base=None):
+        """Return (path, download_name) for a cached result, or None."""
+        start = time.perf_counter()
+        try:
+            entry = self.store.cache_entry(key)
+            if entry is not None and not os.path.exists(entry[0]):
+                self.store.forget_cache_entry(key, entry[0])
+                entry = None
+        except sqlite3.Error as e:
+            logger.warning(f"Conversion cache lookup failed: {e}")
+            entry = None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        path = entry[0]
+        stored = os.path.basename(path)
+        if stored.startswith(_SUFFIX_MARK):
+            name = (input_base or 'output') + stored[len(_SUFFIX_MARK):]
+        else:
+            name = stored
+        self.hit_seconds += time.perf_counter() - start
+        return path, name
+
+    def put(self, key, src_path, input_base=None):
+        """Move src_path into the cache under key and return its new path; the cache owns it from now on."""
+        name = os.path.basename(src_path)
+        if input_base and name.startswith(input_base):
+            name = _SUFFIX_MARK + name[len(input_base):]
+        entry_dir = self._entry_dir(key)
+        os.makedirs(entry_dir)
+        path = os.path.join(entry_dir, name)
+        try:
+            shutil.move(src_path, path)
+            if not self.store.add_cache_entry(key, path, os.path.getsize(path)):
+                # Another process cached the same result meanwhile
+                existing = self.store.cache_entry(key)
+                if existing is not None and existing[0] != path:
+                    shutil.rmtree(entry_dir, ignore_errors=True)
+                    return existing[0]
+        except (OSError, sqlite3.Error):
+            # Hand the file back, so the caller still has its output
+            if os.path.exists(path) and not os.path.exists(src_path):
+                os.replace(path, src_path)
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            raise
+        self._evict()
+        return path
+
+    def _evict(self):
+        """Remove least recently used entries until all processes' entries fit the budget."""
+        try:
+            evicted = self.store.evict_cache(self.max_bytes)
+        except sqlite3.Error as e:
+            logger.warning(f"Conversion cache eviction failed: {e}")
+            return
+        for path in evicted:
+            shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+        if evicted:
+            with self._lock:
+                self.evictions += len(evicted)
+
+    def note_shared(self):
+        with self._lock:
+            self.shared += 1
+
+    def stats(self):
+        entries, size = self.store.cache_usage()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': entries,
+                'bytes': size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 3) if lookups else None,
+                'shared_in_flight': self.shared,
+                'evictions': self.evictions,
+                'avg_hit_ms': round(self.hit_seconds / self.hits * 1000, 3) if self.hits else None,
+            }
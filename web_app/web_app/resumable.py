@@ -0,0 +1,240 @@
+"""
+Resumable uploads (a small subset of the tus protocol).
+
+Each session is a JSON file plus a .part file in the sessions directory, so an
+interrupted upload can continue from the committed offset even after a server
+restart. The committed offset is simply the size of the .part file.
+
+Chunks of one session may reach different server processes (see wsgi.py), so the
+offset check and the append run under a lock file of the session, not only a
+lock of this process.
+"""
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+import contextlib
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from upload_stream import stream_to_file
+
+logger = logging.getLogger(__name__)
+
+SESSION_TTL = int(os.environ.get('RESUMABLE_SESSION_TTL', 24 * 3600))  # seconds without activity
+
+
+class OffsetMismatch(ValueError):
+    """Raised when a chunk does not start at the committed offset."""
+
+    def __init__(self, expected, got):
+        super().__init__(f"Upload-Offset {got} does not match committed offset {expected}")
+        self.expected = expected
+
+
+class SessionGone(LookupError):
+    """Raised when a session was finalized or aborted while waiting for its lock."""
+
+
+_session_locks = {}
+_locks_guard = threading.Lock()
+
+
+def _thread_lock(upload_id):
+    with _locks_guard:
+        return _session_locks.setdefault(upload_id, threading.Lock())
+
+
+def _lock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    else:
+        f.seek(0)
+        # LK_LOCK retries for about 10 seconds, then raises OSError
+        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+
+def _unlock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextlib.contextmanager
+def _session_lock(session):
+    """Hold the session against other threads and other server processes."""
+    with _thread_lock(session.id):
+        with open(session.lock_path, 'a+b') as f:
+            _lock_file(f)
+            try:
+                # Whoever held the lock before may have finalized or aborted the session
+                if not os.path.exists(session.meta_path):
+                    raise SessionGone(f"Upload {session.id} is no longer open")
+                yield
+            finally:
+                _unlock_file(f)
+
+
+class UploadSession:
+    def __init__(self, sessions_dir, upload_id, filename, length, dest_folder, source, created=None):
+        self.sessions_dir = sessions_dir
+        self.id = upload_id
+        self.filename = filename
+        self.length = length
+        self.dest_folder = dest_folder
+        self.source = source
+        self.created = created or time.time()
+
+    @property
+    def meta_path(self):
+        return os.path.join(self.sessions_dir, f"{self.id}.json")
+
+    @property
+    def part_path(self):
+        return os.path.join(self.sessions_dir, f"{self.id}.part")
+
+    @property
+    def lock_path(self):
+        return os.path.join(self.sessions_dir, f"{self.id}.lock")
+
+    @property
+    def offset(self):
+        try:
+            return os.path.getsize(self.part_path)
+        except OSError:
+            return 0
+
+    def to_dict(self):
+        return {
+            'upload_id': self.id,
+            'filename': self.filename,
+            'length': self.length,
+            'offset': self.offset,
+            'source': self.source,
+            'created': self.created,
+        }
+
+    def _save(self):
+        tmp_path = f"{self.meta_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'filename': self.filename,
+                'length': self.length,
+                'dest_folder': self.dest_folder,
+                'source': self.source,
+                'created': self.created,
+            }, f)
+        os.replace(tmp_path, self.meta_path)
+
+
+def create(sessions_dir, filename, length, dest_folder, source):
+    os.makedirs(sessions_dir, exist_ok=True)
+    cleanup_stale(sessions_dir)
+    session = UploadSession(sessions_dir, uuid.uuid4().hex, filename, length, dest_folder, source)
+    open(session.part_path, 'wb').close()
+    session._save()
+    logger.info(f"Resumable upload {session.id} created for {filename} ({length} bytes)")
+    return session
+
+
+def load(sessions_dir, upload_id):
+    if not upload_id.isalnum():
+        return None
+    meta_path = os.path.join(sessions_dir, f"{upload_id}.json")
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return UploadSession(sessions_dir, upload_id, meta['filename'], meta['length'],
+                         meta['dest_folder'], meta['source'], meta['created'])
+
+
+def append(session, stream, offset):
+    """
+    Append the request body at offset. Whatever arrived before a disconnect
+    stays committed, so the client can resume from the new offset.
+    Returns the committed offset afterwards.
+    """
+    with _session_lock(session):
+        current = session.offset
+        if offset != current:
+            raise OffsetMismatch(current, offset)
+        try:
+            stream_to_file(stream, session.part_path, append=True, limit=session.length - current)
+        finally:
+            os.utime(session.meta_path)
+        return session.offset
+
+
+def finalize(session):
+    """Atomically move the completed upload into its destination folder."""
+    with _session_lock(session):
+        if session.offset != session.length:
+            raise OffsetMismatch(session.length, session.offset)
+        os.makedirs(session.dest_folder, exist_ok=True)
+        final_path = os.path.join(session.dest_folder, session.filename)
+        os.replace(session.part_path, final_path)
+        os.remove(session.meta_path)
+    _forget_lock(session)
+    logger.info(f"Resumable upload {session.id} finalized to {final_path}")
+    return final_path
+
+
+def _forget_lock(session):
+    with _locks_guard:
+        _session_locks.pop(session.id, None)
+    try:
+        os.remove(session.lock_path)
+    except OSError:
+        pass  # still held open by a waiter (Windows) or already gone; cleanup_stale removes it
+
+
+def abort(session):
+    with _session_lock(session):
+        for path in (session.part_path, session.meta_path):
+            if os.path.exists(path):
+                os.remove(path)
+    _forget_lock(session)
+
+
+def cleanup_stale(sessions_dir, ttl=SESSION_TTL):
+    """Remove sessions that have seen no chunk for ttl seconds. Returns how many were removed."""
+    if not os.path.isdir(sessions_dir):
+        return 0
+    cutoff = time.time() - ttl
+    removed = 0
+    names = os.listdir(sessions_dir)
+    for name in names:
+        # Lock files of sessions that are gone
+        if name.endswith('.lock') and f"{name[:-len('.lock')]}.json" not in names:
+            try:
+                os.remove(os.path.join(sessions_dir, name))
+            except OSError:
+                pass
+            continue
+        if not name.endswith('.json'):
+            continue
+        meta_path = os.path.join(sessions_dir, name)
+        try:
+            if os.path.getmtime(meta_path) >= cutoff:
+                continue
+            upload_id = name[:-len('.json')]
+            for path in (meta_path, os.path.join(sessions_dir, f"{upload_id}.part"),
+                         os.path.join(sessions_dir, f"{upload_id}.lock")):
+                if os.path.exists(path):
+                    os.remove(path)
+            removed += 1
+        except OSError as e:
+            logger.warning(f"Could not clean up resumable session {name}: {e}")
+    if removed:
+        logger.info(f"Removed {removed} stale resumable upload sessions")
+    return removed
@@ -0,0 +1,242 @@
+"""
+State shared by all server processes, kept in one SQLite file.
+
+Under a pre-fork WSGI server (see wsgi.py) every worker has its own memory,
+so the latest processing result and the status of conversion jobs live here:
+any worker can answer /result or /convert/jobs/<id> for work another worker
+did. WAL mode lets readers go on while a writer commits.
+
+Results form a ring buffer per client (the newest RESULTS_PER_CLIENT are kept)
+with ids that only grow, so a client can ask for everything after the last id
+it has seen and wait until something arrives. Waiters in this process are woken
+by add_result(); results written by other processes are seen within POLL_INTERVAL.
+
+The uploads table is the content-hash index of stored uploads (see upload_index.py),
+the cache table the index of the conversion cache (see result_cache.py), so that
+all processes share one byte budget. Claims let one process do a chore (such as
+the startup scan of the upload folder) for all of them.
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+
+RESULT_HISTORY = int(os.environ.get('RESULT_HISTORY', 1000))  # processing results kept in all
+RESULTS_PER_CLIENT = int(os.environ.get('RESULTS_PER_CLIENT', 50))
+POLL_INTERVAL = 0.25  # seconds between looks for results from other processes while waiting
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    filename TEXT NOT NULL,
+    text TEXT NOT NULL,
+    created REAL NOT NULL,
+    client TEXT NOT NULL DEFAULT '',
+    upload_id TEXT
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    info TEXT NOT NULL,
+    finished REAL
+);
+CREATE TABLE IF NOT EXISTS uploads (
+    path TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cache (
+    key TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    used REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS claims (
+    name TEXT PRIMARY KEY,
+    pid INTEGER NOT NULL,
+    expires REAL NOT NULL
+);
+"""
+INDEXES = """
+CREATE INDEX IF NOT EXISTS results_client ON results (client, id);
+CREATE INDEX IF NOT EXISTS results_upload ON results (upload_id);
+CREATE INDEX IF NOT EXISTS uploads_hash ON uploads (sha256, size);
+CREATE INDEX IF NOT EXISTS cache_used ON cache (used);
+"""
+RESULT_COLUMNS = 'id, filename, text, created, client, upload_id'
+
+
+def _result(row):
+    return dict(zip(('id', 'filename', 'text', 'created', 'client', 'upload_id'), row))
+
+
+class Store:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._changed = threading.Condition()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._db() as db:
+            db.executescript(SCHEMA)
+            # Stores written before results were kept per client
+            columns = {row[1] for row in db.execute('PRAGMA table_info(results)')}
+            if 'client' not in columns:
+                db.execute("ALTER TABLE results ADD COLUMN client TEXT NOT NULL DEFAULT ''")
+            if 'upload_id' not in columns:
+                db.execute('ALTER TABLE results ADD COLUMN upload_id TEXT')
+            db.executescript(INDEXES)
+
+    def _db(self):
+        """This thread's connection; a forked worker opens its own instead of sharing the parent's."""
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def add_result(self, filename, text, client='', upload_id=None):
+        """Record a processing result and wake the requests waiting for one; returns it with its id."""
+        created = time.time()
+        with self._db() as db:
+            cursor = db.execute('INSERT INTO results (filename, text, created, client, upload_id) VALUES (?, ?, ?, ?, ?)',
+                                (filename, text, created, client, upload_id))
+            result_id = cursor.lastrowid
+            db.execute('DELETE FROM results WHERE client = ? AND id <= '
+                       '(SELECT id FROM results WHERE client = ? ORDER BY id DESC LIMIT 1 OFFSET ?)',
+                       (client, client, RESULTS_PER_CLIENT))
+            db.execute('DELETE FROM results WHERE id <= ?', (result_id - RESULT_HISTORY,))
+        with self._changed:
+            self._changed.notify_all()
+        return _result((result_id, filename, text, created, client, upload_id))
+
+    def results(self, client=None, upload_id=None, since=0, limit=RESULTS_PER_CLIENT):
+        """Results newer than id since, oldest first; at most the newest limit of them."""
+        query = f'SELECT {RESULT_COLUMNS} FROM results WHERE id > ?'
+        params = [since]
+        if client:
+            query += ' AND client = ?'
+            params.append(client)
+        if upload_id:
+            query += ' AND upload_id = ?'
+            params.append(upload_id)
+        rows = self._db().execute(query + ' ORDER BY id DESC LIMIT ?', params + [limit]).fetchall()
+        return [_result(row) for row in reversed(rows)]
+
+    def wait_results(self, client=None, upload_id=None, since=0, timeout=0):
+        """results(), but if there are none yet wait up to timeout seconds for one."""
+        deadline = time.monotonic() + timeout
+        while True:
+            found = self.results(client, upload_id, since)
+            remaining = deadline - time.monotonic()
+            if found or remaining <= 0:
+                return found
+            with self._changed:
+                self._changed.wait(min(POLL_INTERVAL, remaining))
+
+    def last_result_id(self, client=None):
+        if client:
+            row = self._db().execute('SELECT MAX(id) FROM results WHERE client = ?', (client,)).fetchone()
+        else:
+            row = self._db().execute('SELECT MAX(id) FROM results').fetchone()
+        return row[0] or 0
+
+    def latest_result(self):
+        found = self.results(limit=1)
+        return found[0] if found else {'text': '', 'filename': ''}
+
+    def save_job(self, job_id, info, finished=None):
+        with self._db() as db:
+            db.execute('INSERT OR REPLACE INTO jobs (id, info, finished) VALUES (?, ?, ?)',
+                       (job_id, json.dumps(info), finished))
+
+    def get_job(self, job_id):
+        row = self._db().execute('SELECT info FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def prune_jobs(self, cutoff):
+        """Forget jobs that finished before cutoff."""
+        with self._db() as db:
+            db.execute('DELETE FROM jobs WHERE finished IS NOT NULL AND finished < ?', (cutoff,))
+
+    def index_upload(self, path, sha256, size, mtime):
+        with self._db() as db:
+            db.execute('INSERT OR REPLACE INTO uploads (path, sha256, size, mtime) VALUES (?, ?, ?, ?)',
+                       (path, sha256, size, mtime))
+
+    def indexed_upload(self, path):
+        row = self._db().execute('SELECT path, sha256, size, mtime FROM uploads WHERE path = ?', (path,)).fetchone()
+        return dict(zip(('path', 'sha256', 'size', 'mtime'), row)) if row else None
+
+    def uploads_with_hash(self, sha256, size):
+        rows = self._db().execute('SELECT path, sha256, size, mtime FROM uploads WHERE sha256 = ? AND size = ?',
+                                  (sha256, size)).fetchall()
+        return [dict(zip(('path', 'sha256', 'size', 'mtime'), row)) for row in rows]
+
+    def forget_upload(self, path):
+        with self._db() as db:
+            db.execute('DELETE FROM uploads WHERE path = ?', (path,))
+
+    def add_cache_entry(self, key, path, size):
+        """Index a cached result; False if key already has one."""
+        with self._db() as db:
+            cursor = db.execute('INSERT OR IGNORE INTO cache (key, path, size, used) VALUES (?, ?, ?, ?)',
+                                (key, path, size, time.time()))
+            return cursor.rowcount == 1
+
+    def cache_entry(self, key, touch=True):
+        """(path, size) of the cached result for key, or None; touch marks it as just used."""
+        row = self._db().execute('SELECT path, size FROM cache WHERE key = ?', (key,)).fetchone()
+        if row and touch:
+            with self._db() as db:
+                db.execute('UPDATE cache SET used = ? WHERE key = ?', (time.time(), key))
+        return row
+
+    def cache_entries(self):
+        return self._db().execute('SELECT key, path FROM cache').fetchall()
+
+    def forget_cache_entry(self, key, path):
+        with self._db() as db:
+            db.execute('DELETE FROM cache WHERE key = ? AND path = ?', (key, path))
+
+    def cache_usage(self):
+        """(entries, bytes) in the cache."""
+        return self._db().execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache').fetchone()
+
+    def evict_cache(self, max_bytes):
+        """
+        Forget the least recently used cache entries until the rest fit in max_bytes
+        (the newest one always stays). Returns the paths of the forgotten entries.
+        """
+        evicted = []
+        db = self._db()
+        with db:
+            # Take the write lock first, so two processes don't both evict for the same excess
+            db.execute('BEGIN IMMEDIATE')
+            count, total = db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache').fetchone()
+            if total <= max_bytes:
+                return evicted
+            for key, path, size in db.execute('SELECT key, path, size FROM cache ORDER BY used').fetchall():
+                if total <= max_bytes or count <= 1:
+                    break
+                db.execute('DELETE FROM cache WHERE key = ?', (key,))
+                evicted.append(path)
+                total -= size
+                count -= 1
+        return evicted
+
+    def claim(self, name, ttl):
+        """True for the one process that gets to do name now; the others get False for ttl seconds."""
+        now = time.time()
+        db = self._db()
+        with db:
+            db.execute('BEGIN IMMEDIATE')
+            row = db.execute('SELECT expires FROM claims WHERE name = ?', (name,)).fetchone()
+            if row and row[0] > now:
+                return False
+            db.execute('INSERT OR REPLACE INTO claims (name, pid, expires) VALUES (?, ?, ?)',
+                       (name, os.getpid(), now + ttl))
+            return True
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Pipe-mode ffmpeg conversions. Needs ffmpeg on PATH.
+
+    python -m pytest -q test_ffmpeg_pipe.py
+"""
+import io
+import os
+import sys
+import time
+import wave
+import shutil
+import subprocess
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from converter import scheduler
+from converter.ffmpeg_pipe import stream_convert
+
+pytestmark = pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg not on PATH')
+
+
+@pytest.fixture
+def mp3(tmp_path):
+    path = tmp_path / 'tone.mp3'
+    subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-f', 'lavfi', '-i', 'sine=frequency=440:duration=20',
+                    '-ac', '2', str(path)], check=True)
+    return path.read_bytes()
+
+
+@pytest.fixture
+def one_core(monkeypatch):
+    shared = scheduler.Scheduler(cores=1, express=0)
+    monkeypatch.setattr(scheduler, '_scheduler', shared)
+    return shared
+
+
+def _wait_for(condition, timeout=20):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+def test_slow_consumer_does_not_hold_the_slot(mp3, one_core):
+    output = stream_convert('mp3_to_wav', io.BytesIO(mp3))
+    chunks = [next(output)]
+    # The client stalls after the first chunk; several MB of WAV are still to come
+    assert _wait_for(lambda: one_core.stats()['cores_in_use'] == 0), 'slot held while the client stalls'
+    with scheduler.slots('ffmpeg') as cores:
+        assert cores == 1
+    chunks.extend(output)
+    with wave.open(io.BytesIO(b''.join(chunks)), 'rb') as w:
+        assert w.getnchannels() == 2
+        assert w.getnframes() >= 19 * w.getframerate()
+
+
+def test_closing_early_kills_ffmpeg(mp3, one_core):
+    output = stream_convert('mp3_to_wav', io.BytesIO(mp3))
+    next(output)
+    output.close()
+    assert _wait_for(lambda: one_core.stats()['cores_in_use'] == 0)
+
+
+def test_bad_input_raises(one_core):
+    with pytest.raises(RuntimeError, match='ffmpeg mp3_to_wav failed'):
+        list(stream_convert('mp3_to_wav', io.BytesIO(b'not audio' * 100)))
+    assert one_core.stats()['cores_in_use'] == 0
+
+
+if __name__ == '__main__':
+    sys.exit(pytest.main([__file__, '-q']))
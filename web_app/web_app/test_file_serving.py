@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Byte ranges and validators of file_serving.serve_file.
+
+    python -m pytest -q test_file_serving.py
+"""
+import os
+import sys
+
+import pytest
+from flask import Flask
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from file_serving import serve_file, parse_ranges
+
+CONTENT = bytes(range(256)) * 4  # 1024 bytes
+
+
+@pytest.fixture
+def client(tmp_path):
+    (tmp_path / 'data.bin').write_bytes(CONTENT)
+    app = Flask(__name__)
+    app.add_url_rule('/files/<name>', 'files', lambda name: serve_file(str(tmp_path), name))
+    return app.test_client()
+
+
+def _parts(resp):
+    """(Content-Range, body) of each part of a multipart/byteranges response."""
+    boundary = resp.headers['Content-Type'].split('boundary=')[1].encode()
+    parts = []
+    for chunk in resp.data.split(b'--' + boundary)[1:-1]:
+        head, _, body = chunk.partition(b'\r\n\r\n')
+        content_range = [line for line in head.split(b'\r\n') if line.startswith(b'Content-Range')][0]
+        parts.append((content_range.decode().split(': ')[1], body[:-2]))
+    return parts
+
+
+def test_parse_ranges():
+    assert parse_ranges('bytes=0-9,5-20') == [(0, 10), (5, 21)]
+    assert parse_ranges('bytes=100-,-50') == [(100, None), (-50, None)]
+    assert parse_ranges('bytes=9-0') is None
+    assert parse_ranges('items=0-9') is None
+    assert parse_ranges('bytes=a-b') is None
+    assert parse_ranges(None) is None
+
+
+def test_single_range(client):
+    resp = client.get('/files/data.bin', headers={'Range': 'bytes=10-19'})
+    assert resp.status_code == 206
+    assert resp.headers['Content-Range'] == 'bytes 10-19/1024'
+    assert resp.data == CONTENT[10:20]
+
+
+def test_overlapping_ranges_are_merged(client):
+    resp = client.get('/files/data.bin', headers={'Range': 'bytes=0-9,5-20'})
+    assert resp.status_code == 206
+    assert resp.headers['Content-Range'] == 'bytes 0-20/1024'
+    assert resp.data == CONTENT[:21]
+
+
+def test_unsorted_ranges_are_sorted_and_merged(client):
+    resp = client.get('/files/data.bin', headers={'Range': 'bytes=500-599,0-9,-24,8-15'})
+    assert resp.status_code == 206
+    assert resp.headers['Content-Type'].startswith('multipart/byteranges')
+    assert int(resp.headers['Content-Length']) == len(resp.data)
+    assert _parts(resp) == [('bytes 0-15/1024', CONTENT[:16]),
+                            ('bytes 500-599/1024', CONTENT[500:600]),
+                            ('bytes 1000-1023/1024', CONTENT[1000:])]
+
+
+def test_unsatisfiable_and_invalid_ranges(client):
+    resp = client.get('/files/data.bin', headers={'Range': 'bytes=5000-6000'})
+    assert resp.status_code == 416
+    assert resp.headers['Content-Range'] == 'bytes */1024'
+    # A malformed header is ignored: the whole file
+    resp = client.get('/files/data.bin', headers={'Range': 'bytes=20-10'})
+    assert resp.status_code == 200 and resp.data == CONTENT
+
+
+def test_etag_and_if_range(client):
+    etag = client.get('/files/data.bin').headers['ETag']
+    assert client.get('/files/data.bin', headers={'If-None-Match': etag}).status_code == 304
+    resp = client.get('/files/data.bin', headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+    assert resp.status_code == 200 and resp.data == CONTENT
+    resp = client.get('/files/data.bin', headers={'Range': 'bytes=0-9', 'If-Range': etag})
+    assert resp.status_code == 206 and resp.data == CONTENT[:10]
+
+
+if __name__ == '__main__':
+    sys.exit(pytest.main([__file__, '-q']))
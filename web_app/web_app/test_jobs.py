@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Job results: naming, the result cache and removal of converter outputs.
+
+    python -m pytest -q test_jobs.py
+"""
+import os
+import sys
+import time
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import jobs
+from store import Store
+from result_cache import ResultCache
+
+OUTPUTS = None
+gate = threading.Event()
+
+
+def fake_convert(input_path):
+    """Stand-in converter: writes <stem>_converted.txt into the outputs folder like the real ones do."""
+    gate.wait(10)
+    base = os.path.splitext(os.path.basename(input_path))[0]
+    output_path = os.path.join(OUTPUTS, f"{base}_converted.txt")
+    with open(input_path, 'rb') as src, open(output_path, 'wb') as dst:
+        dst.write(src.read().upper())
+    return output_path
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    global OUTPUTS
+    OUTPUTS = str(tmp_path / 'outputs')
+    os.makedirs(OUTPUTS)
+    monkeypatch.setattr(jobs, '_jobs', {})
+    monkeypatch.setattr(jobs, '_inflight', {})
+    monkeypatch.setattr(jobs, '_store', None)
+    monkeypatch.setattr(jobs, '_cache', None)
+    gate.set()
+    return tmp_path
+
+
+def _upload(tmp_path, name, content=b'hello'):
+    job_dir = tmp_path / f"job_{name}"
+    job_dir.mkdir()
+    path = job_dir / f"{name}_1234abcd.txt"
+    path.write_bytes(content)
+    return str(path), str(job_dir)
+
+
+def _submit(input_path, job_dir, stem, cache_key=None):
+    return jobs.submit(fake_convert, input_path, cleanup=[job_dir], threaded=True, cache_key=cache_key,
+                       input_base=stem, saved_base=os.path.splitext(os.path.basename(input_path))[0])
+
+
+def test_result_is_complete_when_wait_returns(workspace):
+    input_path, job_dir = _upload(workspace, 'notes')
+    job = _submit(input_path, job_dir, 'notes')
+    assert jobs.wait(job, timeout=10)
+    assert job.status == 'done'
+    assert job.download_name == 'notes_converted.txt'
+    assert not os.path.exists(job_dir)
+    with open(job.result, 'rb') as f:
+        assert f.read() == b'HELLO'
+
+
+def test_released_output_is_removed(workspace):
+    input_path, job_dir = _upload(workspace, 'notes')
+    job = _submit(input_path, job_dir, 'notes')
+    jobs.wait(job, timeout=10)
+    assert job.output == job.result
+    jobs.release(job)
+    assert os.listdir(OUTPUTS) == []
+
+
+def test_expired_job_output_is_removed(workspace, monkeypatch):
+    input_path, job_dir = _upload(workspace, 'old')
+    old = _submit(input_path, job_dir, 'old')
+    jobs.wait(old, timeout=10)
+    old.finished = time.time() - jobs.JOB_TTL - 1
+    input_path, job_dir = _upload(workspace, 'new')
+    jobs.wait(_submit(input_path, job_dir, 'new'), timeout=10)
+    assert not os.path.exists(old.result)
+    assert os.listdir(OUTPUTS) == ['new_1234abcd_converted.txt']
+
+
+def test_cached_result_leaves_no_output_behind(workspace, monkeypatch):
+    cache = ResultCache(str(workspace / 'cache'), Store(str(workspace / 'state.sqlite3')))
+    monkeypatch.setattr(jobs, '_cache', cache)
+    gate.clear()
+    first = _submit(*_upload(workspace, 'first'), 'first', cache_key='k' * 64)
+    second = _submit(*_upload(workspace, 'second'), 'second', cache_key='k' * 64)
+    assert second.future is first.future
+    gate.set()
+    for job in (first, second):
+        assert jobs.wait(job, timeout=10)
+        assert job.status == 'done'
+        assert job.output is None
+    assert first.download_name == 'first_converted.txt'
+    assert second.download_name == 'second_converted.txt'
+    assert first.result == second.result and first.result.startswith(str(workspace / 'cache'))
+    assert os.listdir(OUTPUTS) == []
+    third = _submit(*_upload(workspace, 'third'), 'third', cache_key='k' * 64)
+    assert third.cached and third.download_name == 'third_converted.txt'
+
+
+if __name__ == '__main__':
+    sys.exit(pytest.main([__file__, '-q']))
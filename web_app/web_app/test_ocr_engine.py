@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+The tesserocr API pool, with a fake tesserocr that counts loaded APIs.
+
+    python -m pytest -q test_ocr_engine.py
+"""
+import os
+import sys
+import types
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from converter import ocr_converter
+from converter.ocr_converter import OcrEngine
+
+
+class FakeApi:
+    live = []
+
+    def __init__(self, lang, psm):
+        self.key = (lang, psm)
+        self.ended = False
+        FakeApi.live.append(self)
+
+    def SetImage(self, image):
+        self.image = image
+
+    def GetUTF8Text(self):
+        return f"{self.image} {self.key[0]}"
+
+    def End(self):
+        self.ended = True
+        FakeApi.live.remove(self)
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    FakeApi.live = []
+    monkeypatch.setattr(ocr_converter, 'tesserocr', types.SimpleNamespace(PyTessBaseAPI=FakeApi), raising=False)
+    monkeypatch.setattr(ocr_converter, 'HAVE_TESSEROCR', True)
+    return OcrEngine(max_apis=2)
+
+
+def test_apis_are_reused_and_ended_on_close(engine):
+    assert engine.recognize('page1', lang='eng') == 'page1 eng'
+    assert engine.recognize('page2', lang='eng') == 'page2 eng'
+    assert len(FakeApi.live) == 1
+    engine.close()
+    assert FakeApi.live == []
+
+
+def test_other_languages_evict_idle_apis(engine):
+    for lang in ('eng', 'kor', 'jpn', 'eng'):
+        assert engine.recognize('page', lang=lang) == f"page {lang}"
+        assert len(FakeApi.live) <= 2
+
+
+def test_callers_wait_for_a_free_api(engine):
+    first = engine._checkout('eng', 3)
+    second = engine._checkout('eng', 3)
+    done = threading.Event()
+    worker = threading.Thread(target=lambda: (engine.recognize('page', lang='kor'), done.set()))
+    worker.start()
+    assert not done.wait(0.2)
+    engine._checkin('eng', 3, first)
+    assert done.wait(5)
+    worker.join()
+    assert len(FakeApi.live) == 2 and first.ended
+    engine._checkin('eng', 3, second)
+
+
+if __name__ == '__main__':
+    sys.exit(pytest.main([__file__, '-q']))
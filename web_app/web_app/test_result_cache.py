@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Conversion cache: it owns what it stores, and all processes share one byte budget.
+
+Each ResultCache below gets its own Store on the same SQLite file, as two server
+processes would.
+
+    python -m pytest -q test_result_cache.py
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from store import Store
+from result_cache import ResultCache, make_key
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return str(tmp_path / 'cache'), str(tmp_path / 'state.sqlite3'), tmp_path
+
+
+def _output(tmp_path, name, size):
+    path = tmp_path / name
+    path.write_bytes(os.urandom(size))
+    return str(path)
+
+
+def _disk_usage(root):
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(root) for f in files)
+
+
+def test_put_moves_the_output_in(paths):
+    root, store_path, tmp_path = paths
+    cache = ResultCache(root, Store(store_path))
+    src = _output(tmp_path, 'photo_1a2b3c4d_converted.png', 1000)
+    path = cache.put(make_key('convert_image', ['abc'], 'png'), src, 'photo_1a2b3c4d')
+    assert not os.path.exists(src)
+    assert path.startswith(root) and os.path.getsize(path) == 1000
+    assert cache.get(make_key('convert_image', ['abc'], 'PNG '), 'holiday') == (path, 'holiday_converted.png')
+
+
+def test_budget_is_shared_between_processes(paths):
+    root, store_path, tmp_path = paths
+    first = ResultCache(root, Store(store_path), max_bytes=10000)
+    second = ResultCache(root, Store(store_path), max_bytes=10000)
+    for n in range(8):
+        cache = first if n % 2 else second
+        cache.put(f"{n:064d}", _output(tmp_path, f"out{n}.bin", 3000))
+    # Each process alone stored 12000 bytes; together they keep to one budget
+    assert first.stats()['bytes'] == second.stats()['bytes'] == 9000
+    assert _disk_usage(root) == 9000
+    assert first.get(f"{0:064d}") is None
+    assert second.get(f"{7:064d}") is not None
+    assert first.stats()['evictions'] + second.stats()['evictions'] == 5
+
+
+def test_same_key_from_two_processes_is_stored_once(paths):
+    root, store_path, tmp_path = paths
+    first = ResultCache(root, Store(store_path))
+    second = ResultCache(root, Store(store_path))
+    path = first.put('k' * 64, _output(tmp_path, 'a.bin', 100))
+    assert second.put('k' * 64, _output(tmp_path, 'b.bin', 100)) == path
+    assert _disk_usage(root) == 100 and first.stats()['entries'] == 1
+
+
+def test_restart_reconciles_index_and_disk(paths):
+    root, store_path, tmp_path = paths
+    cache = ResultCache(root, Store(store_path))
+    kept = cache.put('a' * 64, _output(tmp_path, 'a.bin', 100))
+    gone = cache.put('b' * 64, _output(tmp_path, 'b.bin', 100))
+    os.remove(gone)
+    # An entry left by a cache from before the shared index
+    orphan_dir = os.path.join(root, 'cc', 'c' * 64)
+    os.makedirs(orphan_dir)
+    with open(os.path.join(orphan_dir, 'c.bin'), 'wb') as f:
+        f.write(b'x' * 50)
+
+    restarted = ResultCache(root, Store(store_path))
+    assert restarted.stats()['entries'] == 2 and restarted.stats()['bytes'] == 150
+    assert restarted.get('a' * 64)[0] == kept
+    assert restarted.get('b' * 64) is None
+    assert restarted.get('c' * 64)[0] == os.path.join(orphan_dir, 'c.bin')
+
+
+if __name__ == '__main__':
+    sys.exit(pytest.main([__file__, '-q']))
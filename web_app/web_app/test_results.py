@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+/result answers each client with its own processing results.
+
+    python -m pytest -q test_results.py
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import app as app_module
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(app_module, 'UPLOAD_FOLDER', str(tmp_path / 'uploads'))
+    monkeypatch.setattr(app_module, 'MOBILE_UPLOADS_FOLDER', str(tmp_path / 'mobile_uploads'))
+    monkeypatch.setattr(app_module, 'RESUMABLE_FOLDER', str(tmp_path / 'uploads' / '.resumable'))
+    flask_app = app_module.create_app({'UPLOAD_FOLDER': str(tmp_path / 'uploads'),
+                                       'STORE_PATH': str(tmp_path / 'state.sqlite3')})
+    store = flask_app.extensions['store']
+    store.add_result('a.jpg', 'phone A result', client='10.0.0.1', upload_id='upload-a')
+    store.add_result('b.jpg', 'phone B result', client='10.0.0.2', upload_id='upload-b')
+    store.add_result('c.jpg', 'named client result', client='tablet')
+    return flask_app.test_client()
+
+
+def _get(client, url, addr='10.0.0.1', **headers):
+    return client.get(url, headers=headers, environ_base={'REMOTE_ADDR': addr})
+
+
+def test_result_defaults_to_the_asking_client(client):
+    assert _get(client, '/result').json['text'] == 'phone A result'
+    assert _get(client, '/result', addr='10.0.0.2').json['text'] == 'phone B result'
+    assert _get(client, '/result', addr='10.0.0.9').json['text'] == ''
+    assert _get(client, '/result', **{'Client-Id': 'tablet'}).json['text'] == 'named client result'
+
+
+def test_upload_id_and_long_poll_stay_with_the_client(client):
+    assert _get(client, '/result?upload_id=upload-b', addr='10.0.0.2').json['text'] == 'phone B result'
+    assert _get(client, '/result?upload_id=upload-b').json['text'] == ''
+    resp = _get(client, '/result?since=0&wait=0.2')
+    assert [r['text'] for r in resp.json['results']] == ['phone A result']
+
+
+def test_all_clients_on_request(client):
+    resp = _get(client, '/result?client=*&since=0')
+    assert [r['client'] for r in resp.json['results']] == ['10.0.0.1', '10.0.0.2', 'tablet']
+
+
+if __name__ == '__main__':
+    sys.exit(pytest.main([__file__, '-q']))
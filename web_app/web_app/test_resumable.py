@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Resumable upload protocol, driven with requests against the app on a local server.
+
+Covers create, PATCH, a PATCH at the wrong offset (409), HEAD, resuming after a
+connection drops mid-chunk, finalizing, cleanup of expired sessions and the
+session lock shared between server processes.
+
+    python -m pytest -q test_resumable.py
+"""
+import os
+import sys
+import time
+import socket
+import hashlib
+import threading
+import subprocess
+
+import pytest
+import requests
+from werkzeug.serving import make_server
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+import app as app_module
+import resumable
+
+PAYLOAD = os.urandom(3 * 1024 * 1024 + 123)
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    upload_folder = str(tmp_path / 'uploads')
+    sessions = str(tmp_path / 'uploads' / '.resumable')
+    monkeypatch.setattr(app_module, 'UPLOAD_FOLDER', upload_folder)
+    monkeypatch.setattr(app_module, 'MOBILE_UPLOADS_FOLDER', str(tmp_path / 'mobile_uploads'))
+    monkeypatch.setattr(app_module, 'RESUMABLE_FOLDER', sessions)
+    flask_app = app_module.create_app({'UPLOAD_FOLDER': upload_folder,
+                                       'STORE_PATH': str(tmp_path / 'state.sqlite3')})
+    httpd = make_server('127.0.0.1', 0, flask_app, threaded=True)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_port}", upload_folder, sessions
+    httpd.shutdown()
+
+
+def _create(base, name='video.mp4', length=len(PAYLOAD)):
+    resp = requests.post(f"{base}/resumable", headers={'Upload-Length': str(length), 'Upload-Filename': name})
+    assert resp.status_code == 201, resp.text
+    return base + resp.headers['Location']
+
+
+def _patch(url, offset, data):
+    return requests.patch(url, data=data, headers={'Upload-Offset': str(offset),
+                                                   'Content-Type': 'application/offset+octet-stream'})
+
+
+def _offset(url):
+    resp = requests.head(url)
+    assert resp.status_code == 200
+    return int(resp.headers['Upload-Offset'])
+
+
+def _send_partial(url, offset, data, declared):
+    """PATCH that announces declared bytes but sends only data, then drops the connection."""
+    host, port = url.split('/')[2].split(':')
+    path = '/' + url.split('/', 3)[3]
+    with socket.create_connection((host, int(port))) as sock:
+        sock.sendall(f"PATCH {path} HTTP/1.1\r\nHost: {host}\r\nUpload-Offset: {offset}\r\n"
+                     f"Content-Length: {declared}\r\n\r\n".encode() + data)
+        sock.shutdown(socket.SHUT_WR)
+        sock.recv(4096)
+
+
+def test_create_patch_and_offset_mismatch(server):
+    base, _, _ = server
+    url = _create(base)
+    assert _offset(url) == 0
+    resp = _patch(url, 0, PAYLOAD[:1024 * 1024])
+    assert resp.status_code == 204
+    assert resp.headers['Upload-Offset'] == str(1024 * 1024)
+    assert _offset(url) == 1024 * 1024
+
+    resp = _patch(url, 0, PAYLOAD[:10])
+    assert resp.status_code == 409
+    assert resp.json()['offset'] == 1024 * 1024
+    assert _offset(url) == 1024 * 1024
+
+
+def test_resume_after_interruption_and_finalize(server):
+    base, upload_folder, _ = server
+    url = _create(base)
+    first = 1024 * 1024
+    assert _patch(url, 0, PAYLOAD[:first]).status_code == 204
+
+    # The connection drops halfway through the second chunk: what arrived stays committed
+    _send_partial(url, first, PAYLOAD[first:first + 500 * 1024], declared=len(PAYLOAD) - first)
+    for _ in range(50):
+        offset = _offset(url)
+        if offset == first + 500 * 1024:
+            break
+        time.sleep(0.1)
+    assert offset == first + 500 * 1024
+
+    resp = _patch(url, offset, PAYLOAD[offset:])
+    assert resp.status_code == 200, resp.text
+    assert resp.json()['size'] == len(PAYLOAD)
+    with open(os.path.join(upload_folder, 'video.mp4'), 'rb') as f:
+        assert hashlib.sha256(f.read()).digest() == hashlib.sha256(PAYLOAD).digest()
+    # A finished session is gone
+    assert requests.head(url).status_code == 404
+
+
+def test_expired_sessions_are_cleaned_up(server):
+    base, _, sessions = server
+    stale = _create(base, 'stale.jpg', 100)
+    fresh = _create(base, 'fresh.jpg', 100)
+    stale_id = stale.rsplit('/', 1)[1]
+    old = time.time() - resumable.SESSION_TTL - 60
+    os.utime(os.path.join(sessions, f"{stale_id}.json"), (old, old))
+
+    assert resumable.cleanup_stale(sessions) == 1
+    assert not os.path.exists(os.path.join(sessions, f"{stale_id}.part"))
+    assert requests.head(stale).status_code == 404
+    assert _offset(fresh) == 0
+
+
+def test_session_lock_is_shared_between_processes(server):
+    base, _, sessions = server
+    url = _create(base, 'locked.txt', 100)
+    upload_id = url.rsplit('/', 1)[1]
+    # Another server process holds the session for a second
+    holder = subprocess.Popen(
+        [sys.executable, '-c',
+         'import sys, time, resumable\n'
+         f'session = resumable.load({sessions!r}, {upload_id!r})\n'
+         'with resumable._session_lock(session):\n'
+         '    print("locked", flush=True)\n'
+         '    time.sleep(1)\n'],
+        cwd=HERE, stdout=subprocess.PIPE, text=True)
+    try:
+        assert holder.stdout.readline().strip() == 'locked'
+        start = time.monotonic()
+        assert _patch(url, 0, b'x' * 100).status_code == 200
+        assert time.monotonic() - start >= 0.5, 'PATCH did not wait for the other process'
+    finally:
+        holder.wait(timeout=10)
+
+
+if __name__ == '__main__':
+    sys.exit(pytest.main([__file__, '-q']))
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+WAV synthesis through the pyttsx3 worker thread, with a fake engine that can hang.
+
+    python -m pytest -q test_tts_service.py
+"""
+import io
+import os
+import sys
+import types
+import wave
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from converter import tts_service
+from converter.tts_service import AudioCache, TTSService
+
+
+class FakeEngine:
+    hang = threading.Event()  # set: the next runAndWait() blocks until released
+    release = threading.Event()
+
+    def __init__(self):
+        self._job = None
+
+    def getProperty(self, name):
+        return 'default'
+
+    def setProperty(self, name, value):
+        pass
+
+    def save_to_file(self, text, path):
+        self._job = (text, path)
+
+    def runAndWait(self):
+        if FakeEngine.hang.is_set():
+            FakeEngine.hang.clear()
+            FakeEngine.release.wait(30)
+        text, path = self._job
+        with wave.open(path, 'wb') as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(8000)
+            w.writeframes(b'\0\0' * len(text))
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    engines = []
+
+    def init():
+        engines.append(FakeEngine())
+        return engines[-1]
+
+    monkeypatch.setitem(sys.modules, 'pyttsx3', types.SimpleNamespace(init=init))
+    monkeypatch.setattr(tts_service, 'SENTENCE_TIMEOUT', 1)
+    FakeEngine.hang.clear()
+    FakeEngine.release.clear()
+    yield TTSService(AudioCache(root=str(tmp_path / 'tts_cache'))), engines
+    FakeEngine.release.set()
+
+
+def _frames(data):
+    with wave.open(io.BytesIO(data), 'rb') as w:
+        return w.getnframes()
+
+
+def test_wav_sentences_come_from_one_engine(service):
+    tts, engines = service
+    audio = list(tts.iter_sentences('First sentence here. ' * 20, fmt='wav'))
+    assert audio and all(_frames(data) > 0 for data in audio)
+    assert len(engines) == 1
+
+
+def test_hung_engine_is_replaced(service):
+    tts, engines = service
+    FakeEngine.hang.set()
+    with pytest.raises(RuntimeError, match='no audio within'):
+        list(tts.iter_sentences('This one hangs.', fmt='wav'))
+    hung = tts._pyttsx3
+    assert hung.error is not None
+
+    # The next request gets a new engine instead of waiting on the stuck one
+    audio = list(tts.iter_sentences('This one works.', fmt='wav'))
+    assert _frames(audio[0]) > 0
+    assert len(engines) == 2 and tts._pyttsx3 is not hung
+
+    # Once the old engine returns, its thread exits instead of taking more work
+    FakeEngine.release.set()
+    hung.join(timeout=5)
+    assert not hung.is_alive()
+
+
+def test_queued_sentences_fail_with_the_abandoned_worker(service):
+    tts, _ = service
+    FakeEngine.hang.set()
+    worker = tts._pyttsx3_worker()
+    stuck = worker.synthesize('Stuck.')
+    queued = worker.synthesize('Queued behind it.')
+    worker.abandon('test')
+    for future in (stuck, queued):
+        with pytest.raises(RuntimeError, match='test'):
+            future.result(timeout=1)
+    with pytest.raises(RuntimeError, match='test'):
+        worker.synthesize('After.').result(timeout=1)
+
+
+if __name__ == '__main__':
+    sys.exit(pytest.main([__file__, '-q']))
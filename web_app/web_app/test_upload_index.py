@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Content-hash index of the upload folder, shared by the server processes.
+
+Each UploadIndex below gets its own Store on the same SQLite file, as two server
+processes would.
+
+    python -m pytest -q test_upload_index.py
+"""
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import store
+import upload_index
+from store import Store
+from upload_index import UploadIndex, hash_file
+
+
+def test_only_one_process_scans_the_folder(tmp_path, monkeypatch):
+    folder = tmp_path / 'mobile_uploads'
+    folder.mkdir()
+    for n in range(3):
+        (folder / f"photo{n}.jpg").write_bytes(os.urandom(1000))
+    (folder / 'photo0.jpg.1234.part').write_bytes(b'partial')
+    store_path = str(tmp_path / 'state.sqlite3')
+    first = UploadIndex(str(folder), Store(store_path))
+    second = UploadIndex(str(folder), Store(store_path))
+
+    assert first.scan() == 3
+    assert second.scan() == 0
+    photo = str(folder / 'photo1.jpg')
+    assert second.find(hash_file(photo), 1000) == photo
+
+    # Once the interval has passed, a scan only hashes what is new
+    later = time.time() + upload_index.SCAN_INTERVAL + 1
+    monkeypatch.setattr(store.time, 'time', lambda: later)
+    (folder / 'photo3.jpg').write_bytes(os.urandom(1000))
+    assert second.scan() == 1
+
+
+if __name__ == '__main__':
+    sys.exit(pytest.main([__file__, '-q']))
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Atomic saves of request bodies.
+
+    python -m pytest -q test_upload_stream.py
+"""
+import io
+import os
+import sys
+import hashlib
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from upload_stream import save_stream_atomic
+
+
+@pytest.fixture
+def umask_022():
+    old = os.umask(0o022)
+    yield
+    os.umask(old)
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='POSIX file modes')
+def test_saved_file_gets_the_umask_mode(tmp_path, umask_022):
+    path = str(tmp_path / 'photo.jpg')
+    save_stream_atomic(io.BytesIO(b'x' * 100), path)
+    assert os.stat(path).st_mode & 0o777 == 0o644
+
+
+def test_complete_body_replaces_the_file(tmp_path):
+    path = tmp_path / 'notes.txt'
+    path.write_bytes(b'old')
+    body = b'new content'
+    written, digest, _ = save_stream_atomic(io.BytesIO(body), str(path), expected_length=len(body),
+                                            expected_sha256=hashlib.sha256(body).hexdigest())
+    assert written == len(body) and path.read_bytes() == body
+    assert digest == hashlib.sha256(body).hexdigest()
+    assert os.listdir(tmp_path) == ['notes.txt']
+
+
+@pytest.mark.parametrize('kwargs', [{'expected_length': 100}, {'expected_sha256': '0' * 64}])
+def test_bad_body_keeps_the_old_file(tmp_path, kwargs):
+    path = tmp_path / 'notes.txt'
+    path.write_bytes(b'old')
+    with pytest.raises(ValueError):
+        save_stream_atomic(io.BytesIO(b'short'), str(path), **kwargs)
+    assert path.read_bytes() == b'old'
+    assert os.listdir(tmp_path) == ['notes.txt']
+
+
+if __name__ == '__main__':
+    sys.exit(pytest.main([__file__, '-q']))
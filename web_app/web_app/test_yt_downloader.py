@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Playlist downloads through DownloadManager against a local stand-in media server.
+
+The server publishes an RSS feed of short m4a tracks (plus one entry that 404s)
+and counts the connections open at once. Needs ffmpeg on PATH to make the
+tracks and extract mp3 audio.
+
+    python -m pytest -q test_yt_downloader.py
+"""
+import os
+import sys
+import time
+import shutil
+import functools
+import threading
+import subprocess
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from converter import progress, scheduler
+from converter.yt_downloader import DownloadManager
+
+pytestmark = pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg not on PATH')
+
+TRACKS = 3
+KBPS = 256  # per connection, so downloads take long enough to overlap
+
+
+class MediaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, folder):
+        super().__init__(('127.0.0.1', 0), functools.partial(self.Handler, directory=folder))
+        self.active = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    class Handler(SimpleHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def copyfile(self, source, outputfile):
+            server = self.server
+            with server.lock:
+                server.active += 1
+                server.peak = max(server.peak, server.active)
+            try:
+                while True:
+                    data = source.read(16 * 1024)
+                    if not data:
+                        break
+                    outputfile.write(data)
+                    time.sleep(len(data) / (KBPS * 1024))
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                with server.lock:
+                    server.active -= 1
+
+
+@pytest.fixture
+def media_server(tmp_path):
+    media = tmp_path / 'media'
+    media.mkdir()
+    for n in range(1, TRACKS + 1):
+        subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-f', 'lavfi',
+                        '-i', f'sine=frequency={200 + 50 * n}:duration=3',
+                        '-c:a', 'aac', '-b:a', '128k', str(media / f'track{n}.m4a')], check=True)
+    server = MediaServer(str(media))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    names = [f'track{n}.m4a' for n in range(1, TRACKS + 1)] + ['missing.m4a']
+    items = ''.join(f'<item><title>{name}</title><guid>{name}</guid>'
+                    f'<enclosure url="{base}/{name}" type="audio/mp4"/></item>' for name in names)
+    (media / 'feed.xml').write_text(f'<?xml version="1.0"?><rss version="2.0"><channel><title>Test feed</title>'
+                                    f'<link>{base}/</link>{items}</channel></rss>')
+    yield server, f"{base}/feed.xml"
+    server.shutdown()
+
+
+def _collect_events(task_id):
+    events = []
+    thread = threading.Thread(target=lambda: events.extend(e for e in progress.get_hub().subscribe(task_id, heartbeat=1)
+                                                           if e is not None), daemon=True)
+    thread.start()
+    return events, thread
+
+
+def test_playlist_runs_items_concurrently_with_progress(media_server, tmp_path):
+    server, feed = media_server
+    manager = DownloadManager(out_dir=str(tmp_path / 'out'), concurrent_items=3, fragment_threads=1)
+    task = manager.start(feed, 'mp3', playlist=True)
+    events, listener = _collect_events(task.id)
+    assert task.wait(timeout=120)
+    listener.join(timeout=5)
+
+    assert server.peak >= 2, 'items were downloaded one at a time'
+    statuses = sorted(item.status for item in task.items)
+    assert statuses == ['done'] * TRACKS + ['failed']
+    for item in task.items:
+        if item.status == 'done':
+            assert item.filename.endswith('.mp3') and os.path.getsize(item.filename) > 0
+    failed = next(item for item in task.items if item.status == 'failed')
+    assert failed.error
+    # A playlist with a failed item doesn't report plain success
+    assert task.status == 'failed'
+    assert task.report()['downloaded'] == TRACKS and task.report()['failed'] == 1
+
+    item_events = [e['item'] for e in events if 'item' in e]
+    assert any(e['status'] == 'downloading' and e.get('downloaded_bytes', 0) > 0 for e in item_events)
+    assert any(e['status'] == 'converting' for e in item_events)
+    assert events[-1]['status'] == 'failed'
+
+
+def test_failed_audio_extraction_fails_the_item(media_server, tmp_path, monkeypatch):
+    _, feed = media_server
+
+    def no_ffmpeg(command, **kwargs):
+        raise FileNotFoundError(2, 'No such file or directory', command[0])
+
+    monkeypatch.setattr(scheduler, 'run', no_ffmpeg)
+    manager = DownloadManager(out_dir=str(tmp_path / 'out'), concurrent_items=3, fragment_threads=1)
+    task = manager.start(feed, 'mp3', playlist=True)
+    assert task.wait(timeout=120)
+
+    assert all(item.status == 'failed' for item in task.items), [i.status for i in task.items]
+    assert task.status == 'failed'
+    assert any('Audio extraction failed' in item.error for item in task.items)
+
+
+if __name__ == '__main__':
+    sys.exit(pytest.main([__file__, '-q']))
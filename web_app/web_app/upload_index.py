@@ -0,0 +1,178 @@
+"""
+Content-hash index of an upload folder, to store re-sent files only once.
+
+Phones send the same photos and videos again and again. Every file stored in
+the folder is indexed by sha256 and size, in the shared store so that all
+server processes see it:
+
+- a client can first ask whether the content is already here (POST /upload/check)
+  and skip sending it;
+- a duplicate body that arrives anyway has its new copy replaced by a hardlink
+  to the stored file, so it takes no extra space.
+
+Before an entry is used the file's size and mtime are checked, so files changed
+or removed behind the server's back are dropped from the index instead of being
+trusted. Where hardlinks aren't possible (FAT/exFAT drives) the copy is kept.
+"""
+import os
+import uuid
+import shutil
+import hashlib
+import logging
+import sqlite3
+import threading
+
+from upload_stream import CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+SHA256_LENGTH = 64
+TEMP_SUFFIXES = ('.part', '.link')
+SCAN_INTERVAL = int(os.environ.get('UPLOAD_SCAN_INTERVAL', 600))  # seconds before another process rescans
+
+
+def hash_file(path, chunk_size=CHUNK_SIZE):
+    """sha256 hex digest of a file, read in chunks so big videos never sit in memory."""
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _temp_path(path, suffix):
+    """A temp name next to path that no concurrent upload of the same name can share."""
+    return f"{path}.{uuid.uuid4().hex}{suffix}"
+
+
+def _link_over(original, path):
+    """Atomically make path a hardlink to original. False if the filesystem can't."""
+    link_path = _temp_path(path, '.link')
+    try:
+        os.link(original, link_path)
+        os.replace(link_path, path)
+        return True
+    except OSError as e:
+        logger.info(f"Could not hardlink {path} to {original}: {e}")
+        if os.path.exists(link_path):
+            os.remove(link_path)
+        return False
+
+
+class UploadIndex:
+    def __init__(self, folder, store):
+        self.folder = folder
+        self.store = store
+        self.duplicates = 0
+        self.bytes_saved = 0
+        self.preflight_hits = 0
+        self.preflight_misses = 0
+        self._lock = threading.Lock()
+
+    def _current(self, entry):
+        """True if the indexed file is still there, unchanged; stale entries are forgotten."""
+        try:
+            st = os.stat(entry['path'])
+            if st.st_size == entry['size'] and st.st_mtime == entry['mtime']:
+                return True
+        except OSError:
+            pass
+        self.store.forget_upload(entry['path'])
+        return False
+
+    def find(self, sha256, size):
+        """Path of a stored file with this content, or None."""
+        try:
+            entries = self.store.uploads_with_hash(sha256.lower(), size)
+            return next((e['path'] for e in entries if self._current(e)), None)
+        except sqlite3.Error as e:
+            logger.warning(f"Upload index lookup failed: {e}")
+            return None
+
+    def _index(self, path, sha256):
+        st = os.stat(path)
+        self.store.index_upload(path, sha256, st.st_size, st.st_mtime)
+
+    def add(self, path, sha256=None):
+        """
+        Index a file just stored in the folder, hashing it unless sha256 is known.
+        If the same content is already stored under another name, path becomes a
+        hardlink to that file. Returns the file it now shares, or None.
+        """
+        sha256 = sha256 or hash_file(path)
+        size = os.path.getsize(path)
+        original = self.find(sha256, size)
+        if original and os.path.samefile(original, path):
+            original = None
+        if original and not _link_over(original, path):
+            original = None
+        if original:
+            with self._lock:
+                self.duplicates += 1
+                self.bytes_saved += size
+            logger.info(f"Duplicate upload {os.path.basename(path)} linked to {os.path.basename(original)}")
+        try:
+            self._index(path, sha256)
+        except sqlite3.Error as e:
+            logger.warning(f"Could not index upload {path}: {e}")
+        return original
+
+    def claim(self, sha256, size, path=None):
+        """
+        Pre-flight check: is content with this hash and size already stored? If so, and
+        path is given, path is made to hold it too (a hardlink, else a copy) as if it had
+        been uploaded. Returns the path holding the content, or None.
+        """
+        original = self.find(sha256, size)
+        with self._lock:
+            if original is None:
+                self.preflight_misses += 1
+            else:
+                self.preflight_hits += 1
+                self.bytes_saved += size
+        if original is None or path is None:
+            return original
+        if not (os.path.exists(path) and os.path.samefile(original, path)) and not _link_over(original, path):
+            part_path = _temp_path(path, '.part')
+            try:
+                shutil.copyfile(original, part_path)
+                os.replace(part_path, path)
+            finally:
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+        self._index(path, sha256.lower())
+        return path
+
+    def scan(self):
+        """
+        Hash the files of the folder that aren't indexed yet or changed since. Returns how many.
+        Every server process calls this at startup, but only one per SCAN_INTERVAL does the work.
+        """
+        hashed = 0
+        try:
+            if not self.store.claim(f"scan:{self.folder}", SCAN_INTERVAL):
+                return 0
+            names = os.listdir(self.folder)
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"Could not scan {self.folder}: {e}")
+            return 0
+        for name in names:
+            path = os.path.join(self.folder, name)
+            if name.endswith(TEMP_SUFFIXES) or not os.path.isfile(path):
+                continue
+            try:
+                entry = self.store.indexed_upload(path)
+                st = os.stat(path)
+                if entry and entry['size'] == st.st_size and entry['mtime'] == st.st_mtime:
+                    continue
+                self._index(path, hash_file(path))
+                hashed += 1
+            except (OSError, sqlite3.Error) as e:
+                logger.warning(f"Could not index {path}: {e}")
+        if hashed:
+            logger.info(f"Indexed {hashed} files in {self.folder}")
+        return hashed
+
+    def stats(self):
+        return {'duplicates_linked': self.duplicates, 'bytes_saved': self.bytes_saved,
+                'preflight_hits': self.preflight_hits, 'preflight_misses': self.preflight_misses}
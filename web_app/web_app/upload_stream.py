@@ -0,0 +1,75 @@
+"""
+Helpers for writing request bodies straight to disk.
+
+The body is read from the WSGI input stream in large chunks and hashed while
+it is written, so a multi-GB upload is never held in memory and never has to
+be read back just to checksum it.
+"""
+import os
+import time
+import uuid
+import hashlib
+
+CHUNK_SIZE = 1024 * 1024  # 1 MB reads keep syscalls low without holding much memory
+
+
+def stream_to_file(stream, path, chunk_size=CHUNK_SIZE, append=False, hasher=None, limit=None, fsync=True):
+    """
+    Copy stream into path, at most limit bytes if given.
+    Returns (bytes_written, hasher, seconds). The sha256 hasher can be passed in
+    to continue a digest across several calls.
+    """
+    if hasher is None:
+        hasher = hashlib.sha256()
+    written = 0
+    start = time.time()
+    with open(path, 'ab' if append else 'wb') as f:
+        while True:
+            to_read = chunk_size if limit is None else min(chunk_size, limit - written)
+            if to_read <= 0:
+                break
+            chunk = stream.read(to_read)
+            if not chunk:
+                break
+            f.write(chunk)
+            hasher.update(chunk)
+            written += len(chunk)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    return written, hasher, time.time() - start
+
+
+def save_stream_atomic(stream, path, chunk_size=CHUNK_SIZE, expected_sha256=None, fsync=True, expected_length=None):
+    """
+    Write stream to path via a unique .part file in the same folder that only
+    replaces path once the whole body arrived (expected_length bytes, if given)
+    and matched expected_sha256, if given. Otherwise ValueError is raised and
+    any existing file at path is left as it was. Replacing rather than rewriting
+    path also leaves other hardlinks to it untouched.
+    Returns (bytes_written, sha256_hex, seconds).
+    """
+    part_path = f"{path}.{uuid.uuid4().hex}.part"
+    # Unlike mkstemp (always 0600), this gives the file the umask's mode, so other readers can serve it
+    open(part_path, 'xb').close()
+    try:
+        written, hasher, duration = stream_to_file(stream, part_path, chunk_size, fsync=fsync)
+        if expected_length is not None and written != expected_length:
+            raise ValueError(f"Incomplete upload: expected {expected_length} bytes, got {written}")
+        digest = hasher.hexdigest()
+        if expected_sha256 and expected_sha256.lower() != digest:
+            raise ValueError(f"Checksum mismatch: expected {expected_sha256}, got {digest}")
+        os.replace(part_path, path)
+        return written, digest, duration
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+
+
+def throughput_stats(size, duration):
+    size_mb = size / (1024 * 1024)
+    return {
+        'size': size,
+        'duration': round(duration, 3),
+        'mb_per_sec': round(size_mb / duration, 2) if duration > 0 else None,
+    }
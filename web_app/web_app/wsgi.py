@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Production server: several worker processes, each serving requests on a pool of threads.
+
+    python wsgi.py                                         # gunicorn, or waitress where gunicorn can't run (Windows)
+    WEB_WORKERS=4 gunicorn -k gthread -w 4 --threads 8 -b 0.0.0.0:5000 'app:create_app()'
+    waitress-serve --threads 32 --port 5000 --call app:create_app
+
+WEB_WORKERS and WEB_THREADS set the process and thread counts, WEB_BIND the address.
+Synchronous conversions, /events streams and yt downloads hold a thread for as long
+as they run, hence threaded workers and a long timeout.
+
+Every worker process starts its own converter pool, sized by default to its share of
+the cores (CONVERTER_WORKERS = cores / WEB_WORKERS). python wsgi.py builds the scheduler
+(converter/scheduler.py) before forking, so all workers keep to one core budget; the
+plain gunicorn command line gives each worker its own, so set CONVERTER_CORES to the
+per-worker share there. Results and job status are shared through store.py; progress
+channels and yt downloads live in the process that started them.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+WORKERS = int(os.environ.get('WEB_WORKERS', min(4, os.cpu_count() or 2)))
+THREADS = int(os.environ.get('WEB_THREADS', 8))
+BIND = os.environ.get('WEB_BIND', '0.0.0.0:5000')
+TIMEOUT = int(os.environ.get('WEB_TIMEOUT', 3600))  # seconds a request may take, conversions included
+
+
+def serve_gunicorn(bind=BIND, workers=WORKERS, threads=THREADS):
+    from gunicorn.app.base import BaseApplication
+    # Read when jobs.py is imported, to size each worker's converter pool
+    os.environ['WEB_WORKERS'] = str(workers)
+    from app import create_app
+    from converter import scheduler
+    # Semaphores created before the fork are shared by all workers: one core budget for the machine
+    scheduler.get_scheduler()
+
+    class Server(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', bind)
+            self.cfg.set('workers', workers)
+            self.cfg.set('threads', threads)
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('timeout', TIMEOUT)
+
+        def load(self):
+            # Built in each worker after the fork; only the scheduler above is shared
+            return create_app()
+
+    Server().run()
+
+
+def serve_waitress(bind=BIND, threads=WORKERS * THREADS):
+    from waitress import serve
+    from app import create_app
+    host, port = bind.rsplit(':', 1)
+    serve(create_app(), host=host, port=int(port), threads=threads, channel_timeout=TIMEOUT)
+
+
+def main():
+    try:
+        serve_gunicorn()
+    except ImportError:  # gunicorn needs fcntl, so not on Windows
+        serve_waitress()
+
+
+if __name__ == '__main__':
+    main()
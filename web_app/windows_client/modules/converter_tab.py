@@ -4,6 +4,7 @@ import time
 import socket
 import subprocess
 import re
+import logging
 import yt_dlp
 from PySide6.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, 
@@ -16,6 +17,12 @@ from datetime import datetime
 from youtube_transcript_api import YouTubeTranscriptApi
 from PIL import Image  # <-- Add PIL import for local image processing
 
+logger = logging.getLogger(__name__)
+
+# Longest wait for the result of an async conversion job once its progress stream ends
+RESULT_WAIT = 3600
+
+
 def get_wifi_ip_address():
     """
     Automatically detect the WiFi IP address of the current machine.
@@ -116,12 +123,16 @@ class ConverterWorker(QThread):
             file_obj = FileWithProgress(file_path, progress_callback, lambda: self._cancel_requested)
             files = {'file': (file_path, file_obj)}
             try:
-                resp = requests.post(self.server, files=files, data=self.data, timeout=3600)
+                # Ask for a job id instead of a blocking response, so conversion progress can be shown
+                resp = requests.post(self.server, files=files, data=self.data, timeout=3600,
+                                     headers={'Prefer': 'respond-async'})
                 file_obj.close()
                 self.file_progress.emit(100, 'upload')
-                # Now show converting phase (indeterminate)
+                # Now show converting phase (indeterminate until the server reports progress)
                 self.progress_update.emit(idx, total, f"Converting: {file_path}", elapsed, est_remaining)
                 self.file_progress.emit(-1, 'convert')  # -1 means indeterminate
+                if resp.status_code == 202:
+                    resp = self._follow_job(resp.json())
                 
                 # Create converted_files directory structure
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -152,6 +163,49 @@ class ConverterWorker(QThread):
                 break
         self.finished.emit(success, fail)
 
+    @staticmethod
+    def _event_percent(event):
+        """Percent done from a server progress event, or None if it has no measure"""
+        if 'percent' in event:
+            return event['percent']
+        if event.get('pages'):
+            return 100 * event.get('page', 0) / event['pages']
+        if event.get('total'):
+            done = event.get('members', event.get('done', 0))
+            return 100 * done / event['total']
+        return None
+
+    def _follow_job(self, job):
+        """Show the progress events of an async conversion job, then download its result"""
+        import json
+        import requests
+        from urllib.parse import urljoin
+        try:
+            with requests.get(urljoin(self.server, f"/events/{job['job_id']}"), stream=True, timeout=(10, 60)) as events:
+                for line in events.iter_lines(decode_unicode=True):
+                    if self._cancel_requested:
+                        break
+                    if not line or not line.startswith('data: '):
+                        continue
+                    event = json.loads(line[len('data: '):])
+                    percent = self._event_percent(event)
+                    if percent is not None:
+                        self.file_progress.emit(int(percent), 'convert')
+                    if event.get('status') in ('done', 'failed'):
+                        break
+        except (requests.RequestException, ValueError) as e:
+            logger.warning(f"Progress stream unavailable, waiting for the result: {e}")
+        result_url = urljoin(self.server, job['result_url'])
+        deadline = time.monotonic() + RESULT_WAIT
+        while True:
+            resp = requests.get(result_url, timeout=3600)
+            # 409: still running (the event stream ended early)
+            if resp.status_code != 409 or self._cancel_requested:
+                return resp
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"no result from the server after {RESULT_WAIT}s")
+            time.sleep(1)
+
     def _get_conversion_folder(self):
         """Get the appropriate folder name for the conversion type"""
         conversion_map = {
@@ -1572,9 +1626,14 @@ class ConverterTab(QWidget):
             self.file_progress.setValue(percent)
             self.phase_label.setText('Uploading...')
         elif phase == 'convert':
-            self.file_progress.setMaximum(0)  # Indeterminate
             self.file_progress.setMinimum(0)
-            self.file_progress.setFormat('')
+            if percent < 0:
+                self.file_progress.setMaximum(0)  # Indeterminate
+                self.file_progress.setFormat('')
+            else:
+                self.file_progress.setMaximum(100)
+                self.file_progress.setFormat('%p%')
+                self.file_progress.setValue(percent)
             self.phase_label.setText('Converting...')
 
     def on_file_result(self, file_path, result):